@@ -2,12 +2,35 @@ import numpy as np
 from hampy import detect_markers
 
 import nao.data as nao
-from nao.controller.motion import MotionController
+from ai.motion.samples import SampleWriter
+from nao.controller.arm_table import fit_arm_table
+from nao.controller.motion import MotionController, LARM_JOINTS
 from nao.controller.video import VideoController
 from utils.camera import geom
 
 __author__ = 'Anthony Rouneau'
 
+# The directory of the samples of the learning (see SampleWriter)
+SAMPLES_DIRECTORY = "../../values/learning"
+# The positions of the left hand placed above the holes, followed by the angles of the left arm (see LARM_JOINTS)
+ARM_SAMPLES_FILE = "../../values/learning/left_arm_samples"
+ARM_TABLE_FILE = "../../values/learning/left_arm_table.npz"
+
+
+def build_arm_table(samples_file=ARM_SAMPLES_FILE, table_file=ARM_TABLE_FILE):
+    """
+    :param samples_file: the file of the samples recorded by Connect4Learning
+    :type samples_file: str
+    :param table_file: the file in which the table is written (see MotionController's arm_table_file)
+    :type table_file: str
+    :return: the table fitted on the samples
+    :rtype: ArmLookupTable
+    """
+    samples = np.loadtxt(samples_file, delimiter=",", ndmin=2)
+    table = fit_arm_table(samples, LARM_JOINTS)
+    table.save(table_file)
+    return table
+
 
 class Connect4Learning(object):
     """
@@ -27,36 +50,19 @@ class Connect4Learning(object):
         self.nao_video = VideoController(robot_ip=robot_ip, robot_port=robot_port)
         self.nao_video.connectToCamera(res=2, fps=30, camera_num=1, subscriber_id="C4Learning")
         self.left_arm_angles = []
+        self.left_hand_position = []
         self.min_head_pitch = 0.
         self.max_head_pitch = 0.
         self.min_head_yaw = 0.
         self.max_head_yaw = 0.
         self.selected_hole = 0
-        self.shoulder_pitch_array = []
-        self.shoulder_pitch_file = None
-        self.shoulder_roll_array = []
-        self.shoulder_roll_file = None
-        self.elbow_yaw_array = []
-        self.elbow_yaw_file = None
-        self.elbow_roll_array = []
-        self.elbow_roll_file = None
-        self.wrist_yaw_array = []
-        self.wrist_yaw_file = None
+        self.samples = None
 
     def openFiles(self):
         """
-        Open the data files
+        Open the writer of the samples of the session
         """
-        self.shoulder_pitch_array = []
-        self.shoulder_pitch_file = open("../../values/learning/shoulder_pitch", 'a')
-        self.shoulder_roll_array = []
-        self.shoulder_roll_file = open("../../values/learning/shoulder_roll", 'a')
-        self.elbow_yaw_array = []
-        self.elbow_yaw_file = open("../../values/learning/shoulder_yaw", 'a')
-        self.elbow_roll_array = []
-        self.elbow_roll_file = open("../../values/learning/shoulder_roll", 'a')
-        self.wrist_yaw_array = []
-        self.wrist_yaw_file = open("../../values/learning/wrist_yaw", 'a')
+        self.samples = SampleWriter(SAMPLES_DIRECTORY)
 
     def waitingNaoPosition(self):
         """
@@ -64,6 +70,8 @@ class Connect4Learning(object):
         """
         raw_input("Please place NAO's left arm in the perfect position and press Enter")
         self.left_arm_angles = self.nao_motion.getLeftArmAngles()
+        self.left_hand_position = self.nao_motion.getLeftHandPosition()
+        self.recordArmSample()
         self.selected_hole = int(raw_input("Enter the index of the selected hole, [0, 6]: "))
         self.min_head_yaw = float(raw_input("Enter the min head yaw in degrees: "))
         self.max_head_yaw = float(raw_input("Enter the max head yaw in degrees: "))
@@ -71,6 +79,15 @@ class Connect4Learning(object):
         self.max_head_pitch = float(raw_input("Enter the max head pitch in degrees: "))
         self.openFiles()
 
+    def recordArmSample(self):
+        """
+        Append the position of the left hand placed above the hole and the angles of the arm to the samples of the
+            arm table (see build_arm_table)
+        """
+        with open(ARM_SAMPLES_FILE, 'a') as samples_file:
+            np.savetxt(samples_file, np.array([list(self.left_hand_position) + list(self.left_arm_angles)]),
+                       delimiter=",")
+
     def learningRoutine(self):
         """
         Move NAO's head and detect the marker corresponding to the wanted hole
@@ -106,40 +123,16 @@ class Connect4Learning(object):
         :type: hampy's Hamming Marker
         :param pitch: the pitch of NAO's head
         :param yaw: the yaw of NAO's head
-        record the result into the lists
+        record the result into the samples of the session
         """
-        # Variables set
-        corners = np.array(geom.sort_rectangle_corners(marker.contours)).ravel().tolist()
-        variables = [pitch, yaw]
-        variables.extend(corners)
-        variables = np.array(variables)
-
-        # Result set
-        self.shoulder_pitch_array.append(np.append(variables, self.left_arm_angles[0]))
-        self.shoulder_roll_array.append(np.append(variables, self.left_arm_angles[1]))
-        self.elbow_yaw_array.append(np.append(variables, self.left_arm_angles[2]))
-        self.elbow_roll_array.append(np.append(variables, self.left_arm_angles[3]))
-        self.wrist_yaw_array.append(np.append(variables, self.left_arm_angles[4]))
+        corners = geom.sort_rectangle_corners(marker.contours)
+        self.samples.append(self.selected_hole, pitch, yaw, corners, self.left_arm_angles)
 
     def writeInFile(self):
         """
-        Write the results in different files
-        """
-        np.savetxt(self.shoulder_pitch_file, np.array(self.shoulder_pitch_array), delimiter=",")
-        self.shoulder_pitch_file.close()
-        self.shoulder_pitch_array = []
-        np.savetxt(self.shoulder_roll_file, np.array(self.shoulder_roll_array), delimiter=",")
-        self.shoulder_roll_file.close()
-        self.shoulder_roll_array = []
-        np.savetxt(self.elbow_yaw_file, np.array(self.elbow_yaw_array), delimiter=",")
-        self.elbow_yaw_file.close()
-        self.elbow_yaw_array = []
-        np.savetxt(self.elbow_roll_file, np.array(self.elbow_roll_array), delimiter=",")
-        self.elbow_roll_file.close()
-        self.elbow_roll_array = []
-        np.savetxt(self.wrist_yaw_file, np.array(self.wrist_yaw_array), delimiter=",")
-        self.wrist_yaw_file.close()
-        self.wrist_yaw_array = []
+        Write the samples of the session that are not written yet (see SampleWriter)
+        """
+        self.samples.flush()
 
     def learn(self):
         """
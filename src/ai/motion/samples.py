@@ -0,0 +1,89 @@
+import glob
+import os
+
+import numpy as np
+
+__author__ = 'Anthony Rouneau'
+
+SAMPLES_PREFIX = "samples_"
+# A sample of the learning : the hole, the pose of the head in degrees, the corners of the marker of the hole in the
+# image (see geom.sort_rectangle_corners) and the angles of the left arm in radians (see LARM_JOINTS)
+SAMPLE_DTYPE = np.dtype([("hole", np.int8),
+                         ("head_pitch", np.float32),
+                         ("head_yaw", np.float32),
+                         ("corners", np.float32, (4, 2)),
+                         ("arm_angles", np.float32, (5,))])
+
+
+def _chunk_firsts(directory):
+    """
+    :return: the index of the first sample of each chunk of the directory, sorted
+    :rtype: list
+    """
+    return sorted(int(os.path.basename(file_name)[len(SAMPLES_PREFIX):-len(".npy")])
+                  for file_name in glob.glob(os.path.join(directory, SAMPLES_PREFIX + "*.npy")))
+
+
+def load_samples(directory):
+    """
+    :param directory: the directory of the chunks written by a SampleWriter
+    :type directory: str
+    :return: the chunks of samples, memory-mapped, in the order they were written
+    :rtype: list
+    """
+    return [np.load(os.path.join(directory, SAMPLES_PREFIX + "%08d.npy" % first), mmap_mode='r')
+            for first in _chunk_firsts(directory)]
+
+
+class SampleWriter(object):
+    """
+    Buffers the samples of the learning in a structured array (see SAMPLE_DTYPE), written in binary chunks :
+        "<directory>/samples_<index of the first sample>.npy". The chunks of the previous sessions are kept.
+    """
+
+    def __init__(self, directory, chunk_size=4096, initial_capacity=256):
+        """
+        :param directory: the directory of the chunks, created if needed
+        :type directory: str
+        :param chunk_size: the maximum number of samples in a chunk
+        :type chunk_size: int
+        :param initial_capacity: the number of samples allocated at first, doubled each time the buffer is full
+        :type initial_capacity: int
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.nb_of_samples = sum(len(chunk) for chunk in load_samples(directory))
+        self._buffer = np.empty(min(initial_capacity, chunk_size), dtype=SAMPLE_DTYPE)
+        self._buffered = 0
+
+    def append(self, hole, head_pitch, head_yaw, corners, arm_angles):
+        """
+        :param hole: the index of the hole, [0, 6]
+        :type hole: int
+        :param head_pitch: the pitch of NAO's head, in degrees
+        :type head_pitch: float
+        :param head_yaw: the yaw of NAO's head, in degrees
+        :type head_yaw: float
+        :param corners: the four corners (x, y) of the marker of the hole in the image
+        :type corners: list
+        :param arm_angles: the angles of the left arm (see LARM_JOINTS)
+        :type arm_angles: list
+        """
+        if self._buffered == len(self._buffer):
+            self._buffer = np.resize(self._buffer, min(2 * len(self._buffer), self.chunk_size))
+        self._buffer[self._buffered] = (hole, head_pitch, head_yaw, np.reshape(corners, (4, 2)), arm_angles)
+        self._buffered += 1
+        self.nb_of_samples += 1
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the samples that are not written yet in a new chunk
+        """
+        if self._buffered > 0:
+            first = self.nb_of_samples - self._buffered
+            np.save(os.path.join(self.directory, SAMPLES_PREFIX + "%08d.npy" % first), self._buffer[:self._buffered])
+            self._buffered = 0
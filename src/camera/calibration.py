@@ -1,7 +1,8 @@
 import time
 
+from camera import dataset
+from camera.calibration_engine import CalibrationEngine, best_values
 from connect4.connect4handler import *
-from connect4.detector import front_holes as c4
 from nao import data
 from nao.controller.motion import MotionController
 from nao.controller.video import VideoController
@@ -26,7 +27,6 @@ connect4 = Connect4Handler(get_nao_image)
 # connect4 = None
 connect4_model = connect4.model
 # connect4_model = None
-detector = c4.FrontHolesDetector(connect4_model)
 nao_video = None
 nao_motion = None
 
@@ -139,267 +139,194 @@ def get_camera_information():
     return mtx, disto
 
 
-def get_f_score(nb_grid_circles, nb_noise_circles):
-    total_circles = float((nb_grid_circles + nb_noise_circles))
-    if total_circles == 0 or nb_grid_circles == 0:
-        return 0
-    recall = float(nb_grid_circles) / total_circles
-    precision = float(nb_grid_circles) / 42.0
-    return (2 * precision * recall) / (precision + recall)
-
-
-def calibration_param2(dist, images, must_latex=True):
-    global detector, connect4
+def calibration_param2(dist, images, must_latex=True, engine=None):
+    """
+    :param dist: the distance between the robot and the Connect 4 on the images, in meters
+    :type dist: float
+    :param images: the images on which the detection is evaluated
+    :type images: list
+    :param must_latex: if True, a LaTeX table of the results is generated for each image
+    :type must_latex: bool
+    :param engine: the engine to use, that caches the preprocessed images. If None, a new one is created
+    :type engine: CalibrationEngine
+    :return: the best values of param2 for each image
+    :rtype: list
+    """
     titles = ["\\texttt{param2}", "Grid circles", "Noise circles",
               "Total", "Score"]
-    results = []
-    counter = 0
+    if engine is None:
+        engine = CalibrationEngine(images)
     max_radius = connect4.estimateMaxRadius(dist)
     min_radius = connect4.estimateMinRadius(dist)
     max_error = connect4.computeMaxPixelError(min_radius)
     min_dist = int(min_radius * 1.195)
     param1 = 60
-
-    for img in images:
-        table = []
-        best_value = []
-        best_score = -1000
-        # how many pixels for a circle radius on a 320x240px image when standing one meter away
-        param2 = 5.
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray = cv2.medianBlur(gray, 3)
-        while param2 < 17:
-            circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, min_dist, param1=param1, param2=param2,
-                                       minRadius=min_radius, maxRadius=max_radius)
-            if circles is None:
-                nb_of_grid_circles = 0
-                circles = [[]]
-            else:
-                try:
-                    detector.runDetection(circles[0], pixel_error_margin=max_error)
-                    nb_of_grid_circles = len(detector.relativeCoordinates)
-                except c4.CircleGridNotFoundException:
-                    nb_of_grid_circles = 0
-            score = round(get_f_score(nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles), 4)
-            if score > best_score:
-                best_score = score
-                best_value = [param2]
-            elif abs(score - best_score) < 0.00001:
-                best_value.append(param2)
-            line = [param2, nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles, len(circles[0]), score]
-            table.append(line)
-            param2 += 0.25
-        results.append(best_value)
-        print "radius : image " + str(counter) + " finished"
+    results_table = engine.sweep([param1], np.arange(5., 17., 0.25), [(min_radius, max_radius, min_dist, max_error)])
+    results = []
+    for counter in range(len(engine.grays)):
+        image_results = results_table[results_table['image'] == counter]
+        results.append(best_values(image_results, 'param2'))
         if must_latex:
+            table = image_results[['param2', 'grid_circles', 'noise_circles', 'total', 'score']].tolist()
             latex_generator.generate_longtable(titles, "../../latex/generated_radius_" +
                                                str(dist) + "_" + str(counter), table)
-        counter += 1
     return results
 
 
-def plotting_param2(dist, images):
-    global detector, connect4
-    results = {}
-    counter = 0
+def plotting_param2(dist, images, engine=None):
+    """
+    :param dist: the distance between the robot and the Connect 4 on the images, in meters
+    :type dist: float
+    :param images: the images on which the detection is evaluated
+    :type images: list
+    :param engine: the engine to use, that caches the preprocessed images. If None, a new one is created
+    :type engine: CalibrationEngine
+    :return: the scores of each image, for each value of param2
+    :rtype: dict
+    """
+    if engine is None:
+        engine = CalibrationEngine(images)
     max_radius = connect4.estimateMaxRadius(dist)
     min_radius = connect4.estimateMinRadius(dist)
     max_error = connect4.computeMaxPixelError(min_radius)
     min_dist = int(min_radius * 1.195)
     param1 = 60
-
-    for img in images:
-        # how many pixels for a circle radius on a 320x240px image when standing one meter away
-        param2 = 5.
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray = cv2.medianBlur(gray, 3)
-        while param2 < 17:
-            circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, min_dist, param1=param1, param2=param2,
-                                       minRadius=min_radius, maxRadius=max_radius)
-            if circles is None:
-                nb_of_grid_circles = 0
-                circles = [[]]
-                score = 0
-            else:
-                # circles = np.uint16(np.around(circles))
-                try:
-                    detector.runDetection(circles[0], pixel_error_margin=max_error)
-                    nb_of_grid_circles = len(detector.relativeCoordinates)
-                    score = round(get_f_score(nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles), 4)
-                except c4.CircleGridNotFoundException:
-                    score = 0
-                    nb_of_grid_circles = 0
-
-            param2 += 0.25
-            key = str(round(param2, 2))
-            if key in results:
-                results[key].append(score)
-            else:
-                results[key] = [score]
-        print "param2 : image " + str(counter) + " finished"
-        counter += 1
+    results_table = engine.sweep([param1], np.arange(5., 17., 0.25), [(min_radius, max_radius, min_dist, max_error)])
+    results = {}
+    for row in results_table:
+        results.setdefault(str(round(row['param2'], 2)), []).append(row['score'])
     return results
 
 
-def calibration_param1(dist, images, must_latex=True):
-    global detector, connect4
+def calibration_param1(dist, images, must_latex=True, engine=None):
+    """
+    :param dist: the distance between the robot and the Connect 4 on the images, in meters
+    :type dist: float
+    :param images: the images on which the detection is evaluated
+    :type images: list
+    :param must_latex: if True, a LaTeX table of the results is generated for each image
+    :type must_latex: bool
+    :param engine: the engine to use, that caches the preprocessed images. If None, a new one is created
+    :type engine: CalibrationEngine
+    :return: the best values of param1 for each image
+    :rtype: list
+    """
     titles = ["\\texttt{param1}", "Grid circles", "Noise circles",
               "Total", "Score"]
-    results = []
-    counter = 0
+    if engine is None:
+        engine = CalibrationEngine(images)
     min_radius = connect4.estimateMinRadius(dist)
     max_radius = connect4.estimateMaxRadius(dist)
     max_error = connect4.computeMaxPixelError(min_radius)
     min_dist = int(min_radius * 1.195)
     param2 = 10.5
-    for img in images:
-        table = []
-        best_value = []
-        best_score = 0
-        # how many pixels for a circle radius on a 320x240px image when standing one meter away
-        param1 = 30
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray = cv2.medianBlur(gray, 3)
-        while param1 < 200:
-            circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, min_dist, param1=param1, param2=param2,
-                                       minRadius=min_radius, maxRadius=max_radius)
-            if circles is None:
-                score = 0
-                nb_of_grid_circles = 0
-                circles = [[]]
-            else:
-                try:
-                    detector.runDetection(circles[0], pixel_error_margin=max_error)
-                    nb_of_grid_circles = len(detector.relativeCoordinates)
-                    score = round(get_f_score(nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles), 4)
-                except c4.CircleGridNotFoundException:
-                    score = 0
-                    nb_of_grid_circles = 0
-                if score > best_score:
-                    best_score = score
-                    best_value = [param1]
-                elif abs(score - best_score) < 0.00001:
-                    best_value.append(param1)
-            line = [param1, nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles, len(circles[0]), score]
-            table.append(line)
-            param1 += 1
-        results.append(best_value)
-        print "param1 : image " + str(counter) + " finished"
+    results_table = engine.sweep(range(30, 200), [param2], [(min_radius, max_radius, min_dist, max_error)])
+    results = []
+    for counter in range(len(engine.grays)):
+        image_results = results_table[results_table['image'] == counter]
+        results.append([int(value) for value in best_values(image_results, 'param1', only_detected=True)])
         if must_latex:
+            table = [[int(line[0])] + list(line[1:])
+                     for line in image_results[['param1', 'grid_circles', 'noise_circles', 'total', 'score']].tolist()]
             latex_generator.generate_longtable(titles, "../../latex/generated_param1_" +
                                                str(dist) + "_" + str(counter), table)
-        counter += 1
     return results
 
 
-def plotting_param1(dist, images):
-    global detector, connect4
-    results = {}
-    counter = 0
+def plotting_param1(dist, images, engine=None):
+    """
+    :param dist: the distance between the robot and the Connect 4 on the images, in meters
+    :type dist: float
+    :param images: the images on which the detection is evaluated
+    :type images: list
+    :param engine: the engine to use, that caches the preprocessed images. If None, a new one is created
+    :type engine: CalibrationEngine
+    :return: the scores of each image, for each value of param1
+    :rtype: dict
+    """
+    if engine is None:
+        engine = CalibrationEngine(images)
     min_radius = connect4.estimateMinRadius(dist)
     max_radius = connect4.estimateMaxRadius(dist)
     max_error = connect4.computeMaxPixelError(min_radius)
     min_dist = int(min_radius * 1.195)
     param2 = 10.5
-    for img in images:
-        best_score = -1
-        # how many pixels for a circle radius on a 320x240px image when standing one meter away
-        param1 = 30
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray = cv2.medianBlur(gray, 3)
-        while param1 < 200:
-            circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, min_dist, param1=param1, param2=param2,
-                                       minRadius=min_radius, maxRadius=max_radius)
-            if circles is None:
-                score = 0
-                nb_of_grid_circles = 0
-                circles = [[]]
-            else:
-                try:
-                    detector.runDetection(circles[0], pixel_error_margin=max_error)
-                    nb_of_grid_circles = len(detector.relativeCoordinates)
-                    score = round(get_f_score(nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles), 4)
-                except c4.CircleGridNotFoundException:
-                    score = 0
-                    nb_of_grid_circles = 0
-                else:
-                    score = round(get_f_score(nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles), 4)
-
-            param1 += 1
-            if param1 in results:
-                results[param1].append(score)
-            else:
-                results[param1] = [score]
-        print "param1 : image " + str(counter) + " finished"
-        counter += 1
+    results_table = engine.sweep(range(30, 200), [param2], [(min_radius, max_radius, min_dist, max_error)])
+    results = {}
+    for row in results_table:
+        results.setdefault(int(row['param1']), []).append(row['score'])
     return results
 
 
-def calibration_radius_error(dist, images, must_latex=True):
-    global detector, connect4
+def calibration_radius_error(dist, images, must_latex=True, engine=None):
+    """
+    :param dist: the distance between the robot and the Connect 4 on the images, in meters
+    :type dist: float
+    :param images: the images on which the detection is evaluated
+    :type images: list
+    :param must_latex: if True, a LaTeX table of the results is generated for each image
+    :type must_latex: bool
+    :param engine: the engine to use, that caches the preprocessed images. If None, a new one is created
+    :type engine: CalibrationEngine
+    :return: the best (min_radius, max_radius) for each image
+    :rtype: list
+    """
     titles = ["\\texttt{minRadius}", "\\texttt{maxRadius}", "\\texttt{minDist}", "Grid circles", "Noise circles",
               "Total", "Score"]
-    results = []
-    counter = 0
+    if engine is None:
+        engine = CalibrationEngine(images)
     factor = 3.0 * dist
-    for img in images:
-        table = []
-        best_score = -1000
-        # how many pixels for a circle radius on a 320x240px image when standing one meter away
-        one_meter_value = 6
-        best_value = []
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (3, 3), 0)
-        gray = cv2.medianBlur(gray, 3)
-        while one_meter_value < 8:
-            dist_value = int(round(one_meter_value / dist))
-            upper_bound = (dist_value + 1)
-            while upper_bound < (factor * one_meter_value) / dist:
-                lower_bound = (dist_value - 1)
-                while lower_bound > (one_meter_value / factor) / dist:
-                    min_radius = int(lower_bound)
-                    max_radius = int(upper_bound)
-                    max_error = connect4.computeMaxPixelError(min_radius)
-                    min_dist = round(lower_bound * 1.125, 2)
-                    circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, min_dist, param1=48, param2=10.5,
-                                               minRadius=min_radius, maxRadius=max_radius)
-                    if circles is None:
-                        score = 0
-                        nb_of_grid_circles = 0
-                        circles = [[]]
-                    else:
-                        # circles = np.uint16(np.around(circles))
-                        try:
-                            detector.runDetection(circles[0], pixel_error_margin=max_error)
-                            nb_of_grid_circles = len(detector.relativeCoordinates)
-                            score = round(get_f_score(nb_of_grid_circles, len(circles[0]) - nb_of_grid_circles), 4)
-                        except c4.CircleGridNotFoundException:
-                            score = 0
-                            nb_of_grid_circles = 0
-                        if score > best_score:
-                            best_score = score
-                            best_value = [(min_radius, max_radius)]
-                        elif abs(score - best_score) < 0.00001:
-                            best_value.append((min_radius, max_radius))
-                    line = [lower_bound, upper_bound, min_dist, nb_of_grid_circles,
-                            len(circles[0]) - nb_of_grid_circles, len(circles[0]), score]
-                    table.append(line)
-                    lower_bound -= 1
-                upper_bound += 1
-            one_meter_value += 1
-        print "radius : image " + str(counter) + " finished"
-        results.append(best_value)
+    radius_values = []
+    # how many pixels for a circle radius on a 320x240px image when standing one meter away
+    for one_meter_value in range(6, 8):
+        dist_value = int(round(one_meter_value / dist))
+        upper_bound = (dist_value + 1)
+        while upper_bound < (factor * one_meter_value) / dist:
+            lower_bound = (dist_value - 1)
+            while lower_bound > (one_meter_value / factor) / dist:
+                radius_values.append((lower_bound, upper_bound, round(lower_bound * 1.125, 2),
+                                      connect4.computeMaxPixelError(lower_bound)))
+                lower_bound -= 1
+            upper_bound += 1
+    results_table = engine.sweep([48], [10.5], radius_values)
+    results = []
+    for counter in range(len(engine.grays)):
+        image_results = results_table[results_table['image'] == counter]
+        results.append(best_values(image_results, ['min_radius', 'max_radius'], only_detected=True))
         if must_latex:
+            table = image_results[['min_radius', 'max_radius', 'min_dist', 'grid_circles', 'noise_circles',
+                                   'total', 'score']].tolist()
             latex_generator.generate_longtable(titles, "../../latex/generated_radius_" +
                                                str(dist) + "_" + str(counter), table)
-        counter += 1
     return results
 
 
+def auto_tune(dist, images, sloped=False, file_name="../../values/hough_parameters.json", engine=None):
+    """
+    :param dist: the distance between the robot and the Connect 4 on the images, in meters
+    :type dist: float
+    :param images: the images on which the detection is evaluated, the whole Connect 4 must be visible on each one
+    :type images: list
+    :param sloped: True if the Connect 4 is sloped on the images
+    :type sloped: bool
+    :param file_name: the JSON file in which the tuned parameters are saved for this distance
+    :type file_name: str
+    :param engine: the engine to use, that caches the preprocessed images. If None, a new one is created
+    :type engine: CalibrationEngine
+    :return: ((param1, param2, min_dist_factor), score) : the best parameters found and their mean F-score
+    :rtype: tuple
+    Tune the HoughCircles parameters for a distance (see CalibrationEngine.coarseToFine)
+        and save them so that the Connect4Handler can load them.
+    """
+    if engine is None:
+        engine = CalibrationEngine(images)
+    min_radius, max_radius = connect4.computeMinMaxRadius(dist, sloped)
+    max_error = connect4.computeMaxPixelError(min_radius)
+    (param1, param2, min_dist_factor), score = engine.coarseToFine(min_radius, max_radius, max_error)
+    save_hough_parameters(file_name, dist, sloped, param1, param2, min_dist_factor, score)
+    return (param1, param2, min_dist_factor), score
+
+
 def get_images(dist):
     global nao_video
     nao_video = VideoController()
@@ -434,14 +361,30 @@ def evaluate(best_values, param, dist):
     return best_values
 
 
+def get_image_files(dist, nb_images=40):
+    return ["../../latex/img/" + str(dist) + "m/img_" + str(i) + ".png" for i in range(nb_images)]
+
+
 def load_images(dist):
     images = []
-    for i in range(40):
-        filename = "../../latex/img/" + str(dist) + "m/img_" + str(i) + ".png"
+    for filename in get_image_files(dist):
         images.append(cv2.imread(filename))
     return images
 
 
+def load_engine(dist, processes=None):
+    """
+    :param dist: the distance of the images to load, in meters
+    :type dist: float
+    :param processes: the number of worker processes of the engine (see CalibrationEngine)
+    :type processes: int
+    :return: an engine on the preprocessed images of the distance, taken from the dataset cache
+    :rtype: CalibrationEngine
+    """
+    grays = dataset.load_cache(get_image_files(dist), "../../latex/img/" + str(dist) + "m/preprocessed")
+    return CalibrationEngine(grays, processes=processes, preprocessed=True)
+
+
 def prepare_plot(scores, param_name):
     data_file = open("../../plot/" + param_name + ".dat", 'w')
     big_dict = {}
@@ -468,6 +411,7 @@ if __name__ == "__main__":
     # for dist in dists:
     # print "-" * 20 + str(dist) + "-" * 20
     # image = load_images(dist)
+    # engine = load_engine(dist)
     # print evaluate(calibration_radius_error(dist, image), "(minRadius, maxRadius)", dist)
     # print evaluate(calibration_param1(dist, image), "param1", dist)
     # print evaluate(calibration_param2(dist, image), "param2", dist)
@@ -475,6 +419,7 @@ if __name__ == "__main__":
     # scores2.append(plotting_param2(dist, image))
     # prepare_plot(scores1, "param1")
     # prepare_plot(scores2, "param2")
+    # print auto_tune(dist, image)
     camera_file = open("../../values/" + "camera_information" + ".dat", 'w')
     cam_mat, cam_disto = get_camera_information()
     camera_file.write(str(cam_mat) + "\n\n" + str(cam_disto))
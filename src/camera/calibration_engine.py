@@ -0,0 +1,245 @@
+import itertools
+import multiprocessing
+
+import cv2
+import numpy as np
+
+from connect4.detector.front_holes import FrontHolesDetector
+from connect4.model.default_model import DefaultModel
+from utils.camera.circle_grid_detector import CircleGridNotFoundException
+from utils.camera.frame import as_frame
+
+__author__ = 'Anthony Rouneau'
+
+# The parameters of one HoughCircles run on one image
+TASK_DTYPE = np.dtype([('image', np.int32), ('param1', np.float64), ('param2', np.float64),
+                       ('min_radius', np.int32), ('max_radius', np.int32), ('min_dist', np.float64),
+                       ('max_error', np.float64)])
+
+# The parameters of one HoughCircles run on one image, followed by the result of the front holes detection
+RESULT_DTYPE = np.dtype(TASK_DTYPE.descr + [('grid_circles', np.int32), ('noise_circles', np.int32),
+                                            ('total', np.int32), ('score', np.float64)])
+
+# The state of a worker process, set once by _init_worker
+_worker_grays = None
+_worker_detector = None
+
+
+def preprocess(img):
+    """
+    :param img: the BGR image (or the frame) to prepare for the circle detection
+    :type img: np.ndarray
+    :return: the blurred grayscale image, as used by the front holes detection
+    :rtype: np.ndarray
+    """
+    return as_frame(img).getBlurredGray()
+
+
+def get_f_score(nb_grid_circles, nb_noise_circles):
+    total_circles = float((nb_grid_circles + nb_noise_circles))
+    if total_circles == 0 or nb_grid_circles == 0:
+        return 0
+    recall = float(nb_grid_circles) / total_circles
+    precision = float(nb_grid_circles) / 42.0
+    return (2 * precision * recall) / (precision + recall)
+
+
+def _init_worker(grays):
+    """
+    :param grays: the preprocessed images on which the tasks will be run
+    :type grays: list
+    Give its images and its own detector to a worker
+    """
+    global _worker_grays, _worker_detector
+    _worker_grays = grays
+    _worker_detector = FrontHolesDetector(DefaultModel())
+
+
+def _evaluate(task):
+    """
+    :param task: (image, param1, param2, min_radius, max_radius, min_dist, max_error)
+    :type task: tuple
+    :return: (grid_circles, noise_circles, total, score)
+    :rtype: tuple
+    Run the circle detection, then the front holes detection, with the parameters of the task
+    """
+    (image, param1, param2, min_radius, max_radius, min_dist, max_error) = task
+    circles = cv2.HoughCircles(_worker_grays[image], cv2.HOUGH_GRADIENT, 1, min_dist, param1=param1, param2=param2,
+                               minRadius=min_radius, maxRadius=max_radius)
+    if circles is None:
+        return 0, 0, 0, 0.
+    total = len(circles[0])
+    try:
+        _worker_detector.runDetection(circles[0], pixel_error_margin=max_error)
+        nb_of_grid_circles = len(_worker_detector.getCircleGrid())
+    except CircleGridNotFoundException:
+        nb_of_grid_circles = 0
+    return nb_of_grid_circles, total - nb_of_grid_circles, total, \
+        round(get_f_score(nb_of_grid_circles, total - nb_of_grid_circles), 4)
+
+
+def best_values(results, fields, only_detected=False):
+    """
+    :param results: the rows of a result table (see RESULT_DTYPE)
+    :type results: np.ndarray
+    :param fields: the name of the field (or the list of names of the fields) to return
+    :type fields: str
+    :param only_detected: if True, the rows in which no circle were detected are ignored
+    :type only_detected: bool
+    :return: the values of the fields in the rows that have the best score, in the order of the table
+    :rtype: list
+    """
+    if only_detected:
+        results = results[results['total'] > 0]
+    if len(results) == 0:
+        return []
+    return results[results['score'] == results['score'].max()][fields].tolist()
+
+
+def save_results(results, file_name):
+    """
+    :param results: the table of results (see RESULT_DTYPE)
+    :type results: np.ndarray
+    :param file_name: the name of the file, without extension
+    :type file_name: str
+    Save a result table, so that it can be reloaded with np.load(file_name + ".npy")
+    """
+    np.save(file_name + ".npy", results)
+
+
+class CalibrationEngine(object):
+    """
+    Evaluates the front holes detection on a set of images, for a grid of HoughCircles parameters.
+    Each image is converted and blurred once, and the runs are shared between a pool of processes.
+    """
+
+    def __init__(self, images, processes=None, preprocessed=False):
+        """
+        :param images: the BGR images on which the detection will be evaluated
+        :type images: list
+        :param processes: the number of worker processes. If None, the number of CPUs is used.
+                          If 1, the runs are made in the current process
+        :type processes: int
+        :param preprocessed: True if the images are already preprocessed (see preprocess), e.g. the
+                             memory-mapped array of a dataset cache (see camera.dataset.load_cache)
+        :type preprocessed: bool
+        """
+        if preprocessed:
+            self.grays = images
+        else:
+            self.grays = [preprocess(img) for img in images]
+        self.processes = processes
+        # Results of the tasks already run : task tuple -> (grid_circles, noise_circles, total, score)
+        self._cache = {}
+
+    @staticmethod
+    def buildTasks(images, param1_values, param2_values, radius_values):
+        """
+        :param images: the indices of the images to use
+        :type images: list
+        :param param1_values: the values of HoughCircles "param1" to try
+        :type param1_values: list
+        :param param2_values: the values of HoughCircles "param2" to try
+        :type param2_values: list
+        :param radius_values: the (min_radius, max_radius, min_dist, max_error) to try
+        :type radius_values: list
+        :return: the table of every combination of the parameters (see TASK_DTYPE), ordered by image,
+                 then param1, then param2, then radius values
+        :rtype: np.ndarray
+        """
+        return np.array([(image, param1, param2) + tuple(radius)
+                         for image in images
+                         for param1 in param1_values
+                         for param2 in param2_values
+                         for radius in radius_values], dtype=TASK_DTYPE)
+
+    def run(self, tasks):
+        """
+        :param tasks: the table of the runs to make (see TASK_DTYPE)
+        :type tasks: np.ndarray
+        :return: the table of the results, in the order of the tasks (see RESULT_DTYPE)
+        :rtype: np.ndarray
+        Evaluate the detection for each task. Tasks that have already been run by this engine are not run again.
+        """
+        task_tuples = tasks.tolist()
+        to_run = list(set(task for task in task_tuples if task not in self._cache))
+        if len(to_run) > 0:
+            if self.processes == 1:
+                _init_worker(self.grays)
+                outcomes = map(_evaluate, to_run)
+            else:
+                processes = self.processes if self.processes is not None else multiprocessing.cpu_count()
+                pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self.grays,))
+                try:
+                    outcomes = pool.map(_evaluate, to_run, chunksize=max(1, len(to_run) // (8 * processes)))
+                finally:
+                    pool.close()
+                    pool.join()
+            self._cache.update(zip(to_run, outcomes))
+        return np.array([task + self._cache[task] for task in task_tuples], dtype=RESULT_DTYPE)
+
+    def sweep(self, param1_values, param2_values, radius_values):
+        """
+        :param param1_values: the values of HoughCircles "param1" to try
+        :type param1_values: list
+        :param param2_values: the values of HoughCircles "param2" to try
+        :type param2_values: list
+        :param radius_values: the (min_radius, max_radius, min_dist, max_error) to try
+        :type radius_values: list
+        :return: the table of the results on every image (see RESULT_DTYPE)
+        :rtype: np.ndarray
+        """
+        return self.run(self.buildTasks(range(len(self.grays)), param1_values, param2_values, radius_values))
+
+    def coarseToFine(self, min_radius, max_radius, max_error, param1_values=range(30, 211, 30),
+                     param2_values=range(5, 18, 2), min_dist_factors=(1.2, 1.8, 2.4, 3.0), levels=3, keep=3):
+        """
+        :param min_radius: the minimum radius of the circles to detect
+        :type min_radius: int
+        :param max_radius: the maximum radius of the circles to detect
+        :type max_radius: int
+        :param max_error: the pixel error margin of the front holes detection
+        :type max_error: float
+        :param param1_values: the regularly spaced values of HoughCircles "param1" of the coarse grid
+        :type param1_values: list
+        :param param2_values: the regularly spaced values of HoughCircles "param2" of the coarse grid
+        :type param2_values: list
+        :param min_dist_factors: the regularly spaced values of the coarse grid for the minimum distance between
+                                 two circles, divided by the minimum radius
+        :type min_dist_factors: list
+        :param levels: the number of refinements of the grid
+        :type levels: int
+        :param keep: the number of best candidates refined at each level
+        :type keep: int
+        :return: ((param1, param2, min_dist_factor), score) : the parameters that have the best mean F-score
+                 on the images, and this score
+        :rtype: tuple
+        Search the HoughCircles parameters that maximise the mean F-score of the front holes detection.
+        The coarse grid is evaluated first. Then, at each level, the step of the grid is halved and the
+            neighbours of the best candidates are evaluated.
+        """
+        if len(self.grays) == 0:
+            raise ValueError("The parameters can not be tuned without images")
+        steps = np.array([param1_values[1] - param1_values[0], param2_values[1] - param2_values[0],
+                          min_dist_factors[1] - min_dist_factors[0]], dtype=np.float64)
+        candidates = list(itertools.product(param1_values, param2_values, min_dist_factors))
+        scores = {}  # (param1, param2, min_dist_factor) -> mean score
+        for level in range(levels + 1):
+            new_candidates = []
+            for candidate in candidates:
+                candidate = tuple(round(float(value), 4) for value in candidate)
+                if candidate not in scores and min(candidate) > 0 and candidate not in new_candidates:
+                    new_candidates.append(candidate)
+            if len(new_candidates) > 0:
+                tasks = np.array([(image, param1, param2, min_radius, max_radius, int(min_radius * factor), max_error)
+                                  for (param1, param2, factor) in new_candidates
+                                  for image in range(len(self.grays))], dtype=TASK_DTYPE)
+                mean_scores = self.run(tasks)['score'].reshape(len(new_candidates), -1).mean(axis=1)
+                scores.update(zip(new_candidates, mean_scores))
+            best_candidates = sorted(scores, key=lambda c: (-scores[c], c))[:keep]
+            steps /= 2
+            candidates = [np.array(candidate) + np.array(offset) * steps
+                          for candidate in best_candidates
+                          for offset in itertools.product((-1, 0, 1), repeat=3)]
+        best = min(scores, key=lambda c: (-scores[c], c))
+        return best, scores[best]
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+from camera.calibration_engine import preprocess
+
+__author__ = 'Anthony Rouneau'
+
+
+def file_hash(file_name):
+    """
+    :param file_name: the path of the file to hash
+    :type file_name: str
+    :return: the SHA-1 of the content of the file
+    :rtype: str
+    """
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(1 << 16), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def _file_entry(file_name, sha1=None):
+    """
+    :param file_name: the path of a source image
+    :type file_name: str
+    :param sha1: the hash of the file, computed if None
+    :type sha1: str
+    :return: the manifest entry of the file
+    :rtype: dict
+    """
+    status = os.stat(file_name)
+    if sha1 is None:
+        sha1 = file_hash(file_name)
+    return {"name": os.path.abspath(file_name), "size": status.st_size, "mtime": status.st_mtime, "sha1": sha1}
+
+
+def _check_manifest(manifest, image_files):
+    """
+    :param manifest: the manifest of the cache
+    :type manifest: dict
+    :param image_files: the paths of the source images
+    :type image_files: list
+    :return: the up to date entries of the manifest if the cache has been built from the same images,
+             with the same contents, None otherwise
+    :rtype: list
+    A file whose size and modification time have not changed is not hashed again
+    """
+    entries = manifest.get("files", [])
+    if len(entries) != len(image_files):
+        return None
+    checked_entries = []
+    for entry, file_name in zip(entries, image_files):
+        if entry["name"] != os.path.abspath(file_name) or not os.path.isfile(file_name):
+            return None
+        status = os.stat(file_name)
+        if status.st_size != entry["size"]:
+            return None
+        if status.st_mtime != entry["mtime"]:
+            # The file has been touched, only its content matters
+            sha1 = file_hash(file_name)
+            if sha1 != entry["sha1"]:
+                return None
+            entry = _file_entry(file_name, sha1)
+        checked_entries.append(entry)
+    return checked_entries
+
+
+def build_cache(image_files, cache_name):
+    """
+    :param image_files: the paths of the source images, that must all have the same size
+    :type image_files: list
+    :param cache_name: the path of the cache, without extension. "<cache_name>.npy" will contain the images and
+                       "<cache_name>.json" the manifest of the source images
+    :type cache_name: str
+    :return: the (N, height, width) array of the preprocessed images (see calibration_engine.preprocess)
+    :rtype: np.ndarray
+    Read, preprocess and pack the images into a single file
+    """
+    grays = []
+    for file_name in image_files:
+        img = cv2.imread(file_name)
+        if img is None:
+            raise IOError("Could not read the image " + file_name)
+        grays.append(preprocess(img))
+    if len(set(gray.shape for gray in grays)) > 1:
+        raise ValueError("The images of a dataset must have the same size")
+    grays = np.array(grays, dtype=np.uint8)
+    np.save(cache_name + ".npy", grays)
+    # The manifest is written last, so that an interrupted build is detected
+    with open(cache_name + ".json", 'w') as manifest_file:
+        json.dump({"files": [_file_entry(file_name) for file_name in image_files], "shape": grays.shape},
+                  manifest_file, indent=2)
+    return grays
+
+
+def load_cache(image_files, cache_name):
+    """
+    :param image_files: the paths of the source images, that must all have the same size
+    :type image_files: list
+    :param cache_name: the path of the cache, without extension (see build_cache)
+    :type cache_name: str
+    :return: the (N, height, width) array of the preprocessed images, memory-mapped in read-only mode
+    :rtype: np.ndarray
+    Load the preprocessed images from the cache. The cache is rebuilt if it does not exist
+        or if the source images have changed.
+    The memory-mapped pages are shared by the processes that read them (e.g. the workers of a CalibrationEngine).
+    """
+    manifest = None
+    if os.path.isfile(cache_name + ".json") and os.path.isfile(cache_name + ".npy"):
+        with open(cache_name + ".json") as manifest_file:
+            manifest = json.load(manifest_file)
+    entries = None if manifest is None else _check_manifest(manifest, image_files)
+    if entries is None:
+        build_cache(image_files, cache_name)
+    elif entries != manifest["files"]:
+        # Some files were touched without being modified : their new modification time is kept
+        manifest["files"] = entries
+        with open(cache_name + ".json", 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+    return np.load(cache_name + ".npy", mmap_mode='r')
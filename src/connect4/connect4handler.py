@@ -1,12 +1,18 @@
+import json
+import os
+
 import cv2
 import numpy as np
 from hampy import detect_markers
 
 import utils.camera.geom as geom
 from connect4.connect4tracker import Connect4Tracker
+from detector.pose import PoseEstimator, MIN_CORRESPONDENCES
 from detector.front_holes import FrontHolesDetector, FrontHolesGridNotFoundException
 from detector.upper_hole import UpperHolesDetector, NotEnoughLandmarksException
 from model.default_model import DefaultModel
+from utils.camera.flow import PointFlowTracker
+from utils.camera.frame import as_frame
 
 __author__ = 'Anthony Rouneau'
 
@@ -14,6 +20,10 @@ DEFAULT_RESOLUTION = 320
 
 DEFAULT_MODEL = "DEFAULT_MODEL"
 
+# The HoughCircles parameters used when no tuned parameters are available : (param1, param2, min_dist_factor)
+DEFAULT_HOUGH_PARAMETERS = (77, 9.25, 2.391)
+DEFAULT_SLOPED_HOUGH_PARAMETERS = (77, 8, 2.391)
+
 
 def draw_circles(img, circles):
     img2 = img.copy()
@@ -25,6 +35,53 @@ def draw_circles(img, circles):
     return img2
 
 
+def _slope_key(sloped):
+    return "sloped" if sloped else "straight"
+
+
+def load_hough_parameters(file_name):
+    """
+    :param file_name: the JSON file written by save_hough_parameters
+    :type file_name: str
+    :return: {"straight"|"sloped": {distance: (param1, param2, min_dist_factor)}}
+    :rtype: dict
+    """
+    with open(file_name) as parameters_file:
+        content = json.load(parameters_file)
+    parameters = {}
+    for slope, buckets in content.items():
+        parameters[slope] = {float(distance): (bucket["param1"], bucket["param2"], bucket["min_dist_factor"])
+                             for distance, bucket in buckets.items()}
+    return parameters
+
+
+def save_hough_parameters(file_name, distance, sloped, param1, param2, min_dist_factor, score=None):
+    """
+    :param file_name: the JSON file in which the parameters are stored. Its other distances are kept.
+    :type file_name: str
+    :param distance: the distance between the robot and the board for which the parameters were tuned, in meters
+    :type distance: float
+    :param sloped: True if the parameters were tuned for a sloped board
+    :type sloped: bool
+    :param param1: the HoughCircles "param1"
+    :type param1: float
+    :param param2: the HoughCircles "param2"
+    :type param2: float
+    :param min_dist_factor: the minimum distance between two circles, divided by the minimum radius
+    :type min_dist_factor: float
+    :param score: the F-score reached by these parameters, kept for information
+    :type score: float
+    """
+    content = {}
+    if os.path.isfile(file_name):
+        with open(file_name) as parameters_file:
+            content = json.load(parameters_file)
+    content.setdefault(_slope_key(sloped), {})[str(float(distance))] = {
+        "param1": param1, "param2": param2, "min_dist_factor": min_dist_factor, "score": score}
+    with open(file_name, 'w') as parameters_file:
+        json.dump(content, parameters_file, indent=2, sort_keys=True)
+
+
 class Connect4ModelNotFound(Exception):
     def __init__(self, model_name):
         msg = "The _model " + model_name + " does not exists"
@@ -32,17 +89,23 @@ class Connect4ModelNotFound(Exception):
 
 
 class Connect4Handler(object):
-    def __init__(self, next_img_func, cam_no=-1, model_type=DEFAULT_MODEL):
+    def __init__(self, next_img_func, cam_no=-1, model_type=DEFAULT_MODEL, hough_parameters_file=None):
         if model_type == DEFAULT_MODEL:
             self.model = DefaultModel()
         else:
             raise Connect4ModelNotFound(model_type)
         self.cam_no = cam_no
         self.img = None
+        # The frame of "self.img", that keeps the views of the image computed by the detections
+        self.frame = None
         self.next_img_func = next_img_func
         self.front_hole_detector = FrontHolesDetector(self.model)
         self.upper_hole_detector = UpperHolesDetector(self.model)
         self.tracker = Connect4Tracker(self.model)
+        self.pose_estimator = PoseEstimator()
+        # Follows the corners of the Hamming codes between the frames (see trackUpperHolesCoordinatesUsingMarkers)
+        self.marker_flow = PointFlowTracker()
+        self.marker_flow_object_points = None
         # Used for the detection
         self.front_holes_detection_prepared = False
         self.circles = []
@@ -55,6 +118,10 @@ class Connect4Handler(object):
         self.pixel_error_margin = None
         self.res = 320
         self.distance = None
+        # The tuned HoughCircles parameters, by slope and distance (see load_hough_parameters)
+        self.hough_parameters = {}
+        if hough_parameters_file is not None:
+            self.hough_parameters = load_hough_parameters(hough_parameters_file)
 
     def estimateMinRadius(self, dist):
         """
@@ -131,6 +198,21 @@ class Connect4Handler(object):
         hyp = np.sqrt(hor ** 2 + ver ** 2)
         return 0.9 * hyp
 
+    def getHoughParameters(self, distance, sloped):
+        """
+        :param distance: The distance between the robot and the farthest circle in the Connect 4 grid in meters
+        :type distance: float
+        :param sloped: True if the connect 4 can be considered as sloped for the robot vision
+        :type sloped: bool
+        :return: (param1, param2, min_dist_factor) : the HoughCircles parameters tuned for the closest distance,
+                 or the default ones if no parameters were tuned for this slope
+        :rtype: tuple
+        """
+        buckets = self.hough_parameters.get(_slope_key(sloped))
+        if not buckets:
+            return DEFAULT_SLOPED_HOUGH_PARAMETERS if sloped else DEFAULT_HOUGH_PARAMETERS
+        return buckets[min(buckets, key=lambda bucket_distance: abs(bucket_distance - distance))]
+
     def prepareFrontHolesDetection(self, distance, sloped, res):
         """
         Initialize The parameters for the detection
@@ -142,14 +224,113 @@ class Connect4Handler(object):
         :type res: int
         """
         self.front_holes_detection_prepared = True
+        self.distance = distance
+        self.sloped = sloped
         self.res = res
         self.min_radius, self.max_radius = self.computeMinMaxRadius(distance, sloped, res)
         self.pixel_error_margin = self.computeMaxPixelError(self.min_radius)
-        self.min_dist = int(self.min_radius * 2.391 * (self.res / 320))
-        self.param1 = 77
-        self.param2 = 9.25
-        if self.sloped:
-            self.param2 = 8
+        self.param1, self.param2, min_dist_factor = self.getHoughParameters(distance, sloped)
+        self.min_dist = int(self.min_radius * min_dist_factor * (self.res / 320))
+
+    def _nextImage(self, camera_num, res):
+        """
+        :param camera_num: the camera used if no camera number was given to the handler
+        :type camera_num: int
+        :param res: the resolution parameter of the image function
+        :type res: int
+        :return: the BGR image of the next frame of the "next_img_func"
+        :rtype: np.ndarray
+        Take the next frame and make it the current one ("self.frame" and "self.img").
+        The image function can return a Frame or a BGR image.
+        """
+        if self.cam_no != -1:
+            camera_num = self.cam_no
+        self.frame = as_frame(self.next_img_func(camera_num, res=res))
+        self.img = None if self.frame is None else self.frame.getBGR()
+        return self.img
+
+    def _findFrontHoles(self, distance, sloped, res):
+        """
+        :param distance: The distance between the robot and the connect4
+        :type distance: float
+        :param sloped: True if the connect4 is sloped or in an unknown position
+        :type sloped: bool
+        :param res: the resolution of the image
+        :type res: int
+        :return: False if no circle could be found in the image
+        :rtype: bool
+        Run the front holes detection on the current image ("self.img").
+        Raises a FrontHolesGridNotFoundException if the circles found do not form the front holes grid.
+        """
+        self.circles = []
+        if not self.front_holes_detection_prepared or self.distance != distance or self.sloped != sloped \
+                or self.res != res:
+            # Every parameter of the detection depends on the distance, not only the radius of the holes
+            self.prepareFrontHolesDetection(distance, sloped, res)
+        if self.frame is None or self.frame.getBGR() is not self.img:
+            self.frame = as_frame(self.img)
+        circles = cv2.HoughCircles(self.frame.getBlurredGray(), cv2.HOUGH_GRADIENT, 1, self.min_dist,
+                                   param1=self.param1, param2=self.param2, minRadius=self.min_radius,
+                                   maxRadius=self.max_radius)
+        if circles is None:
+            return False
+        self.circles = circles[0]
+        self.front_hole_detector.runDetection(self.circles, pixel_error_margin=self.pixel_error_margin,
+                                              img=self.img)
+        return True
+
+    def estimateBoardPoseUsingFrontHoles(self, img, distance, sloped, camera_matrix, camera_dist,
+                                         res=DEFAULT_RESOLUTION, guess=None):
+        """
+        :param img: the image (or the frame) in which the front holes are searched
+        :type img: np.ndarray
+        :param distance: The distance between the robot and the connect4
+        :type distance: float
+        :param sloped: True if the connect4 is sloped or in an unknown position
+        :type sloped: bool
+        :param camera_matrix: The intrinsic camera matrix that can be get via camera calibration
+        :type camera_matrix: np.matrix
+        :param camera_dist: The intrinsic camera distortion coefficients that can be get via camera calibration
+        :type camera_dist: np.array
+        :param res: the resolution of the image
+        :type res: int
+        :param guess: (rvec, tvec) the previous pose of the board, used as a starting point by SolvePnP, can be None
+        :type guess: tuple
+        :return: (rvec, tvec) : the pose of the board seen from the camera
+        :rtype: tuple
+        Find the pose of the board in one image, without using the "next_img_func" nor the tracker.
+        Raises a FrontHolesGridNotFoundException if the front holes are not found.
+        """
+        self.frame = as_frame(img)
+        self.img = self.frame.getBGR()
+        if not self._findFrontHoles(distance, sloped, res):
+            raise FrontHolesGridNotFoundException("No circle could be found in the image")
+        return self.front_hole_detector.match3DModel(camera_matrix, camera_dist, guess=guess)
+
+    def estimateBoardPoseUsingMarkers(self, img, camera_matrix, camera_dist, res=640, guess=None):
+        """
+        :param img: the image (or the frame) in which the Hamming codes are searched
+        :type img: np.ndarray
+        :param camera_matrix: The intrinsic camera matrix that can be get via camera calibration
+        :type camera_matrix: np.matrix
+        :param camera_dist: The intrinsic camera distortion coefficients that can be get via camera calibration
+        :type camera_dist: np.array
+        :param res: the resolution of the image
+        :type res: int
+        :param guess: (rvec, tvec) the previous pose of the board, used as a starting point by SolvePnP, can be None
+        :type guess: tuple
+        :return: (rvec, tvec) : the pose of the board seen from the camera
+        :rtype: tuple
+        Find the pose of the board in one image, without using the "next_img_func" nor the tracker.
+        Raises a NotEnoughLandmarksException if not enough Hamming codes are found.
+        """
+        self.frame = as_frame(img)
+        self.img = self.frame.getBGR()
+        markers = detect_markers(self.img)
+        if markers is None:
+            markers = []
+        self.upper_hole_detector.runDetection([], markers)
+        return self.upper_hole_detector.match3DModel(camera_matrix, camera_dist, res=res, guess=guess)
 
     def detectFrontHoles(self, distance, sloped=False, res=DEFAULT_RESOLUTION, tries=1, debug=False):
         """
@@ -172,27 +353,8 @@ class Connect4Handler(object):
         else:
             i_res = 1
         for i in range(tries):
-            if self.cam_no == -1:
-                self.img = self.next_img_func(0, res=i_res)  # We detect the front holes using the top camera
-            else:
-                self.img = self.next_img_func(self.cam_no, res=i_res)
-            self.circles = []
-            if not self.front_holes_detection_prepared:
-                self.prepareFrontHolesDetection(distance, sloped, res)
-            elif self.distance != distance or self.sloped != sloped:
-                self.min_radius, self.max_radius = self.computeMinMaxRadius(distance, sloped)
-            gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
-            gray = cv2.GaussianBlur(gray, (3, 3), 0)
-            gray = cv2.medianBlur(gray, 3)
-
-            circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, self.min_dist,
-                                       param1=self.param1, param2=self.param2, minRadius=self.min_radius,
-                                       maxRadius=self.max_radius)
-            if circles is not None:
-
-                self.circles = circles[0]
-                self.front_hole_detector.runDetection(self.circles, pixel_error_margin=self.pixel_error_margin,
-                                                      img=self.img)
+            self._nextImage(0, i_res)  # We detect the front holes using the top camera
+            if self._findFrontHoles(distance, sloped, res):
                 if debug:
                     img2 = draw_circles(self.img, self.circles)
                     cv2.imshow("Circles detected", img2)
@@ -222,7 +384,7 @@ class Connect4Handler(object):
                     "The detection was not stable as it lost the board after {0} attempt(s)".format(str(i)))
 
     def getUpperHoleCoordinatesUsingMarkers(self, index, camera_position, camera_matrix, camera_dist,
-                                            tries=1, debug=False, res=640):
+                                            tries=1, debug=False, res=640, use_cache=False):
         """
         :param res: The resolution length
         :param index: the index of the hole
@@ -239,26 +401,57 @@ class Connect4Handler(object):
         :param tries: the number of times the detection will be run. If one try fails,
                       the whole detection is considered as failed
         :type tries: int
+        :param use_cache: if True and the camera has not moved since the last detection, the coordinates are
+                          computed from the board pose kept by the tracker, without running a new detection
+        :type use_cache: bool
         Get an upper hole's coordinates using the Hamming markers on the Connect 4.
         This method assumes that the Hamming codes are visible on the image it will
             acquire using its "next_img_func". Otherwise, the detection fails
         """
+        return self.getUpperHolesCoordinatesUsingMarkers(camera_position, camera_matrix, camera_dist, tries=tries,
+                                                         debug=debug, res=res, use_cache=use_cache)[index].tolist()
+
+    def getUpperHolesCoordinatesUsingMarkers(self, camera_position, camera_matrix, camera_dist,
+                                             tries=1, debug=False, res=640, use_cache=False):
+        """
+        :param res: The resolution length
+        :param camera_position: the 6D position of the camera used for the detection (the bottom one),
+                                    from the robot torso
+        :type camera_position: tuple
+        :param camera_matrix: the camera distortion matrix
+        :type camera_matrix: np.array
+        :param camera_dist: the camera distortion coefficients vector
+        :type camera_dist: np.array
+        :param debug: if True, draw the detected markers
+        :type debug: bool
+        :param tries: the number of times the detection will be run. If one try fails,
+                      the whole detection is considered as failed
+        :type tries: int
+        :param use_cache: if True and the camera has not moved since the last detection, the coordinates are
+                          computed from the board pose kept by the tracker, without running a new detection
+        :type use_cache: bool
+        :return: The (7, 6) array that contains the hand position 6D above each upper hole
+        :rtype: np.ndarray
+        Get every upper hole's coordinates using the Hamming markers on the Connect 4.
+        This method assumes that the Hamming codes are visible on the image it will
+            acquire using its "next_img_func". Otherwise, the detection fails.
+        The try that detected the most Hamming codes is fused into the board pose kept by the tracker.
+        """
+        if use_cache and self.tracker.isBoardPoseValid(camera_position, camera_num=1):
+            return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
         max_nb_of_markers = 0
-        rvec = None
-        tvec = None
+        best_try = None
         if res == 640:
             i_res = 2
         else:
             i_res = 1
         for i in range(tries):
-            if self.cam_no == -1:
-                img = self.next_img_func(1, res=i_res)  # We get the image from the bottom camera
-            else:
-                img = self.next_img_func(self.cam_no, res=i_res)
+            img = self._nextImage(1, i_res)  # We get the image from the bottom camera
             min_nb_of_codes = 2
             markers = detect_markers(img)
             if markers is not None and len(markers) >= min_nb_of_codes:
                 if debug:
+                    img = img.copy()  # The image of the frame must not be modified
                     for m in markers:
                         m.draw_contour(img)
                         cv2.putText(img, str(m.id), tuple(int(p) for p in m.center),
@@ -268,17 +461,72 @@ class Connect4Handler(object):
                 self.upper_hole_detector.runDetection([], markers)
                 if len(markers) > max_nb_of_markers:
                     max_nb_of_markers = len(markers)
-                    rvec, tvec = self.upper_hole_detector.match3DModel(camera_matrix, camera_dist)
+                    rvec, tvec = self.upper_hole_detector.match3DModel(
+                        camera_matrix, camera_dist, guess=self.tracker.getExtrinsicGuess(camera_position))
+                    best_try = (rvec, tvec, self.upper_hole_detector.getCorrespondences(res), self.frame.getGray())
             else:
                 if debug:
                     cv2.imshow("Debug", img)
                 if cv2.waitKey(100) == 27:
                     raise NotEnoughLandmarksException("The detection was interrupted")
                 raise NotEnoughLandmarksException("The model needs at least " + str(min_nb_of_codes) + " detected codes")
-        return self._getUpperHoleCoordinates(rvec, tvec, index, camera_position)
+        rvec, tvec, (object_points, image_points), gray = best_try
+        self.tracker.updateBoardPose(rvec, tvec, camera_position, camera_num=1)
+        # The corners of the Hamming codes can be followed in the next frames
+        self.marker_flow_object_points = object_points
+        self.marker_flow.start(gray, image_points * (res / 320.))
+        return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
+
+    def trackUpperHoleCoordinatesUsingMarkers(self, index, camera_position, camera_matrix, camera_dist, res=640):
+        """
+        :param index: the index of the hole
+        :type index: int
+        :return: The hand position 6D above the upper hole
+        :rtype: list
+        Get an upper hole's coordinates by following the Hamming codes in the next image
+            (see trackUpperHolesCoordinatesUsingMarkers)
+        """
+        return self.trackUpperHolesCoordinatesUsingMarkers(camera_position, camera_matrix, camera_dist,
+                                                           res=res)[index].tolist()
+
+    def trackUpperHolesCoordinatesUsingMarkers(self, camera_position, camera_matrix, camera_dist, res=640):
+        """
+        :param camera_position: the 6D position of the camera used for the detection (the bottom one),
+                                    from the robot torso
+        :type camera_position: tuple
+        :param camera_matrix: the camera distortion matrix
+        :type camera_matrix: np.array
+        :param camera_dist: the camera distortion coefficients vector
+        :type camera_dist: np.array
+        :param res: The resolution length
+        :type res: int
+        :return: The (7, 6) array that contains the hand position 6D above each upper hole
+        :rtype: np.ndarray
+        Follow the corners of the Hamming codes found by the last detection in the next image, using the optical flow,
+            which is much faster than a new detection. The camera must not have moved since the last detection.
+        The Hamming codes are detected again (see getUpperHolesCoordinatesUsingMarkers) if too many corners were lost.
+        Raises a NotEnoughLandmarksException if they can not be detected.
+        """
+        if self.marker_flow.isTracking():
+            self._nextImage(1, 2 if res == 640 else 1)
+            ids, image_points = self.marker_flow.track(self.frame.getGray())
+            if len(ids) >= MIN_CORRESPONDENCES:
+                guess = self.tracker.getExtrinsicGuess(camera_position)
+                object_points = self.marker_flow_object_points[ids]
+                image_points = np.float64(image_points) / (res / 320.)  # The calibration was made in 320x240
+                if guess is None:
+                    retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist)
+                else:
+                    retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist,
+                                                      guess[0], guess[1], useExtrinsicGuess=True)
+                if retval:
+                    self.tracker.updateBoardPose(rvec, tvec, camera_position, camera_num=1)
+                    return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
+        self.marker_flow.stop()
+        return self.getUpperHolesCoordinatesUsingMarkers(camera_position, camera_matrix, camera_dist, res=res)
 
     def getUpperHoleCoordinatesUsingFrontHoles(self, distance, sloped, index, camera_position, camera_matrix,
-                                               camera_dist, debug=False, tries=1):
+                                               camera_dist, debug=False, tries=1, use_cache=False):
         """
         :param distance: The distance between the robot and the connect4
         :type distance: float
@@ -298,13 +546,115 @@ class Connect4Handler(object):
         :param tries: the number of times the detection will be run. If one try fails,
                       the whole detection is considered as failed
         :type tries: int
+        :param use_cache: if True and the camera has not moved since the last detection, the coordinates are
+                          computed from the board pose kept by the tracker, without running a new detection
+        :type use_cache: bool
         Get an upper hole's coordinates using the front holes of the Connect 4.
         This method assumes that the front holes are visible on the image it will
             acquire using its "next_img_func". Otherwise, the detection fails
         """
+        return self.getUpperHolesCoordinatesUsingFrontHoles(distance, sloped, camera_position, camera_matrix,
+                                                            camera_dist, debug=debug, tries=tries,
+                                                            use_cache=use_cache)[index].tolist()
+
+    def getUpperHolesCoordinatesUsingFrontHoles(self, distance, sloped, camera_position, camera_matrix,
+                                                camera_dist, debug=False, tries=1, use_cache=False):
+        """
+        :param distance: The distance between the robot and the connect4
+        :type distance: float
+        :param sloped: True if the connect4 is sloped or in an unknown position
+        :type sloped: bool
+        :param camera_position: the 6D position of the camera used for the detection (the top one),
+                                    from the robot torso
+        :type camera_position: tuple
+        :param camera_matrix: the camera distortion matrix
+        :type camera_matrix: np.array
+        :param camera_dist: the camera distortion coefficients vector
+        :type camera_dist: np.array
+        :param debug: if True, draw the detected markers
+        :type debug: bool
+        :param tries: the number of times the detection will be run. If one try fails,
+                      the whole detection is considered as failed
+        :type tries: int
+        :param use_cache: if True and the camera has not moved since the last detection, the coordinates are
+                          computed from the board pose kept by the tracker, without running a new detection
+        :type use_cache: bool
+        :return: The (7, 6) array that contains the hand position 6D above each upper hole
+        :rtype: np.ndarray
+        Get every upper hole's coordinates using the front holes of the Connect 4.
+        This method assumes that the front holes are visible on the image it will
+            acquire using its "next_img_func". Otherwise, the detection fails.
+        The detection is fused into the board pose kept by the tracker.
+        """
+        if use_cache and self.tracker.isBoardPoseValid(camera_position, camera_num=0):
+            return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
         self.detectFrontHoles(distance, sloped, tries=tries, debug=debug)
-        rvec, tvec = self.front_hole_detector.match3DModel(camera_matrix, camera_dist)
-        return self._getUpperHoleCoordinates(rvec, tvec, index, camera_position)
+        rvec, tvec = self.front_hole_detector.match3DModel(camera_matrix, camera_dist,
+                                                           guess=self.tracker.getExtrinsicGuess(camera_position))
+        self.tracker.updateBoardPose(rvec, tvec, camera_position, camera_num=0)
+        return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
+
+    def getUpperHolesCoordinatesUsingAllLandmarks(self, distance, sloped, camera_position, camera_matrix,
+                                                  camera_dist, res=640, tries=1, debug=False, use_cache=False):
+        """
+        :param distance: The distance between the robot and the connect4
+        :type distance: float
+        :param sloped: True if the connect4 is sloped or in an unknown position
+        :type sloped: bool
+        :param camera_position: the 6D position of the camera used for the detection (the bottom one),
+                                from the robot torso
+        :type camera_position: tuple
+        :param camera_matrix: the camera intrinsic matrix
+        :type camera_matrix: np.matrix
+        :param camera_dist: the camera distortion matrix
+        :type camera_dist: np.matrix
+        :param res: The resolution length
+        :type res: int
+        :param tries: the number of times the detection will be run. If one try fails,
+                      the whole detection is considered as failed
+        :type tries: int
+        :param debug: if True, draw the detected landmarks on a debug window
+        :type debug: bool
+        :param use_cache: if True and the camera has not moved since the last detection, the coordinates are
+                          computed from the board pose kept by the tracker, without running a new detection
+        :type use_cache: bool
+        :return: The (7, 6) array that contains the hand position 6D above each upper hole
+        :rtype: np.ndarray
+        Get every upper hole's coordinates using every landmark (front holes and Hamming codes) visible in one image.
+        The correspondences of all the landmarks are used together in a single RANSAC pose estimation, whose
+            reprojection error is kept in "self.pose_estimator.reprojection_error".
+        """
+        if use_cache and self.tracker.isBoardPoseValid(camera_position, camera_num=1):
+            return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
+        if res == 640:
+            i_res = 2
+        else:
+            i_res = 1
+        for i in range(tries):
+            self._nextImage(1, i_res)  # We get the image from the bottom camera
+            self.pose_estimator.clear()
+            try:
+                if self._findFrontHoles(distance, sloped, res):
+                    self.pose_estimator.addCorrespondences(*self.front_hole_detector.getCorrespondences(res))
+            except FrontHolesGridNotFoundException:
+                pass  # The Hamming codes may be enough
+            markers = detect_markers(self.img)
+            if markers is None:
+                markers = []
+            if len(markers) > 0:
+                self.upper_hole_detector.runDetection([], markers)
+                self.pose_estimator.addCorrespondences(*self.upper_hole_detector.getCorrespondences(res))
+            if debug:
+                img2 = draw_circles(self.img, self.circles)
+                for m in markers:
+                    m.draw_contour(img2)
+                cv2.imshow("Debug", img2)
+                if cv2.waitKey(1) == 27:
+                    raise NotEnoughLandmarksException("The detection was interrupted")
+            rvec, tvec, _ = self.pose_estimator.solve(camera_matrix, camera_dist,
+                                                      guess=self.tracker.getExtrinsicGuess(camera_position))
+            self.tracker.updateBoardPose(rvec, tvec, camera_position, camera_num=1)
+        return self._getHandPositions(self.tracker.getBoardPoseUpperHolesCoordinates())
 
     def _getUpperHoleCoordinates(self, rvec, tvec, index, camera_position):
         """
@@ -317,23 +667,46 @@ class Connect4Handler(object):
         :param camera_position: the 6D position of the camera used for the detection, from the robot torso
         :type camera_position: tuple
         :return: The asked upper hole 3D coordinates
-        :rtype: np.array
-        Detect holes in the image using the Hamming codes.
-        """
-        coords = self.tracker.getHoleCoordinates(rvec, tvec, camera_position, index)
-        coords2 = self.tracker.getHoleCoordinates(rvec, tvec, camera_position, (index+1) % 7)
-        sign = 1
-        if index == 6:
-            sign = -1  # We invert it if we took a vector the other way
-        vector = sign * geom.vectorize(coords[0:2], coords2[0:2], False)
-        angle = np.arctan2(vector[1], vector[0]) - 1.56
-        sign = 1
-        if coords2[0] > coords[0]:
-            sign = -1
-        angle *= sign
-        coords[5] = angle
-        coords[2] += 0.12  # So the hand of NAO is located above the connect 4, not on it
-        coords[3:] = [-1.542, -0.0945, angle - 0.505]
-        coords[1] += 0.028
-        coords[0] -= 0.01
+        :rtype: list
+        Computes the hand position above an upper hole.
+        """
+        return self._getUpperHolesCoordinates(rvec, tvec, camera_position)[index].tolist()
+
+    def _getUpperHolesCoordinates(self, rvec, tvec, camera_position):
+        """
+        :param rvec: the rotation vector that will transform the 2D coordinates into 3D coordinates
+        :type rvec: np.array
+        :param tvec: the translation vector that will transform the 2D coordinates into 3D coordinates
+        :type tvec: np.array
+        :param camera_position: the 6D position of the camera used for the detection, from the robot torso
+        :type camera_position: tuple
+        :return: The (7, 6) array that contains the hand position 6D above each upper hole
+        :rtype: np.ndarray
+        Computes the hand position above every upper hole from one pose estimation.
+        """
+        return self._getHandPositions(self.tracker.getUpperHolesCoordinates(rvec, tvec, camera_position))
+
+    @staticmethod
+    def _getHandPositions(coords):
+        """
+        :param coords: the (7, 6) array that contains the position 6D of the middle of each upper hole, from the torso
+        :type coords: np.ndarray
+        :return: The (7, 6) array that contains the hand position 6D above each upper hole
+        :rtype: np.ndarray
+        Computes the position in which NAO's hand must be placed to drop a disc in each upper hole
+        """
+        coords = coords.copy()
+        # The orientation of each hole is given by the vector towards the next hole
+        next_coords = np.roll(coords, -1, axis=0)
+        vectors = np.abs(next_coords[:, 0:2] - coords[:, 0:2])
+        angles = np.arctan2(vectors[:, 1], vectors[:, 0]) - 1.56
+        angles[next_coords[:, 0] > coords[:, 0]] *= -1
+        # The holes are aligned : the last one, that has no next hole, has the orientation of the one before it
+        angles[6] = angles[5]
+        coords[:, 2] += 0.12  # So the hand of NAO is located above the connect 4, not on it
+        coords[:, 3] = -1.542
+        coords[:, 4] = -0.0945
+        coords[:, 5] = angles - 0.505
+        coords[:, 1] += 0.028
+        coords[:, 0] -= 0.01
         return coords
@@ -12,20 +12,124 @@ class Connect4Tracker(object):
      Its main goal is to convert coordinates from the camera space into NAO's.
     """
 
-    def __init__(self, model):
+    def __init__(self, model, smoothing=0.5, position_tolerance=0.01, rotation_tolerance=0.02,
+                 reset_distance=0.05, reset_angle=0.2):
         """
+        :param model: the model of the Connect 4
+        :type model: DefaultModel
+        :param smoothing: the weight of a new pose estimation when it is fused with the kept board pose, in [0, 1]
+        :type smoothing: float
+        :param position_tolerance: the maximum translation of the camera, in meters, for which the kept board pose
+                                   is considered as still valid
+        :type position_tolerance: float
+        :param rotation_tolerance: the maximum rotation of the camera, in radians, for which the kept board pose
+                                   is considered as still valid
+        :type rotation_tolerance: float
+        :param reset_distance: the distance in meters between a new pose estimation and the kept board pose
+                               above which the kept pose is replaced instead of fused
+        :type reset_distance: float
+        :param reset_angle: the angle in radians between a new pose estimation and the kept board pose
+                            above which the kept pose is replaced instead of fused
+        :type reset_angle: float
         Creates the tracker to refresh and keep the Connect 4 position in 3D
         """
         # Transformation from camera's world axes to nao's world axes
-        self.nao_axes_mat = np.matrix([[0, 0, 1],
-                                       [-1, 0, 0],
-                                       [0, -1, 0]])
+        self.nao_axes_mat = np.array([[0, 0, 1],
+                                      [-1, 0, 0],
+                                      [0, -1, 0]], dtype=np.float64)
         # Connect 4 Model and location information
         self.model = model
         self.camera_rmat = None
         self.camera_tvec = None
         self.connect4_rmat = None
         self.connect4_tvec = None
+        # The middle of each upper hole in the model, computed from its top left and its bottom right corners
+        self.upper_hole_middles = np.array([(self.model.getUpperHole(i)[0] + self.model.getUpperHole(i)[3]) / 2
+                                            for i in range(7)], dtype=np.float64)
+        # The board pose from the torso (4x4 homogeneous matrix), fused over the successive pose estimations
+        self.smoothing = smoothing
+        self.position_tolerance = position_tolerance
+        self.rotation_tolerance = rotation_tolerance
+        self.reset_distance = reset_distance
+        self.reset_angle = reset_angle
+        self.board_pose = None
+        # The position 6D of each camera (0 : top, 1 : bottom) at its last estimation fused into the board pose
+        self.board_pose_camera_positions = {}
+        # Buffers of the intermediate 4x4 homogeneous matrices, reused at each pose estimation
+        self._board_to_camera = np.eye(4)
+        self._camera_to_torso = np.eye(4)
+        self._torso_to_camera = np.eye(4)
+        self._board_to_torso = np.eye(4)
+
+    def getBoardToTorsoMatrix(self, rvec, tvec, camera_position6d, out=None):
+        """
+        :param rvec: The rotation vector given by SolvePnP to apply to the _model to get the Connect4Handler 3D coord.
+        :type rvec: np.array
+        :param tvec: The translation vector given by SolvePnP to apply to the _model to get the Connect4Handler 3D coord.
+        :type tvec: np.array
+        :param camera_position6d: the position 6D (x, y, z, Wx, Wy, Wz) of the camera from the robot torso
+        :type camera_position6d: array
+        :param out: the 4x4 array in which the result is written. If None, a new array is allocated
+        :type out: np.ndarray
+        :return: The 4x4 homogeneous matrix that transforms coordinates of the model into coordinates from the torso
+        :rtype: np.ndarray
+        Composes the rigid transformations (model -> camera -> NAO's camera axes -> torso) into a single matrix.
+        """
+        self.connect4_rmat, _ = cv2.Rodrigues(rvec)
+        self.connect4_tvec = tvec
+        geom.transform_matrix(self.connect4_rmat, self.connect4_tvec, out=self._board_to_camera)
+        camera_to_torso = self.getCameraToTorsoMatrix(camera_position6d, out=self._camera_to_torso)
+        return geom.compose_transforms(camera_to_torso, self._board_to_camera, out=out)
+
+    def getCameraToTorsoMatrix(self, camera_position6d, out=None):
+        """
+        :param camera_position6d: the position 6D (x, y, z, Wx, Wy, Wz) of the camera from the robot torso
+        :type camera_position6d: array
+        :param out: the 4x4 array in which the result is written. If None, a new array is allocated
+        :type out: np.ndarray
+        :return: The 4x4 homogeneous matrix that transforms coordinates from the camera (OpenCV axes)
+                 into coordinates from the torso
+        :rtype: np.ndarray
+        """
+        [x, y, z, Wx, Wy, Wz] = camera_position6d
+        self.camera_tvec = np.array([x, y, z], dtype=np.float64)
+        self.camera_rmat = geom.convert_euler_to_matrix((Wx, Wy, Wz), out=self.camera_rmat)
+        return geom.transform_matrix(np.dot(self.camera_rmat, self.nao_axes_mat), self.camera_tvec, out=out)
+
+    def getUpperHolesCoordinates(self, rvec, tvec, camera_position6d, out=None):
+        """
+        :param rvec: The rotation vector given by SolvePnP to apply to the _model to get the Connect4Handler 3D coord.
+        :type rvec: np.array
+        :param tvec: The translation vector given by SolvePnP to apply to the _model to get the Connect4Handler 3D coord.
+        :type tvec: np.array
+        :param camera_position6d: the position 6D (x, y, z, Wx, Wy, Wz) of the camera from the robot torso
+        :type camera_position6d: array
+        :param out: the (7, 6) array in which the result is written. If None, a new array is allocated
+        :type out: np.ndarray
+        :return: The (7, 6) array that contains the position 6D of the middle of each upper hole, from the torso
+        :rtype: np.ndarray
+        Computes the position of every upper hole of the board using one pose estimation.
+        """
+        board_to_torso = self.getBoardToTorsoMatrix(rvec, tvec, camera_position6d, out=self._board_to_torso)
+        return self._getUpperHolesCoordinates(board_to_torso, out=out)
+
+    def _getUpperHolesCoordinates(self, board_to_torso, out=None):
+        """
+        :param board_to_torso: The 4x4 homogeneous matrix that transforms the model into coordinates from the torso
+        :type board_to_torso: np.ndarray
+        :param out: the (7, 6) array in which the result is written. If None, a new array is allocated
+        :type out: np.ndarray
+        :return: The (7, 6) array that contains the position 6D of the middle of each upper hole, from the torso
+        :rtype: np.ndarray
+        """
+        if out is None:
+            out = np.zeros((7, 6))
+        else:
+            # The 3 rotation values (0) match the Position6D requirements of NAO
+            out[:, 3:6] = 0
+        # Rotate and translate the middles of the holes to get their position from the torso
+        geom.apply_transform(board_to_torso, self.upper_hole_middles, out=out[:, 0:3])
+        return out
 
     def getHoleCoordinates(self, rvec, tvec, camera_position6d, hole_index):
         # type: (np.array, np.array, tuple, int) -> list
@@ -40,30 +144,92 @@ class Connect4Tracker(object):
         :type hole_index: int
         :return: The list that contains the upper _holes position
         :rtype: list
-        Computes the position of each upper hole of the board.
+        Computes the position of an upper hole of the board.
         """
-        [x, y, z, Wx, Wy, Wz] = camera_position6d
-        self.camera_tvec = np.array([x, y, z])
-        self.camera_rmat = geom.convert_euler_to_matrix((Wx, Wy, Wz))
-        self.connect4_rmat, _ = cv2.Rodrigues(rvec)
-        self.connect4_tvec = tvec
-        positions = []
-        # We take the top left corner and the bottom right corner of the hole
-        model_coord_0, _, _, model_coord_1 = self.model.getUpperHole(hole_index)
-        # This is the translation vector to add to the left top corner in order to get the middle of the hole
-        middle_vector = (model_coord_1 - model_coord_0) / 2
-        model_coord = model_coord_0 + middle_vector  # The coordinates of the middle of the hole
-        # Rotate and translate to get real position with camera axes
-        new_coord = geom.transform_vector(model_coord, self.connect4_rmat, self.connect4_tvec)
-        # print "Hole", i, "From Camera Original Axes", new_coord
-        new_coord = geom.transform_vector(new_coord, self.nao_axes_mat, np.array([[0], [0], [0]], np.int32)) \
-            .tolist()[0]
-        # print "Hole", i, "From Camera", new_coord
-        new_coord = geom.transform_vector(np.array(new_coord), self.camera_rmat, self.camera_tvec)
-        new_coord = new_coord.tolist()[0]
-        # print "Hole ", i, "From Torso", new_coord, '\n'
-        # Add 3 rotation values (0) to match the Position6D requirements of NAO
-        for _ in range(3):
-            new_coord = np.append(new_coord, 0)
-        return new_coord.tolist()
+        return self.getUpperHolesCoordinates(rvec, tvec, camera_position6d)[hole_index].tolist()
+
+    def updateBoardPose(self, rvec, tvec, camera_position6d, camera_num=0):
+        """
+        :param rvec: The rotation vector given by SolvePnP to apply to the _model to get the Connect4Handler 3D coord.
+        :type rvec: np.array
+        :param tvec: The translation vector given by SolvePnP to apply to the _model to get the Connect4Handler 3D coord.
+        :type tvec: np.array
+        :param camera_position6d: the position 6D (x, y, z, Wx, Wy, Wz) of the camera from the robot torso
+        :type camera_position6d: array
+        :param camera_num: the camera of the estimation, 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: The fused board pose from the torso (4x4 homogeneous matrix)
+        :rtype: np.ndarray
+        Fuse a new pose estimation with the kept board pose, using an exponential filter (the board is assumed static).
+        If the new estimation is too far from the kept pose, the board is assumed to have moved and the kept pose
+            is replaced.
+        """
+        new_pose = self.getBoardToTorsoMatrix(rvec, tvec, camera_position6d)
+        if self.board_pose is None:
+            self.board_pose = new_pose
+            self.board_pose_camera_positions = {}
+        else:
+            # The rotation between the kept pose and the new one, as a rotation vector
+            delta_rvec, _ = cv2.Rodrigues(np.dot(self.board_pose[0:3, 0:3].T, new_pose[0:3, 0:3]))
+            if np.linalg.norm(new_pose[0:3, 3] - self.board_pose[0:3, 3]) > self.reset_distance \
+                    or np.linalg.norm(delta_rvec) > self.reset_angle:
+                self.board_pose = new_pose
+                # The other cameras saw the board before it moved
+                self.board_pose_camera_positions = {}
+            else:
+                fused_pose = np.eye(4)
+                fused_pose[0:3, 0:3] = np.dot(self.board_pose[0:3, 0:3], cv2.Rodrigues(self.smoothing * delta_rvec)[0])
+                fused_pose[0:3, 3] = (1 - self.smoothing) * self.board_pose[0:3, 3] + self.smoothing * new_pose[0:3, 3]
+                self.board_pose = fused_pose
+        self.board_pose_camera_positions[camera_num] = np.array(camera_position6d, dtype=np.float64)
+        return self.board_pose
 
+    def resetBoardPose(self):
+        """
+        Forget the kept board pose, e.g. because the robot has moved
+        """
+        self.board_pose = None
+        self.board_pose_camera_positions = {}
+
+    def isBoardPoseValid(self, camera_position6d, camera_num=0):
+        """
+        :param camera_position6d: the current position 6D (x, y, z, Wx, Wy, Wz) of the camera from the robot torso
+        :type camera_position6d: array
+        :param camera_num: the camera, 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: True if a board pose is kept, the camera took part in it and it has not moved beyond the tolerances
+                 since its last estimation
+        :rtype: bool
+        """
+        if self.board_pose is None or camera_num not in self.board_pose_camera_positions:
+            return False
+        difference = np.array(camera_position6d, dtype=np.float64) - self.board_pose_camera_positions[camera_num]
+        angles_difference = np.abs(np.mod(difference[3:] + np.pi, 2 * np.pi) - np.pi)
+        return np.linalg.norm(difference[0:3]) <= self.position_tolerance \
+            and (angles_difference <= self.rotation_tolerance).all()
+
+    def getExtrinsicGuess(self, camera_position6d):
+        """
+        :param camera_position6d: the current position 6D (x, y, z, Wx, Wy, Wz) of the camera from the robot torso
+        :type camera_position6d: array
+        :return: The (rvec, tvec) of the kept board pose seen from the camera, that can be given to SolvePnP
+                 as an extrinsic guess, or None if no board pose is kept
+        :rtype: tuple
+        """
+        if self.board_pose is None:
+            return None
+        camera_to_torso = self.getCameraToTorsoMatrix(camera_position6d, out=self._camera_to_torso)
+        board_to_camera = geom.compose_transforms(geom.invert_transform(camera_to_torso, out=self._torso_to_camera),
+                                                  self.board_pose, out=self._board_to_camera)
+        rvec, _ = cv2.Rodrigues(board_to_camera[0:3, 0:3])
+        return rvec, board_to_camera[0:3, 3].reshape(3, 1).copy()
+
+    def getBoardPoseUpperHolesCoordinates(self):
+        """
+        :return: The (7, 6) array that contains the position 6D of the middle of each upper hole, from the torso,
+                 computed from the kept board pose
+        :rtype: np.ndarray
+        """
+        if self.board_pose is None:
+            return None
+        return self._getUpperHolesCoordinates(self.board_pose)
@@ -62,27 +62,42 @@ class FrontHolesDetector(CircleGridDetector):
         super(FrontHolesDetector, self).runDetection(circles, pixel_error_margin, min_similar_vectors, img,
                                                      self.connect4_img, grid_shape)
 
-    def match3DModel(self, camera_matrix, camera_dist):
+    def getCorrespondences(self, res=320):
+        """
+        :param res: The resolution (width in pixels) of the image in which the front holes were detected
+        :type res: int
+        :return: (object_points, image_points) : the (42, 3) front holes of the model and the (42, 2) front holes
+                 found in the image, in the same order
+        :rtype: tuple
+        Get the correspondences between the model and the image given by the last detection
+        """
+        res_diff = res / 320.  # Because the calibration was made using 320x240 images
+        object_points = np.array(self.model.three_d[self.model.FRONT_HOLES], dtype=np.float64)
+        image_points = np.zeros((42, 2), dtype=np.float32)
+        for key in self.reference_mapping.keys():
+            image_points[self.model.FRONT_HOLE_MAPPING[key]] = self.reference_mapping[key]
+        image_points = cv2.perspectiveTransform(image_points.reshape(1, -1, 2), self.homography).reshape(-1, 2)
+        return object_points, np.float64(image_points) / res_diff
+
+    def match3DModel(self, camera_matrix, camera_dist, guess=None):
         """
         :param camera_matrix: The intrinsic camera matrix that can be get via camera calibration
         :type camera_matrix: np.matrix
         :param camera_dist: The intrinsic camera distortion coefficients that can be get via camera calibration
         :type camera_dist: np.array
+        :param guess: (rvec, tvec) the previous pose of the board, used as a starting point by SolvePnP, can be None
+        :type guess: tuple
         :return: (rvec, tvec) : rvec = rotation vector, tvec translation vector
         :rtype tuple:
         Find the 3D coordinates of the Connect4Handler
         """
-        object_points = np.array(self.model.three_d[self.model.FRONT_HOLES])
-        image_points = []
-        for i in range(42):
-            image_points.append(0)
-        for key in self.reference_mapping.keys():
-            model_key = self.model.FRONT_HOLE_MAPPING[key]
-            image_points[model_key] = self.reference_mapping[key]
-        image_points = cv2.perspectiveTransform(np.float32(image_points).reshape(1, -1, 2),
-                                                self.homography).reshape(-1, 2)
-        # retval, rvec, tvec = cv2.solvePnP(object_points, image_points, np.eye(3), None)
-        retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist)
+        object_points, image_points = self.getCorrespondences()
+        if guess is None:
+            retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist)
+        else:
+            retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist,
+                                              np.float64(guess[0]).copy(), np.float64(guess[1]).copy(),
+                                              useExtrinsicGuess=True)
         if not retval:
             print "ERR: SolvePnP failed"
-        return rvec, tvec
\ No newline at end of file
+        return rvec, tvec
@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+from connect4.detector.upper_hole import NotEnoughLandmarksException
+
+__author__ = 'Anthony Rouneau'
+
+MIN_CORRESPONDENCES = 6
+
+
+class PoseEstimator(object):
+    """
+    Gathers the 3D model/2D image correspondences of every landmark detected in a frame (front holes,
+     Hamming codes...) and finds the pose of the Connect 4 with one RANSAC PnP solve.
+    """
+
+    def __init__(self, reprojection_threshold=8.0, iterations=100, confidence=0.99):
+        """
+        :param reprojection_threshold: the maximum distance in pixels between an image point and the projection
+                                       of its model point to consider the correspondence as an inlier
+        :type reprojection_threshold: float
+        :param iterations: the number of RANSAC iterations
+        :type iterations: int
+        :param confidence: the probability that RANSAC finds a correct pose
+        :type confidence: float
+        """
+        self.reprojection_threshold = reprojection_threshold
+        self.iterations = iterations
+        self.confidence = confidence
+        self._object_points = []
+        self._image_points = []
+        self.inliers = None
+        self.reprojection_error = None
+
+    def clear(self):
+        """
+        Forget the correspondences and the result of the last solve
+        """
+        self._object_points = []
+        self._image_points = []
+        self.inliers = None
+        self.reprojection_error = None
+
+    def addCorrespondences(self, object_points, image_points):
+        """
+        :param object_points: the (N, 3) model points, in the model coordinates
+        :type object_points: np.ndarray
+        :param image_points: the (N, 2) image points that correspond to the model points
+        :type image_points: np.ndarray
+        Add correspondences to use in the next solve
+        """
+        object_points = np.reshape(np.asarray(object_points, dtype=np.float64), (-1, 3))
+        image_points = np.reshape(np.asarray(image_points, dtype=np.float64), (-1, 2))
+        if len(object_points) != len(image_points):
+            raise ValueError("Each model point needs exactly one image point")
+        if len(object_points) > 0:
+            self._object_points.append(object_points)
+            self._image_points.append(image_points)
+
+    def countCorrespondences(self):
+        """
+        :return: the number of correspondences gathered since the last clear
+        :rtype: int
+        """
+        return sum(len(points) for points in self._object_points)
+
+    def solve(self, camera_matrix, camera_dist, guess=None):
+        """
+        :param camera_matrix: The intrinsic camera matrix that can be get via camera calibration
+        :type camera_matrix: np.matrix
+        :param camera_dist: The intrinsic camera distortion coefficients that can be get via camera calibration
+        :type camera_dist: np.array
+        :param guess: (rvec, tvec) the previous pose of the board, used as a starting point by SolvePnP, can be None
+        :type guess: tuple
+        :return: (rvec, tvec, error) : rvec = rotation vector, tvec translation vector,
+                 error = the RMS reprojection error of the inliers, in pixels
+        :rtype: tuple
+        Find the pose of the Connect 4 using every correspondence gathered
+        """
+        if self.countCorrespondences() < MIN_CORRESPONDENCES:
+            raise NotEnoughLandmarksException(
+                "The model needs at least " + str(MIN_CORRESPONDENCES) + " correspondences")
+        object_points = np.concatenate(self._object_points)
+        image_points = np.concatenate(self._image_points)
+        camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        if guess is None:
+            rvec = np.zeros((3, 1))
+            tvec = np.zeros((3, 1))
+        else:
+            rvec = np.float64(guess[0]).reshape(3, 1).copy()
+            tvec = np.float64(guess[1]).reshape(3, 1).copy()
+        retval, rvec, tvec, inliers = cv2.solvePnPRansac(object_points, image_points, camera_matrix, camera_dist,
+                                                         rvec, tvec, guess is not None, self.iterations,
+                                                         self.reprojection_threshold, self.confidence)
+        if not retval or inliers is None or len(inliers) < MIN_CORRESPONDENCES:
+            raise NotEnoughLandmarksException("Could not find a pose consistent with the detected landmarks")
+        self.inliers = np.ravel(inliers)
+        projected, _ = cv2.projectPoints(object_points[self.inliers], rvec, tvec, camera_matrix, camera_dist)
+        residuals = projected.reshape(-1, 2) - image_points[self.inliers]
+        self.reprojection_error = np.sqrt(np.mean(np.sum(residuals ** 2, axis=1)))
+        return rvec, tvec, self.reprojection_error
@@ -8,6 +8,13 @@ from connect4.model.default_model import DefaultModel
 __author__ = 'Anthony Rouneau'
 
 
+# For each rotation of a Hamming code in the image (0, 90 degrees counterclockwise, 180, 90 degrees clockwise),
+#   the indices, in its sorted corners [NW, NE, SW, SE], of the corners [NW, NE, SW, SE] of the model
+ROTATED_CORNERS = [[0, 1, 2, 3], [2, 0, 3, 1], [3, 2, 1, 0], [1, 3, 0, 2]]
+# The maximum number of times the rotation of each Hamming code is refined from the pose found by SolvePnP
+MAX_ROTATION_REFINEMENTS = 3
+
+
 class NotEnoughLandmarksException(BaseException):
     def __init__(self, msg):
         super(NotEnoughLandmarksException, self).__init__(msg)
@@ -32,6 +39,12 @@ class UpperHolesDetector(object):
         self._centres_to_indices = {}
         self._boxes = []
         self._kdtree = None
+        # Arrays (one row per rectangle) of the centres, of the long side vectors and of the sides lengths
+        self._centres = None
+        self._long_vectors = None
+        self._long_norms = None
+        self._short_norms = None
+        self._filtered_mask = None
         self._filtered_rectangle_centres = []
         self._ham_id_to_rect_centres = {}
 
@@ -45,6 +58,12 @@ class UpperHolesDetector(object):
         self._centres_to_indices = {}
         self._boxes = []
         self._kdtree = None
+        # Arrays (one row per rectangle) of the centres, of the long side vectors and of the sides lengths
+        self._centres = None
+        self._long_vectors = None
+        self._long_norms = None
+        self._short_norms = None
+        self._filtered_mask = None
         self._filtered_rectangle_centres = []
         self._ham_id_to_rect_centres = {}
 
@@ -52,14 +71,24 @@ class UpperHolesDetector(object):
         self._clear()
         self._rectangles = rectangles
         self._hamcodes = hamcodes
+        # The corners of the Hamming codes are sorted as the corners of the model : [NW, NE, SW, SE]
+        if hamcodes is not None:
+            for hamcode in hamcodes:
+                hamcode.contours = geom.sort_rectangle_corners(hamcode.contours)
         self._kdtree, self._centres_to_indices, self._boxes = self._initStructures()
         # self._filtered_rectangle_centres = self._filterIncludedRectangles()
         if len(self._rectangles) != 0:
-            self._filtered_rectangle_centres = self._filterOtherRectangles()
-        if hamcodes is not None and len(hamcodes) > 0:
-            self._ham_id_to_rect_centres = self._findHamcodesRectangles()
-        for rect_centre in self._filtered_rectangle_centres:
-            self._holes.append(self._rectangles[self._centres_to_indices[rect_centre]])
+            self._filtered_mask = self._filterOtherRectangles()
+            filtered_indices = np.flatnonzero(self._filtered_mask)
+            self._filtered_rectangle_centres = [self._rectangles[i][0] for i in filtered_indices]
+            self._holes = [self._rectangles[i] for i in filtered_indices]
+            if hamcodes is not None and len(hamcodes) > 0:
+                matches = self._findHamcodesRectangles()
+                for hamcode, hamcode_matches in zip(self._hamcodes, matches):
+                    if hamcode_matches.any():
+                        # If several rectangles match, the last one is kept
+                        last_match = filtered_indices[np.flatnonzero(hamcode_matches)[-1]]
+                        self._ham_id_to_rect_centres[hamcode.id] = self._rectangles[last_match][0]
 
     def _initStructures(self):
         """
@@ -76,6 +105,8 @@ class UpperHolesDetector(object):
             data.append(rect[0])
         self._filtered_rectangle_centres = data
         if len(data) > 0:
+            self._centres = np.array(data, dtype=np.float64)
+            self._long_vectors, self._long_norms, self._short_norms = geom.get_boxes_info(boxes)
             return KDTree(data), centres_to_indices, boxes
         else:
             return None, None, None
@@ -107,89 +138,173 @@ class UpperHolesDetector(object):
     #     return filtered_rectangle_centres
 
     def _filterOtherRectangles(self):
-        filtered_rectangle_centres = []
-        contains_map = {}
+        """
+        :return: the boolean mask of the rectangles that have at least one neighbour rectangle
+                 that can be the next upper hole
+        :rtype: np.ndarray
+        Filters the rectangles that can not be upper holes.
+        Each pair of rectangles is tested at once, using (N, N) arrays.
+        """
         # The ratio between the hole length + the horizontal space and the hole length
         model_hole_space_ratio = (self._model.hole_length + self._model.hole_h_space) / self._model.hole_length
         model_length_width_ratio = (self._model.hole_length / self._model.hole_width)
-        for centre in self._filtered_rectangle_centres:
-            if not contains_map.get(centre, False):
-                box = self._boxes[self._centres_to_indices[centre]]
-                ((box_vector, box_length), (_, box_width)) = geom.get_box_info(box)
-                max_distance = 0.5 * box_length
-                # If the rectangle is not too small and the length/width ratio is the ratio expected by the _model
-                if box_length > 30 and geom.are_ratio_similar(box_length / box_width, model_length_width_ratio, 1.75):
-                    for other_centre in self._filtered_rectangle_centres:
-                        if other_centre is not centre:
-                            other_box = self._boxes[self._centres_to_indices[other_centre]]
-                            ((other_box_vector, other_box_length),(_, other_box_width)) = geom.get_box_info(other_box)
-                            centres_vector = geom.vectorize(centre, other_centre)
-                            # If the other rectangle is not too small and the length/width ratio
-                            #   is the ratio expected by the _model
-                            #   and : the two rectangle have the same length
-                            #   and : the distance between the _rectangles is the distance expected by the _model
-                            #   and : the vector of the long_side of the rectangle and the vector that binds the
-                            #       two centres is approximately parallel
-                            if other_box_length > 30 \
-                                    and geom.are_ratio_similar(other_box_length / other_box_width,
-                                                               model_length_width_ratio, 1.75) \
-                                    and geom.are_vectors_similar(box_vector, other_box_vector, max_distance,
-                                                                 signed=False) \
-                                    and geom.are_ratio_similar(np.linalg.norm(centres_vector) / box_length,
-                                                               model_hole_space_ratio, 0.25) \
-                                    and geom.are_vectors_parallel(box_vector, centres_vector, 0.4):
-
-                                if not contains_map.get(centre, False):
-                                    filtered_rectangle_centres.append(centre)
-                                    contains_map[centre] = True
-                                if not contains_map.get(other_centre, False):
-                                    filtered_rectangle_centres.append(other_centre)
-                                    contains_map[other_centre] = True
-        return filtered_rectangle_centres
+        lengths = self._long_norms[:, np.newaxis]
+        long_vectors = self._long_vectors[:, np.newaxis, :]
+        # Vectors that bind the centre of the rectangle of the row to the centre of the rectangle of the column
+        centres_vectors = geom.vectorize_points(self._centres[:, np.newaxis, :], self._centres[np.newaxis, :, :])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # If the rectangle is not too small and the length/width ratio is the ratio expected by the _model
+            valid = (self._long_norms > 30) \
+                & geom.are_ratio_similar(self._long_norms / self._short_norms, model_length_width_ratio, 1.75)
+            # Both rectangles are valid
+            #   and : the two rectangle have the same length
+            #   and : the distance between the _rectangles is the distance expected by the _model
+            #   and : the vector of the long_side of the rectangle and the vector that binds the
+            #       two centres is approximately parallel
+            pairs = valid[:, np.newaxis] & valid[np.newaxis, :] \
+                & geom.similar_vectors_mask(long_vectors, self._long_vectors[np.newaxis, :, :], 0.5 * lengths) \
+                & geom.are_ratio_similar(geom.vectors_norms(centres_vectors) / lengths, model_hole_space_ratio, 0.25) \
+                & geom.parallel_vectors_mask(long_vectors, centres_vectors, 0.4)
+        np.fill_diagonal(pairs, False)
+        filtered_mask = np.zeros(len(pairs), dtype=bool)
+        for i in np.flatnonzero(pairs.any(axis=1)):
+            # A rectangle that has already been kept as the neighbour of another one does not add its own neighbours
+            if not filtered_mask[i]:
+                filtered_mask[i] = True
+                filtered_mask |= pairs[i]
+        return filtered_mask
 
     def _findHamcodesRectangles(self):
-        hamcodes_id_to_rect_centres = {}
-        for hamcode in self._hamcodes:
-            hamcode.contours = geom.sort_rectangle_corners(hamcode.contours)
-            ham_long_vector = geom.vectorize(hamcode.contours[0], hamcode.contours[1])
-            for rect_centre in self._filtered_rectangle_centres:
-                ((long_vector, long_norm), (_, _)) = geom.get_box_info(self._boxes[self._centres_to_indices[rect_centre]])
-                if geom.are_vectors_parallel(long_vector, ham_long_vector, 0.25):
-                    hamcode_vector = geom.vectorize(hamcode.contours[0], hamcode.contours[1])
-                    centers_vector = geom.vectorize(hamcode.center, rect_centre)
-                    model_ratio = (self._model.hamcode_v_margin + (self._model.hamcode_side / 2.)
-                                   - self._model.hole_v_margin - (self._model.hole_width / 2.)) / self._model.hamcode_side
-                    image_ratio = np.linalg.norm(centers_vector) / np.linalg.norm(hamcode_vector)
-                    if geom.are_ratio_similar(image_ratio, model_ratio, 1.3):
-                        hamcodes_id_to_rect_centres[hamcode.id] = rect_centre
-        return hamcodes_id_to_rect_centres
-
-    def match3DModel(self, camera_matrix, camera_dist, res=640, min_nb_of_codes=2):
+        """
+        :return: the (H, R) boolean mask that tells, for each Hamming code, which of the R filtered rectangles
+                 can be the upper hole that goes with it
+        :rtype: np.ndarray
+        Match the Hamming codes with the filtered rectangles.
+        """
+        filtered_indices = np.flatnonzero(self._filtered_mask)
+        model_ratio = (self._model.hamcode_v_margin + (self._model.hamcode_side / 2.)
+                       - self._model.hole_v_margin - (self._model.hole_width / 2.)) / self._model.hamcode_side
+        ham_vectors = np.zeros((len(self._hamcodes), 2))
+        ham_centres = np.zeros((len(self._hamcodes), 2))
+        for i, hamcode in enumerate(self._hamcodes):
+            ham_vectors[i] = np.subtract(hamcode.contours[1], hamcode.contours[0])
+            ham_centres[i] = hamcode.center
+        ham_norms = geom.vectors_norms(ham_vectors)[:, np.newaxis]
+        centres_distances = geom.points_distances(ham_centres[:, np.newaxis, :],
+                                                  self._centres[filtered_indices][np.newaxis, :, :])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return geom.parallel_vectors_mask(ham_vectors[:, np.newaxis, :],
+                                              self._long_vectors[filtered_indices][np.newaxis, :, :], 0.25) \
+                & geom.are_ratio_similar(centres_distances / ham_norms, model_ratio, 1.3)
+
+    def getCorrespondences(self, res=640):
+        """
+        :param res: The resolution (width in pixels) of the image in which the Hamming codes were detected
+        :type res: int
+        :return: (object_points, image_points) : the (4*N, 3) corners of the N Hamming codes of the model that were
+                 read correctly and the (4*N, 2) corners found in the image, in the same order
+        :rtype: tuple
+        Get the correspondences between the model and the image given by the Hamming codes of the last detection
+        """
         if self._hamcodes is None:
             raise NotImplementedError("The current 3D matching algorithm uses Hamming codes and can't work without")
         res_diff = res/320.  # Because the calibration was made using 320x240 images
         object_points = []
         image_points = []
-        nb_of_codes = 0
         for hamcode in self._hamcodes:
             hole_id = int(round(int(hamcode.id)/1000))-1
             if 0 <= hole_id <= 6:  # If the code has been read correctly and is one of the Connect 4 Hamming codes
-                nb_of_codes += 1
                 object_points.extend(self._model.getHamcode(hole_id))
-                # image_points.append(np.uint16(geom.sort_rectangle_corners(hamcode.contours)/res_diff))
                 image_points.extend(hamcode.contours)
-                # if self._ham_id_to_rect_centres.get(hamcode.id) is not None:
-                #     object_points.extend(self._model.getUpperHole(hole_id))
-                #     image_points.extend(self._boxes[self._centres_to_indices[self._ham_id_to_rect_centres[hamcode.id]]])
+        object_points = np.reshape(np.array(object_points, dtype=np.float64), (-1, 3))
+        image_points = np.reshape(np.array(image_points, dtype=np.float64), (-1, 2)) / res_diff
+        return object_points, image_points
+
+    def match3DModel(self, camera_matrix, camera_dist, res=640, min_nb_of_codes=2, guess=None):
+        """
+        :param camera_matrix: The intrinsic camera matrix that can be get via camera calibration
+        :type camera_matrix: np.matrix
+        :param camera_dist: The intrinsic camera distortion coefficients that can be get via camera calibration
+        :type camera_dist: np.array
+        :param res: The resolution (width in pixels) of the image in which the Hamming codes were detected
+        :type res: int
+        :param min_nb_of_codes: The minimum number of Hamming codes needed to find the 3D coordinates
+        :type min_nb_of_codes: int
+        :param guess: (rvec, tvec) the previous pose of the board, used as a starting point by SolvePnP, can be None
+        :type guess: tuple
+        :return: (rvec, tvec) : rvec = rotation vector, tvec translation vector
+        :rtype tuple:
+        Find the 3D coordinates of the Connect 4 using the Hamming codes
+        """
+        object_points, image_points = self.getCorrespondences(res)
+        nb_of_codes = len(object_points) / 4
         if nb_of_codes < min_nb_of_codes:
             raise NotEnoughLandmarksException(
                 "The model needs at least " + str(min_nb_of_codes) + " detected codes")
-        for i in range(len(image_points)):
-            image_points[i] = tuple(image_points[i])
-            object_points[i] = tuple(object_points[i])
-        object_points = np.array(object_points)
-        image_points = np.array(image_points) / res_diff
-        retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist)
+        # The corners are sorted from the image : when a code is seen rotated by more than 45 degrees, or at a steep
+        #   angle, its northern side is another side. Starting from each rotation applied to every code, the rotation
+        #   of each code is then chosen as the one that best fits the model, and the best solution is kept.
+        image_corners = image_points.reshape(-1, 4, 2)
+        best = None
+        for rotation in range(4):
+            rotations = np.full(nb_of_codes, rotation, dtype=np.intp)
+            for _ in range(MAX_ROTATION_REFINEMENTS):
+                solution = self._solveRotatedCorners(object_points, image_corners, rotations, camera_matrix,
+                                                     camera_dist, guess)
+                if solution is None:
+                    break
+                error, rvec, tvec, best_rotations = solution
+                if best is None or error < best[0]:
+                    best = (error, rotations, rvec, tvec)
+                if (best_rotations == rotations).all():
+                    break
+                rotations = best_rotations
+        if best is None:
+            raise NotEnoughLandmarksException("SolvePnP failed to find the pose of the Hamming codes")
+        _, rotations, rvec, tvec = best
+        valid_hamcodes = [hamcode for hamcode in self._hamcodes if 0 <= int(round(int(hamcode.id)/1000))-1 <= 6]
+        for hamcode, rotation in zip(valid_hamcodes, rotations):
+            hamcode.contours = list(np.reshape(hamcode.contours, (4, 2))[ROTATED_CORNERS[rotation]])
+        return rvec, tvec
+
+    @staticmethod
+    def _solveRotatedCorners(object_points, image_corners, rotations, camera_matrix, camera_dist, guess=None):
+        """
+        :param object_points: the (4*N, 3) corners of the N Hamming codes of the model
+        :type object_points: np.ndarray
+        :param image_corners: the (N, 4, 2) sorted corners of the N Hamming codes found in the image
+        :type image_corners: np.ndarray
+        :param rotations: the (N,) indices, in ROTATED_CORNERS, of the rotation applied to the corners of each code
+        :type rotations: np.ndarray
+        :param camera_matrix: The intrinsic camera matrix
+        :type camera_matrix: np.matrix
+        :param camera_dist: The intrinsic camera distortion coefficients
+        :type camera_dist: np.array
+        :param guess: (rvec, tvec) the previous pose of the board, used as a starting point by SolvePnP, can be None
+        :type guess: tuple
+        :return: (error, rvec, tvec, best_rotations) : the mean reprojection error of the corners, in pixels, the
+                 pose found using the rotated corners and the rotation of each code that best fits this pose.
+                 None if SolvePnP failed.
+        :rtype: tuple
+        """
+        rotated_corners = image_corners[np.arange(len(rotations))[:, np.newaxis], np.take(ROTATED_CORNERS, rotations,
+                                                                                          axis=0)]
+        image_points = rotated_corners.reshape(-1, 2)
+        if guess is None:
+            retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist)
+        else:
+            retval, rvec, tvec = cv2.solvePnP(object_points, image_points, camera_matrix, camera_dist,
+                                              np.float64(guess[0]).copy(), np.float64(guess[1]).copy(),
+                                              useExtrinsicGuess=True)
         if not retval:
-            print "ERR: SolvePnP failed"
+            return None
+        projected, _ = cv2.projectPoints(object_points, rvec, tvec, camera_matrix, camera_dist)
+        projected = projected.reshape(-1, 4, 2)
+        error = np.mean(geom.vectors_norms(projected - rotated_corners))
+        # The (N, 4) mean error of each code for each rotation of its corners
+        errors = np.mean(geom.vectors_norms(projected[:, np.newaxis] - image_corners[:, ROTATED_CORNERS]), axis=2)
+        return error, rvec, tvec, np.argmin(errors, axis=1)
+        _, rotation, rvec, tvec = best
+        for hamcode in self._hamcodes:
+            hamcode.contours = list(np.reshape(hamcode.contours, (4, 2))[ROTATED_CORNERS[rotation]])
         return rvec, tvec
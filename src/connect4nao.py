@@ -17,13 +17,13 @@ Commands:
    ik            Make NAO grab and drop a disc in the given hole
    play          (Prototype) play the Connect 4 autonomously
 """
+import atexit
 import threading
 from time import sleep
 
 import cv2
 from docopt import docopt
 from hampy import detect_markers
-from naoqi import ALBroker, ALModule, ALProxy
 
 from ai.connect4 import disc
 from ai.connect4.c4_state import C4State
@@ -37,9 +37,10 @@ from connect4.detector.front_holes import FrontHolesGridNotFoundException
 from connect4.detector.upper_hole import NotEnoughLandmarksException
 from connect4.image.default_image import DefaultConnect4Image
 from connect4.model.default_model import DefaultModel
-from nao import data
+from nao import data, recording, simulator
 from nao.controller.motion import MotionController
 from nao.controller.video import VideoController
+from nao.proxy import create_proxy
 from prototype.loop import LogicalLoop
 
 __author__ = 'Anthony Rouneau'
@@ -63,7 +64,14 @@ BOARD = """Usage: connect4nao.py board [options]
   --sloped                  If set, the detection consider the board as sloped
 
   --ip=<ip>                 IP of the robot [default: 169.254.254.250].
+                            simulator = a simulated robot (see nao.simulator)
   --port=<int>              Port of the robot [default: 9559].
+  --record=<dir>            Record the frames and the calls made to the robot in this directory
+  --replay=<dir>            Replay a recording (see --record) instead of using the robot
+  --replay-speed=<float>    Speed of the replay [default: 0].
+                            1 = speed of the recording (at least 1 to pace the replay),
+                            0 = as fast as possible, each frame served in order when it is consumed
+  --latency=<float>         Latency of the simulated robot, in seconds [default: 0].
   --dist=<int>              Defines the distance in meters [default: 1.0]
                             between the robot and the game board
   --min-detections=<int>    Defines the minimum number of stable detections [default: 3]
@@ -71,6 +79,8 @@ BOARD = """Usage: connect4nao.py board [options]
   --cam-no=<int>            Defines the camera used [default: 0].
                             If the robot is used : 0=Top_Camera, 1=Bottom_Camera,
                             otherwise, defines the camera hardware used.
+  --hough-params=<file>     The JSON file of the HoughCircles parameters tuned for each distance
+                            (see camera.calibration.auto_tune). If not set, default parameters are used.
 """
 
 MARKERS = """Usage: connect4nao.py markers [options]
@@ -80,7 +90,16 @@ MARKERS = """Usage: connect4nao.py markers [options]
   --no-robot        Uses a camera of the computer stream rather than the robot
 
   --ip=<str>        IP of the robot [default: 169.254.254.250].
+                    simulator = a simulated robot (see nao.simulator)
   --port=<int>      Port of the robot [default: 9559].
+  --record=<dir>    Record the frames and the calls made to the robot in this directory
+  --replay=<dir>    Replay a recording (see --record) instead of using the robot
+  --replay-speed=<float>
+                    Speed of the replay [default: 0].
+                    1 = speed of the recording (at least 1 to pace the replay),
+                    0 = as fast as possible, each frame served in order when it is consumed
+  --latency=<float>
+                    Latency of the simulated robot, in seconds [default: 0].
   --cam-no=<int>    Defines the camera used [default: 1].
                     If the robot is used : 0=Top_Camera, 1=Bottom_Camera,
                     otherwise, defines the camera hardware used.
@@ -94,7 +113,14 @@ STATE = """Usage: connect4nao.py state [options]
   --sloped                  If set, the detection consider the board as sloped
 
   --ip=<ip>                 IP of the robot [default: 169.254.254.250].
+                            simulator = a simulated robot (see nao.simulator)
   --port=<int>              Port of the robot [default: 9559].
+  --record=<dir>            Record the frames and the calls made to the robot in this directory
+  --replay=<dir>            Replay a recording (see --record) instead of using the robot
+  --replay-speed=<float>    Speed of the replay [default: 0].
+                            1 = speed of the recording (at least 1 to pace the replay),
+                            0 = as fast as possible, each frame served in order when it is consumed
+  --latency=<float>         Latency of the simulated robot, in seconds [default: 0].
   --dist=<int>              Defines the distance in meters [default: 1]
                             between the robot and the game board
   --min-detections=<int>    Defines the minimum number of stable detections [default: 3]
@@ -115,7 +141,14 @@ COORDINATES = """Usage: connect4nao.py coordinates [options]
   --sloped                  If set, the detection consider the board as sloped, used if --board is set
 
   --ip=<ip>                 IP of the robot [default: 169.254.254.250].
+                            simulator = a simulated robot (see nao.simulator)
   --port=<int>              Port of the robot [default: 9559].
+  --record=<dir>            Record the frames and the calls made to the robot in this directory
+  --replay=<dir>            Replay a recording (see --record) instead of using the robot
+  --replay-speed=<float>    Speed of the replay [default: 0].
+                            1 = speed of the recording (at least 1 to pace the replay),
+                            0 = as fast as possible, each frame served in order when it is consumed
+  --latency=<float>         Latency of the simulated robot, in seconds [default: 0].
   --hole=<int>              Defines the hole from which we want to detect the position [default: 3]
   --dist=<int>              Defines the distance in meters [default: 1]
                             between the robot and the game board, used if --board is set.
@@ -133,8 +166,20 @@ IK = """Usage: connect4nao.py ik [options]
                     assume it already has one.
 
   --ip=<str>        IP of the robot [default: 169.254.254.250].
+                    simulator = a simulated robot (see nao.simulator)
   --port=<int>      Port of the robot [default: 9559].
+  --record=<dir>    Record the frames and the calls made to the robot in this directory
+  --replay=<dir>    Replay a recording (see --record) instead of using the robot
+  --replay-speed=<float>
+                    Speed of the replay [default: 0].
+                    1 = speed of the recording (at least 1 to pace the replay),
+                    0 = as fast as possible, each frame served in order when it is consumed
+  --latency=<float>
+                    Latency of the simulated robot, in seconds [default: 0].
   --hole=<int>      Defines the hole in which we want to drop a disc [default: 2]
+  --arm-table=<file>
+                    The learned angles of the left arm (see ai.motion.learning.build_arm_table),
+                    used instead of the Cartesian solver to place the hand above the hole.
   --ppA=FLOAT       The perfect position accuracy in meters. While the robot is not located to the perfect
                     position, with a sharper accuracy than ppA, the robot continues to move
                     [default: 0.05]
@@ -153,9 +198,18 @@ PLAY = """Usage: connect4nao.py play [options]
   --sloped                  If set, the detection consider the board as sloped
   --no-grab                 If set, NAO will not grab a disc and will
                             assume it already has one.
+  --pipeline                If set, both cameras are captured at once and the board is
+                            detected in their frames in background.
 
   --ip=<ip>                 IP of the robot [default: 169.254.254.250].
+                            simulator = a simulated robot (see nao.simulator)
   --port=<int>              Port of the robot [default: 9559].
+  --record=<dir>            Record the frames and the calls made to the robot in this directory
+  --replay=<dir>            Replay a recording (see --record) instead of using the robot
+  --replay-speed=<float>    Speed of the replay [default: 0].
+                            1 = speed of the recording (at least 1 to pace the replay),
+                            0 = as fast as possible, each frame served in order when it is consumed
+  --latency=<float>         Latency of the simulated robot, in seconds [default: 0].
   --dist=<int>              Defines the distance in meters [default: -1.0]
                             between the robot and the game board (-1 = unknown)
   --min-detections=<int>    Defines the minimum number of stable detections [default: 3]
@@ -165,6 +219,8 @@ PLAY = """Usage: connect4nao.py play [options]
   --other-strategy=<str>    Defines the strategy of the other player [default: human].
                             Can be either vision (vision state analysis) or human (human-controlled).
   --max-depth=<int>         Defines the maximum depth of the alpha-beta exploration [default: 6]
+  --arm-table=<file>        The learned angles of the left arm (see ai.motion.learning.build_arm_table),
+                            used instead of the Cartesian solver to place the hand above the hole.
   --ppA=FLOAT               The perfect position accuracy in meters. While the robot is not located to the perfect
                             position, with a sharper accuracy than ppA, the robot continues to move
                             [default: 0.05]
@@ -191,30 +247,42 @@ event = threading.Event()
 callbackObject = None
 memory_proxy = None
 broker = None
+# The recording of the robot, if it is replayed (see --replay)
+replay = None
+# The simulated robot, if it is used instead of a real one (see --ip)
+simulated_robot = None
 
 
-class HeadSensorCallbackModule(ALModule):
-    """ Mandatory docstring
-        Module that will be used to react to the "Head touched" event.
+def create_head_sensor_module():
     """
+    :return: the module that will be used to react to the "Head touched" event, registered in the broker
+    :rtype: naoqi.ALModule
+    """
+    # NAOqi is only needed to talk to a real robot
+    from naoqi import ALModule
 
-    def __init__(self):
-        global memory_proxy, callbackObject, reg_id
-        self._module_name = "callbackObject"
-        ALModule.__init__(self, self._module_name)
-
-    # Call back function registered with subscribeOnDataChange that handles
-    # changes in LandMarkDetection results.
-    def headTouched(self, eventName, val, subscriberId):
-        """ Mandatory docstring.
-            Method that will be called by the "headTouched" event.
+    class HeadSensorCallbackModule(ALModule):
+        """ Mandatory docstring
+            Module that will be used to react to the "Head touched" event.
         """
-        memory_proxy.unsubscribeToEvent("FrontTactilTouched", "callbackObject")
-        memory_proxy.unsubscribeToEvent("MiddleTactilTouched", "callbackObject")
-        memory_proxy.unsubscribeToEvent("RearTactilTouched", "callbackObject")
-        global event
-        nao_motion.motion_proxy.closeHand("LHand")
-        event.set()
+
+        def __init__(self):
+            self._module_name = "callbackObject"
+            ALModule.__init__(self, self._module_name)
+
+        # Call back function registered with subscribeOnDataChange that handles
+        # changes in LandMarkDetection results.
+        def headTouched(self, eventName, val, subscriberId):
+            """ Mandatory docstring.
+                Method that will be called by the "headTouched" event.
+            """
+            memory_proxy.unsubscribeToEvent("FrontTactilTouched", "callbackObject")
+            memory_proxy.unsubscribeToEvent("MiddleTactilTouched", "callbackObject")
+            memory_proxy.unsubscribeToEvent("RearTactilTouched", "callbackObject")
+            nao_motion.motion_proxy.closeHand("LHand")
+            event.set()
+
+    return HeadSensorCallbackModule()
 
 
 class DiscNotObtainedException(BaseException):
@@ -226,6 +294,41 @@ class DiscNotObtainedException(BaseException):
         super(DiscNotObtainedException, self).__init__(msg)
 
 
+def connect(args):
+    """
+    :param args: the arguments of the command
+    :type args: dict
+    Set the address of the robot and, if asked, simulate the robot,
+    record the calls made to the robot or replay a recording
+    """
+    global replay, simulated_robot
+    data.IP = args['--ip']
+    data.PORT = int(args['--port'])
+    if data.IP == simulator.SIMULATOR_IP:
+        # The Hamming codes are drawn on the simulated board so that NAO can place its hand above the holes
+        simulated_robot = simulator.start_simulator(latency=float(args.get('--latency') or 0),
+                                                    marker_images=simulator.hamming_marker_images())
+    if args.get('--record'):
+        recorder = recording.start_recording(args['--record'])
+        atexit.register(recorder.close)
+    elif args.get('--replay'):
+        speed = float(args.get('--replay-speed') or 0)
+        replay = recording.start_replay(args['--replay'], speed if speed >= 1 else None)
+
+
+def create_broker():
+    """
+    :return: the broker that receives the events of the robot,
+             or None if a recording is replayed or if the robot is simulated
+    :rtype: ALBroker
+    """
+    if replay is not None or simulated_robot is not None:
+        return None
+    # NAOqi is only needed to talk to a real robot
+    from naoqi import ALBroker
+    return ALBroker("myBroker", "0.0.0.0", 0, data.IP, data.PORT)
+
+
 def close_camera():
     global nao_video, cap, nao_motion
     if nao_video is not None:
@@ -284,13 +387,18 @@ def wait_for_disc(timeout=180000):
     """
     global event, callbackObject, broker, memory_proxy
     nao_motion.setLeftArmToAskingPosition()
+    if replay is not None or simulated_robot is not None:
+        # Nobody can touch the head : the disc is given at once
+        nao_motion.motion_proxy.closeHand("LHand")
+        nao_motion.setLeftArmRaised()
+        return
     # self.memory_proxy.subscribeToEvent("FrontTactilTouched", "HeadSensorCallbackModule", "HeadTouched")
     if callbackObject is None:
-        callbackObject = HeadSensorCallbackModule()
+        callbackObject = create_head_sensor_module()
 
     # Preparing the callback method
     if memory_proxy is None:
-        memory_proxy = ALProxy("ALMemory", data.IP, data.PORT)
+        memory_proxy = create_proxy("ALMemory")
 
     memory_proxy.subscribeToEvent("FrontTactilTouched", "callbackObject", "headTouched")
     memory_proxy.subscribeToEvent("MiddleTactilTouched", "callbackObject", "headTouched")
@@ -336,12 +444,12 @@ def game(args):
 
 def board(args):
     global nao_motion
-    data.IP = args['--ip']
-    data.PORT = int(args['--port'])
+    connect(args)
     next_img_func = get_nao_image
     if args['--no-robot']:
         next_img_func = get_webcam_image
-    myc4 = Connect4Handler(next_img_func, cam_no=int(args['--cam-no']))
+    myc4 = Connect4Handler(next_img_func, cam_no=int(args['--cam-no']),
+                           hough_parameters_file=args['--hough-params'])
     dist = float(args['--dist'])
     sloped = args['--sloped']
     tries = int(args['--min-detections'])
@@ -365,8 +473,7 @@ def board(args):
 
 def markers(args, must_print=True):
     global nao_motion
-    data.IP = args['--ip']
-    data.PORT = int(args['--port'])
+    connect(args)
     next_img_func = get_nao_image
     try:
         if args['--no-robot']:
@@ -404,8 +511,7 @@ def state(args):
     print
     print "-1 = Empty, 0 = Red, 1 = Green"
     print
-    data.IP = args['--ip']
-    data.PORT = int(args['--port'])
+    connect(args)
     next_img_func = get_nao_image
     if args['--no-robot']:
         next_img_func = get_webcam_image
@@ -440,8 +546,7 @@ def state(args):
 
 
 def coordinates(args):
-    data.IP = args['--ip']
-    data.PORT = int(args['--port'])
+    connect(args)
     global nao_motion
     nao_motion = MotionController()
     camera_position_func = nao_motion.getCameraBottomPositionFromTorso
@@ -501,13 +606,13 @@ def coordinates(args):
 
 def ik(args):
     global broker, nao_motion, nao_video
-    data.IP = args['--ip']
-    data.PORT = int(args['--port'])
-    broker = ALBroker("myBroker", "0.0.0.0", 0, data.IP, data.PORT)
-    nao_motion = MotionController()
+    connect(args)
+    broker = create_broker()
+    nao_motion = MotionController(arm_table_file=args['--arm-table'])
     nao_video = VideoController()
     nao_motion.stand()
-    nao_tts = ALProxy("ALTextToSpeech", data.IP, data.PORT)
+    nao_tts = create_proxy("ALTextToSpeech")
+    loop = None
     try:
         loop = LogicalLoop(nao_motion=nao_motion, nao_video=nao_video, nao_tts=nao_tts,
                            ppA=float(args['--ppA']), cA=float(args['--cA']), rA=float(args['--rA']),
@@ -521,7 +626,11 @@ def ik(args):
         nao_motion.crouch()
     except KeyboardInterrupt:
         print "Keyboard interrupt"
-        broker.shutdown()
+        if broker is not None:
+            broker.shutdown()
+    finally:
+        if loop is not None:
+            loop.close()
     return 0
 
 
@@ -541,23 +650,26 @@ def play(args):
         exit("{0} is not a valid strategy. The valid strategies for the other player are "
              "vision and human".format(args['--other-strategy']))
     basic.ALPHA_BETA_MAX_DEPTH = int(args['--max-depth'])
-    data.IP = args['--ip']
-    data.PORT = int(args['--port'])
-    broker = ALBroker("myBroker", "0.0.0.0", 0, data.IP, data.PORT)
-    nao_motion = MotionController()
+    connect(args)
+    broker = create_broker()
+    nao_motion = MotionController(arm_table_file=args['--arm-table'])
     nao_video = VideoController()
-    nao_tts = ALProxy("ALTextToSpeech", data.IP, data.PORT)
+    nao_tts = create_proxy("ALTextToSpeech")
+    loop = None
     try:
         loop = LogicalLoop(nao_motion=nao_motion, nao_video=nao_video, nao_tts=nao_tts,
                            ppA=float(args['--ppA']), cA=float(args['--cA']), rA=float(args['--rA']),
                            min_detections=int(args['--min-detections']), sloped=args['--sloped'],
                            dist=float(args['--dist']), nao_strategy=nao_strat, other_strategy=other_strat,
-                           wait_disc_func=wait_for_disc, )
+                           wait_disc_func=wait_for_disc, use_pipeline=args['--pipeline'])
         loop.loop()
     except KeyboardInterrupt:
         print "Keyboard interrupt"
     finally:
-        broker.shutdown()
+        if loop is not None:
+            loop.close()
+        if broker is not None:
+            broker.shutdown()
     return 0
 
 
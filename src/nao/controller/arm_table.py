@@ -0,0 +1,131 @@
+import numpy as np
+
+__author__ = 'Anthony Rouneau'
+
+# The maximum distance, in meters, between a queried position and the nearest learned position
+DEFAULT_MAX_DISTANCE = 0.02
+# The number of learned positions interpolated by a query
+DEFAULT_NEIGHBOURS = 4
+# The maximum difference, in radians, between the rotation of a queried position and a learned rotation
+DEFAULT_MAX_ROTATION = 0.1
+# The positions closer than this distance, in meters, are merged into one entry when the table is fitted
+MERGE_DISTANCE = 0.002
+# ... if their rotations are also closer than this angle, in radians
+MERGE_ANGLE = 0.02
+
+
+def fit_arm_table(samples, joint_names, max_distance=DEFAULT_MAX_DISTANCE, neighbours=DEFAULT_NEIGHBOURS,
+                  max_rotation=DEFAULT_MAX_ROTATION):
+    """
+    :param samples: the samples (x, y, z, Wx, Wy, Wz, angle_1, ..., angle_n) : the 6D position of the hand from the
+                    torso, followed by the angles of the joints of the arm that placed it there
+    :type samples: np.ndarray
+    :param joint_names: the names of the n joints of the angles
+    :type joint_names: list
+    :param max_distance: see ArmLookupTable
+    :type max_distance: float
+    :param neighbours: see ArmLookupTable
+    :type neighbours: int
+    :param max_rotation: see ArmLookupTable
+    :type max_rotation: float
+    :return: the table that gives the angles of the arm for a position of the hand.
+             The samples whose positions are closer than MERGE_DISTANCE and whose rotations are closer than
+             MERGE_ANGLE are averaged into one entry.
+    :rtype: ArmLookupTable
+    """
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, 6 + len(joint_names))
+    cells = np.column_stack((np.round(samples[:, 0:3] / MERGE_DISTANCE),
+                             np.round(samples[:, 3:6] / MERGE_ANGLE))).astype(np.int64)
+    _, entries = np.unique(cells, axis=0, return_inverse=True)
+    counts = np.bincount(entries).astype(np.float64)
+    poses = np.array([np.bincount(entries, samples[:, axis]) for axis in range(6)]).T / counts[:, None]
+    angles = np.array([np.bincount(entries, samples[:, 6 + joint]) for joint in range(len(joint_names))]).T
+    return ArmLookupTable(poses[:, 0:3], poses[:, 3:6], angles / counts[:, None], joint_names, max_distance,
+                          neighbours, max_rotation)
+
+
+def load_arm_table(file_name):
+    """
+    :param file_name: the file written by ArmLookupTable.save
+    :type file_name: str
+    :rtype: ArmLookupTable
+    """
+    with np.load(file_name) as content:
+        return ArmLookupTable(content["positions"], content["rotations"], content["angles"],
+                              content["joint_names"].tolist(), float(content["max_distance"]),
+                              int(content["neighbours"]), float(content["max_rotation"]))
+
+
+class ArmLookupTable(object):
+    """
+    Gives the angles of the joints of an arm that place its hand at a position, interpolated from the learned
+        positions around it, so that the arm can be moved in the joint space without the Cartesian solver of NAOqi.
+    """
+
+    def __init__(self, positions, rotations, angles, joint_names, max_distance=DEFAULT_MAX_DISTANCE,
+                 neighbours=DEFAULT_NEIGHBOURS, max_rotation=DEFAULT_MAX_ROTATION):
+        """
+        :param positions: the (N, 3) learned positions (x, y, z) of the hand from the torso
+        :type positions: np.ndarray
+        :param rotations: the (N, 3) learned rotations (Wx, Wy, Wz) of the hand at each position, in radians
+        :type rotations: np.ndarray
+        :param angles: the (N, n) angles, in radians, of the joints that place the hand at each position
+        :type angles: np.ndarray
+        :param joint_names: the names of the n joints
+        :type joint_names: list
+        :param max_distance: the maximum distance, in meters, between a queried position and the nearest learned
+                             one. The positions further than this are not known by the table.
+        :type max_distance: float
+        :param neighbours: the number of nearest learned positions interpolated by a query
+        :type neighbours: int
+        :param max_rotation: the maximum difference, in radians, between the rotation of a queried position and the
+                             rotation of a learned one. The learned positions whose rotations differ more are not
+                             used by the query.
+        :type max_rotation: float
+        """
+        self.positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        self.rotations = np.asarray(rotations, dtype=np.float32).reshape(-1, 3)
+        self.angles = np.asarray(angles, dtype=np.float32).reshape(len(self.positions), -1)
+        self.joint_names = list(joint_names)
+        self.max_distance = max_distance
+        self.neighbours = neighbours
+        self.max_rotation = max_rotation
+
+    def __len__(self):
+        return len(self.positions)
+
+    def query(self, coord):
+        """
+        :param coord: the position of the hand from the torso, (x, y, z) or 6D. A 6D position is only matched with
+                      the learned positions whose rotations are closer than max_rotation.
+        :type coord: list
+        :return: the angles of the joints, in the order of joint_names, that place the hand at the position,
+                 interpolated by inverse distance weighting of the nearest learned positions.
+                 None if no learned position is closer than max_distance.
+        :rtype: list
+        """
+        if len(self.positions) == 0:
+            return None
+        distances = np.linalg.norm(self.positions - np.asarray(coord[0:3], dtype=np.float32), axis=1)
+        if len(coord) >= 6:
+            rotation_differences = np.mod(self.rotations - np.asarray(coord[3:6], dtype=np.float32) + np.pi,
+                                          2 * np.pi) - np.pi
+            distances[(np.abs(rotation_differences) > self.max_rotation).any(axis=1)] = np.inf
+        nearest = np.argsort(distances)[:self.neighbours]
+        if distances[nearest[0]] > self.max_distance:
+            return None
+        if distances[nearest[0]] < 1e-6:
+            return self.angles[nearest[0]].tolist()
+        # Only the positions inside the known region take part in the interpolation
+        nearest = nearest[distances[nearest] <= self.max_distance]
+        weights = 1. / distances[nearest]
+        return (np.dot(weights, self.angles[nearest]) / weights.sum()).tolist()
+
+    def save(self, file_name):
+        """
+        :param file_name: the file in which the table is written, compressed (see load_arm_table)
+        :type file_name: str
+        """
+        np.savez_compressed(file_name, positions=self.positions, rotations=self.rotations, angles=self.angles,
+                            joint_names=np.array(self.joint_names), max_distance=self.max_distance,
+                            neighbours=self.neighbours, max_rotation=self.max_rotation)
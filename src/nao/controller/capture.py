@@ -0,0 +1,309 @@
+import threading
+import time
+
+import numpy as np
+
+__author__ = 'Anthony Rouneau'
+
+
+def decode_image(nao_image, out=None):
+    """
+    :param nao_image: the image returned by ALVideoDevice.getImageRemote :
+                      [width, height, layers, color_space, seconds, microseconds, buffer, ...]
+    :type nao_image: list
+    :param out: the array in which the image is copied. If None, the image is a read-only view on the buffer.
+    :type out: np.ndarray
+    :return: the (height, width, layers) image, usable by OpenCV
+    :rtype: np.ndarray
+    """
+    img = np.reshape(np.frombuffer(nao_image[6], dtype=np.uint8), (nao_image[1], nao_image[0], nao_image[2]))
+    if out is None:
+        return img
+    np.copyto(out, img)
+    return out
+
+
+def encode_image(img, color_space=13, timestamp=None):
+    """
+    :param img: the (height, width, layers) image to encode
+    :type img: np.ndarray
+    :param color_space: the NAOqi color space of the image (13 = BGR)
+    :type color_space: int
+    :param timestamp: the time at which the image was taken, in seconds. If None, the current time is used
+    :type timestamp: float
+    :return: the image in the format returned by ALVideoDevice.getImageRemote
+    :rtype: list
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    if img.ndim == 2:
+        img = img[:, :, np.newaxis]
+    return [img.shape[1], img.shape[0], img.shape[2], color_space, int(timestamp), int((timestamp % 1) * 1e6),
+            np.ascontiguousarray(img, dtype=np.uint8).tostring()]
+
+
+class FrameRingBuffer(object):
+    """
+    A fixed number of preallocated frames, overwritten in turn by a producer and read by any number of consumers
+    """
+
+    def __init__(self, size=4):
+        """
+        :param size: the number of frames kept
+        :type size: int
+        """
+        if size < 2:
+            raise ValueError("The ring buffer needs at least two frames")
+        self.size = size
+        # The slots are allocated with the shape of the first frame
+        self._frames = None
+        self._timestamps = np.full(size, -np.inf)
+        self._count = 0
+        self._closed = False
+        # True when a consumer waits for a frame that is not captured yet (see waitForRequest)
+        self._requested = False
+        self._condition = threading.Condition()
+
+    def put(self, img, timestamp=None):
+        """
+        :param img: the frame to store, copied in the oldest slot
+        :type img: np.ndarray
+        :param timestamp: the time at which the frame was taken, in seconds. If None, the current time is used
+        :type timestamp: float
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._condition:
+            if self._frames is None or self._frames.shape[1:] != img.shape:
+                self._frames = np.empty((self.size,) + img.shape, dtype=img.dtype)
+                self._timestamps.fill(-np.inf)
+            index = self._count % self.size
+            np.copyto(self._frames[index], img)
+            self._timestamps[index] = timestamp
+            self._count += 1
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Wake up the consumers that wait for a frame : no frame will be put anymore
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def isClosed(self):
+        return self._closed
+
+    def waitForRequest(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for a request, in seconds. If None, wait until it comes
+        :type timeout: float
+        :return: True if a consumer waits for a new frame, False if the timeout expired or if the buffer was closed
+        :rtype: bool
+        Used by a producer that captures the frames on demand : each request is answered by one new frame
+        """
+        with self._condition:
+            if not self._requested and not self._closed:
+                self._condition.wait(timeout)
+            if self._requested and not self._closed:
+                self._requested = False
+                return True
+            return False
+
+    def countFrames(self):
+        """
+        :return: the number of frames put in the buffer since its creation
+        :rtype: int
+        """
+        return self._count
+
+    def _newest(self, timestamp):
+        """
+        :param timestamp: the frame must have been taken strictly after this time
+        :type timestamp: float
+        :return: (timestamp, frame copy) of the newest frame, or None if it was not taken after timestamp
+        :rtype: tuple
+        Must be called with the condition acquired
+        """
+        if self._count == 0:
+            return None
+        index = (self._count - 1) % self.size
+        if self._timestamps[index] <= timestamp:
+            return None
+        return self._timestamps[index], self._frames[index].copy()
+
+    def latest(self):
+        """
+        :return: (timestamp, frame) of the newest frame, or None if no frame was put yet
+        :rtype: tuple
+        Never waits for the producer
+        """
+        with self._condition:
+            return self._newest(-np.inf)
+
+    def nextAfter(self, timestamp, timeout=None):
+        """
+        :param timestamp: the frame must have been taken strictly after this time, in seconds
+        :type timestamp: float
+        :param timeout: the maximum time to wait for such a frame, in seconds. If None, wait until it comes
+        :type timeout: float
+        :return: (timestamp, frame) of the newest frame taken after timestamp, or None if the timeout expired
+                 or if the buffer was closed
+        :rtype: tuple
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            frame = self._newest(timestamp)
+            while frame is None and not self._closed:
+                self._requested = True
+                self._condition.notify_all()
+                if deadline is None:
+                    # A timeout keeps the wait interruptible by KeyboardInterrupt
+                    self._condition.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                frame = self._newest(timestamp)
+            return frame
+
+    def frames(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for each frame, in seconds. If None, wait until it comes
+        :type timeout: float
+        :return: an iterator on the (timestamp, frame) of the new frames. A frame overwritten before it could
+                 be read is skipped. The iteration stops when the buffer is closed or when the timeout expires.
+        :rtype: generator
+        """
+        last_timestamp = -np.inf
+        while True:
+            frame = self.nextAfter(last_timestamp, timeout)
+            if frame is None:
+                return
+            last_timestamp = frame[0]
+            yield frame
+
+
+class CaptureThread(threading.Thread):
+    """
+    Continuously grabs frames and stores them in a ring buffer, so that the consumers never wait for the grabbing
+    """
+
+    def __init__(self, grab, ring_buffer, reconnect=None, retry_delay=0.5, on_demand=False):
+        """
+        :param grab: the function that returns a new frame as (timestamp, image), or None if it failed
+        :type grab: function
+        :param ring_buffer: the buffer in which the frames are stored
+        :type ring_buffer: FrameRingBuffer
+        :param reconnect: the function called after a failed grab, before retrying. Can be None.
+        :type reconnect: function
+        :param retry_delay: the time to wait after a failed grab, in seconds
+        :type retry_delay: float
+        :param on_demand: if True, a frame is grabbed only when a consumer waits for a new one
+                          (see FrameRingBuffer.waitForRequest), so that no frame is skipped : used to replay frames
+                          as fast as they are consumed
+        :type on_demand: bool
+        """
+        super(CaptureThread, self).__init__()
+        self.daemon = True
+        self.grab = grab
+        self.ring_buffer = ring_buffer
+        self.reconnect = reconnect
+        self.retry_delay = retry_delay
+        self.on_demand = on_demand
+        self.connected = False
+        self.nb_of_failures = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self.on_demand and not self.ring_buffer.waitForRequest(self.retry_delay):
+                continue
+            try:
+                frame = self.grab()
+            except BaseException, err:
+                print "ERR: cannot grab frame : %s" % err
+                frame = None
+            if frame is not None:
+                self.connected = True
+                self.ring_buffer.put(frame[1], frame[0])
+            else:
+                self.connected = False
+                self.nb_of_failures += 1
+                if self._stop_event.wait(self.retry_delay):
+                    break
+                if self.reconnect is not None:
+                    try:
+                        self.reconnect()
+                    except BaseException, err:
+                        print "ERR: cannot reconnect : %s" % err
+        self.ring_buffer.close()
+
+    def stop(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for the thread to end, in seconds
+        :type timeout: float
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+
+class ReplayVideoDevice(object):
+    """
+    Stands in for the ALVideoDevice proxy by replaying recorded frames in a loop
+    """
+
+    def __init__(self, images, fps=None, color_space=13):
+        """
+        :param images: the recorded frames, as (height, width, layers) arrays
+        :type images: list
+        :param fps: the rate at which the frames are served. If None, getImageRemote never waits.
+        :type fps: float
+        :param color_space: the NAOqi color space of the images
+        :type color_space: int
+        """
+        self.images = images
+        self.fps = fps
+        self.color_space = color_space
+        self.subscribers = []
+        self.available = True
+        self._index = 0
+        self._last_time = None
+
+    def subscribeCamera(self, name, camera_index, resolution, color_space, fps):
+        subscriber = name + "_" + str(len(self.subscribers))
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+            return True
+        return False
+
+    def getSubscribers(self):
+        return list(self.subscribers)
+
+    def setAllCameraParametersToDefault(self, subscriber):
+        pass
+
+    def setCameraParameter(self, subscriber, parameter, value):
+        return True
+
+    def getImageRemote(self, subscriber):
+        """
+        :return: the next recorded frame, in the format of ALVideoDevice, or None if the device is not available
+        :rtype: list
+        """
+        if not self.available or len(self.images) == 0:
+            return None
+        if self.fps is not None and self._last_time is not None:
+            delay = self._last_time + 1. / self.fps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self._last_time = time.time()
+        img = self.images[self._index % len(self.images)]
+        self._index += 1
+        return encode_image(img, self.color_space, self._last_time)
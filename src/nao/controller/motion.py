@@ -1,8 +1,10 @@
 import math
-
-from naoqi import ALProxy
+import time
 
 import nao.data as nao
+from nao.controller.arm_table import load_arm_table
+from nao.controller.motion_queue import MotionFuture, MotionQueue, AWAKE, RESTING
+from nao.proxy import create_proxy
 from utils.camera import geom
 
 __author__ = "Anthony Rouneau"
@@ -14,6 +16,8 @@ FRAME_ROBOT = 2
 
 # Arm movement joints
 LARM_CHAIN = ["LShoulderPitch", "LShoulderRoll", "LElbowRoll", "LElbowYaw", "LWristYaw"]
+# The joints of the left arm in the order of getLeftArmAngles
+LARM_JOINTS = ["LShoulderPitch", "LShoulderRoll", "LElbowYaw", "LElbowRoll", "LWristYaw"]
 RARM_CHAIN = ["RShoulderPitch", "RShoulderRoll", "RElbowRoll", "RElbowYaw", "RWristYaw"]
 # Arm angles in radians :
 ARM_ALONGSIDE_BODY = [1.62, 0.32, -0.03, -1.31, -0.44]
@@ -30,16 +34,21 @@ class MotionController:
     # NAO Default head position in radians
     DEFAULT_HEAD_PITCH = -0.05
     DEFAULT_HEAD_YAW = 0.0
+    # Time, in seconds, during which the cached posture is trusted without asking the robot (see getPosture)
+    POSTURE_CACHE_DURATION = 5.0
 
     """
     Represents a virtual controller for NAO's motion system
     """
-    def __init__(self, robot_ip=None, robot_port=None):
+    def __init__(self, robot_ip=None, robot_port=None, arm_table_file=None):
         """
         :param robot_ip: The IP address of the robot
         :type robot_ip: str
         :param robot_port: The port of the robot
         :type robot_port: int
+        :param arm_table_file: the file of the learned angles of the left arm (see load_arm_table), None to place the
+                               hand with the Cartesian solver of NAOqi only
+        :type arm_table_file: str
         Creates a new Virtual Controller for NAO
         """
         if robot_ip is None:
@@ -51,11 +60,65 @@ class MotionController:
         self.port = robot_port
 
         # Connect and wake up the robot
-        self.motion_proxy = ALProxy("ALMotion", robot_ip, robot_port)
+        self.motion_proxy = create_proxy("ALMotion", robot_ip, robot_port)
         # self.motion_proxy.wakeUp()
         self.motion_proxy.setCollisionProtectionEnabled("Arms", True)
         self.motion_proxy.setMoveArmsEnabled(False, False)
         # self.moveHead(0.114, 0, radians=True)
+        # The thread that executes the motion commands, if they are asynchronous (see startMotionQueue)
+        self.motion_queue = None
+        # Cached state of the robot, used to skip the redundant posture and stiffness commands.
+        # The posture is None if unknown, the stiffness of a joint absent from the dict is the default one.
+        self.posture = None
+        self.posture_time = 0.
+        self.stiffnesses = {}
+        self.default_stiffness = None
+        # The angles of the left arm learned for the positions of the hand (see setLeftHandPosition)
+        self.arm_table = None
+        if arm_table_file is not None:
+            self.arm_table = load_arm_table(arm_table_file)
+
+    def startMotionQueue(self):
+        """
+        Execute the motion commands in a background thread from now on : the asynchronous methods (e.g. moveAtAsync)
+        return at once and the redundant posture commands are coalesced (see MotionQueue.post).
+        The synchronous methods wait for the commands posted before them.
+        """
+        if self.motion_queue is None:
+            self.motion_queue = MotionQueue()
+            self.motion_queue.start()
+
+    def stopMotionQueue(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for the pending commands to be executed, in seconds
+        :type timeout: float
+        """
+        if self.motion_queue is not None:
+            self.motion_queue.stop(timeout)
+            self.motion_queue = None
+
+    def waitForMotions(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait, in seconds. If None, wait until every command is executed
+        :type timeout: float
+        :return: True if every motion command posted has been executed
+        :rtype: bool
+        """
+        return self.motion_queue is None or self.motion_queue.waitUntilIdle(timeout)
+
+    def post(self, func, *args, **kwargs):
+        """
+        :param func: the function that executes the motion command
+        :type func: function
+        :param args: the arguments of the function
+        :param kwargs: posture : the posture reached by the command (see MotionQueue.post),
+                       after : the future of the command this one depends on
+        :return: the future of the command. If the motion queue is not started, the command is executed at once.
+        :rtype: MotionFuture
+        """
+        if self.motion_queue is None:
+            return MotionFuture.execute(func, args, kwargs.get("after"))
+        return self.motion_queue.post(func, args, kwargs.get("posture"), kwargs.get("after"))
 
     def getCameraTopPositionFromTorso(self):
         """
@@ -75,6 +138,20 @@ class MotionController:
                                              FRAME_TORSO,
                                              True)
 
+    def getTorsoHeight(self):
+        """
+        :return: The height of NAO's torso above the ground, in meters, which depends on its posture
+        :rtype: float
+        """
+        return self.motion_proxy.getPosition("Torso", FRAME_ROBOT, True)[2]
+
+    def getRobotPosition(self):
+        """
+        :return: The position (x, y, theta) of the robot in the world, given by its odometry
+        :rtype: list
+        """
+        return self.motion_proxy.getRobotPosition(True)
+
     def getLeftHandPosition(self):
         """
         :return: The 6D coordinates of the left hand of NAO
@@ -100,9 +177,25 @@ class MotionController:
         :param time_limit: The maximum time, in seconds, that the move can take. The shorter the faster.
         :type time_limit: float
         Move the hand to the given coordinates if possible.
+        If the whole position is given (mask = 63) and the arm table knows it, with the same rotation of the hand,
+            the arm is moved to the learned angles instead, without the Cartesian solver.
         """
-        self.stand()
-        self.motion_proxy.positionInterpolations("LArm", FRAME_TORSO, [tuple(coord)], mask, [time_limit])
+        self.setLeftHandPositionAsync(coord, mask, time_limit).result()
+
+    def setLeftHandPositionAsync(self, coord, mask=7, time_limit=3.0):
+        """
+        :return: the future of the move of the hand (see setLeftHandPosition)
+        :rtype: MotionFuture
+        """
+        stand = self.standAsync()
+        angles = None
+        if self.arm_table is not None and mask == 63:
+            angles = self.arm_table.query(coord)
+        if angles is not None:
+            return self.post(self.motion_proxy.angleInterpolation, self.arm_table.joint_names, angles, time_limit,
+                             True, after=stand)
+        return self.post(self.motion_proxy.positionInterpolations, "LArm", FRAME_TORSO, [tuple(coord)], mask,
+                         [time_limit], after=stand)
 
     def moveAt(self, x, y, z_rot):
         """
@@ -114,9 +207,15 @@ class MotionController:
         :type z_rot: float
         Move the robot to a certain position, defined by the three parameters.
         """
-        self.stand()
-        self.motion_proxy.wakeUp()
-        self.motion_proxy.moveTo(x, y, z_rot)
+        self.moveAtAsync(x, y, z_rot).result()
+
+    def moveAtAsync(self, x, y, z_rot):
+        """
+        :return: the future of the walk (see moveAt)
+        :rtype: MotionFuture
+        """
+        stand = self.standAsync()
+        return self.post(self.motion_proxy.moveTo, x, y, z_rot, after=stand)
 
     def getLeftArmAngles(self):
         """
@@ -124,9 +223,8 @@ class MotionController:
             [ShoulderPitch, ShoulderRoll, ElbowYaw, ElbowRoll, WristYaw]
         :rtype: list
         """
-        joint_names = ["LShoulderPitch", "LShoulderRoll", "LElbowYaw", "LElbowRoll", "LWristYaw"]
         use_sensors = True
-        return self.motion_proxy.getAngles(joint_names, use_sensors)
+        return self.motion_proxy.getAngles(LARM_JOINTS, use_sensors)
 
     def moveHead(self, pitch, yaw, radians=False):
         """
@@ -134,12 +232,21 @@ class MotionController:
         :param yaw: the future yaw of NAO's head
         :param radians: True if the angles are given in radians. False by default => angles in degree.
         """
+        self.moveHeadAsync(pitch, yaw, radians).result()
+
+    def moveHeadAsync(self, pitch, yaw, radians=False, after=None):
+        """
+        :param after: the future of the command the move depends on, can be None
+        :type after: MotionFuture
+        :return: the future of the move of the head (see moveHead)
+        :rtype: MotionFuture
+        """
         joint_names = ["HeadYaw", "HeadPitch"]
         if not radians:
             yaw = math.radians(yaw)
             pitch = math.radians(pitch)
         angles = [yaw, pitch]
-        self.motion_proxy.angleInterpolation(joint_names, angles, 1., True)
+        return self.post(self.motion_proxy.angleInterpolation, joint_names, angles, 1., True, after=after)
 
     def compareToLeftHandPosition(self, coord, must_print=False):
         """
@@ -205,39 +312,111 @@ class MotionController:
         :param dist: the supposed distance between NAO and the board
         Make NAO look to the hypothetical game board position, located at "dist" meters from the robot
         """
-        self.crouch()
+        self.lookAtGameBoardAsync(dist).result()
+
+    def lookAtGameBoardAsync(self, dist):
+        """
+        :return: the future of the move of the head (see lookAtGameBoard)
+        :rtype: MotionFuture
+        """
+        crouch = self.crouchAsync()
         height = 0.165
         b = height
         c = geom.pythagore(height, dist)  # The length of the side betwaeen NAO's head and the board to look at
         a = dist  # The difference between the theoretical position (1m) and the actual position (dist)
         pitch_angle = geom.al_kashi(b, a, c, None)
-        self.moveHead(pitch_angle, 0, radians=True)
+        return self.moveHeadAsync(pitch_angle, 0, radians=True, after=crouch)
+
+    def getPosture(self):
+        """
+        :return: the current posture of the robot (see AWAKE and RESTING).
+                 The cached posture is checked with a cheap query once it is older than POSTURE_CACHE_DURATION.
+        :rtype: str
+        """
+        if self.posture is None or time.time() - self.posture_time > self.POSTURE_CACHE_DURATION:
+            posture = AWAKE if self.motion_proxy.robotIsWakeUp() else RESTING
+            if posture != self.posture:
+                # Someone else changed the posture of the robot, the stiffnesses are not known anymore
+                self.stiffnesses = {}
+                self.default_stiffness = None
+            self._setPosture(posture, self.default_stiffness)
+        return self.posture
+
+    def _setPosture(self, posture, default_stiffness):
+        self.posture = posture
+        self.posture_time = time.time()
+        if default_stiffness != self.default_stiffness:
+            self.stiffnesses = {}
+            self.default_stiffness = default_stiffness
+
+    def invalidatePostureCache(self):
+        """
+        Forget the cached posture and stiffnesses, e.g. after the robot was moved without this controller
+        """
+        self.posture = None
+        self.stiffnesses = {}
+        self.default_stiffness = None
 
     def stand(self):
         """
-        Make the robot stand up
+        Make the robot stand up, if it is not awake yet
         """
-        if not self.motion_proxy.robotIsWakeUp():
+        self.standAsync().result()
+
+    def standAsync(self):
+        """
+        :return: the future of the command (see stand)
+        :rtype: MotionFuture
+        """
+        return self.post(self._stand, posture=AWAKE)
+
+    def _stand(self):
+        if self.getPosture() != AWAKE:
             self.motion_proxy.wakeUp()
+            self._setPosture(AWAKE, 1.)
 
     def crouch(self):
         """
         Crouch the robot, but stiff the head
         """
-        self.motion_proxy.rest()
-        self.motion_proxy.setStiffnesses("HeadPitch", 1.0)
+        self.crouchAsync().result()
+
+    def crouchAsync(self):
+        """
+        :return: the future of the command (see crouch)
+        :rtype: MotionFuture
+        """
+        return self.post(self._crouch, posture=RESTING)
+
+    def _crouch(self):
+        if self.getPosture() != RESTING:
+            self.motion_proxy.rest()
+            self._setPosture(RESTING, 0.)
+        self._setStiffnesses(["HeadPitch"], [1.0])
+
+    def _setStiffnesses(self, joint_names, stiffnesses):
+        """
+        :param joint_names: the names of the joints
+        :type joint_names: list
+        :param stiffnesses: the stiffness of each joint, between 0 and 1
+        :type stiffnesses: list
+        Set the stiffness of the joints, unless they already have it
+        """
+        if all(self.stiffnesses.get(name, self.default_stiffness) == stiffness
+               for name, stiffness in zip(joint_names, stiffnesses)):
+            return
+        self.motion_proxy.setStiffnesses(joint_names if len(joint_names) > 1 else joint_names[0],
+                                         stiffnesses if len(stiffnesses) > 1 else stiffnesses[0])
+        self.stiffnesses.update(zip(joint_names, stiffnesses))
 
     def stiffHead(self):
         """
         Set the stiffness of the head to 1 (Max stiff)
         """
-        self.motion_proxy.setStiffnesses(["HeadPitch", "HeadYaw"], [1, 1])
+        self.post(self._setStiffnesses, ["HeadPitch", "HeadYaw"], [1, 1]).result()
 
     def releaseHead(self):
         """
         Release the stiffness of the head
         """
-        self.motion_proxy.setStiffnesses(["HeadPitch", "HeadYaw"], [0, 0])
-
-
-
+        self.post(self._setStiffnesses, ["HeadPitch", "HeadYaw"], [0, 0]).result()
@@ -0,0 +1,193 @@
+import collections
+import sys
+import threading
+import time
+
+__author__ = 'Anthony Rouneau'
+
+# The postures reached by the posture commands, used to coalesce the redundant ones (see MotionQueue.post)
+AWAKE = "awake"
+RESTING = "resting"
+
+
+class MotionFuture(object):
+    """
+    The result of a motion command, available once the command has been executed
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for the command, in seconds. If None, wait until it is executed
+        :type timeout: float
+        :return: True if the command has been executed
+        :rtype: bool
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for the command, in seconds. If None, wait until it is executed
+        :type timeout: float
+        :return: the result of the command. The exception raised by the command, if any, is raised again.
+        Raises a RuntimeError if the timeout expired.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("The motion command is not executed yet")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def failed(self):
+        return self._done.is_set() and self._exc_info is not None
+
+    def addDoneCallback(self, callback):
+        """
+        :param callback: the function called with the future once the command has been executed.
+                         It is called at once if the command is already executed.
+        :type callback: function
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _setResult(self, result, exc_info=None):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def _run(self, func, args, after=None):
+        """
+        Execute the command and store its result, unless the command it depends on has failed
+        """
+        if after is not None and after.failed():
+            self._setResult(None, after._exc_info)
+            return
+        try:
+            self._setResult(func(*args))
+        except Exception:
+            self._setResult(None, sys.exc_info())
+
+    @staticmethod
+    def execute(func, args, after=None):
+        """
+        :return: the future of the command, executed at once in the current thread
+        :rtype: MotionFuture
+        """
+        future = MotionFuture()
+        future._run(func, args, after)
+        return future
+
+
+class MotionQueue(threading.Thread):
+    """
+    Executes the motion commands one after the other, in the order they were posted, so that the caller does not
+    wait for the robot while it moves.
+    """
+
+    def __init__(self):
+        super(MotionQueue, self).__init__()
+        self.daemon = True
+        # Deque of (future, function, arguments, posture, future of the command it depends on)
+        self._pending = collections.deque()
+        self._current = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        self.nb_of_commands = 0
+        self.nb_of_coalesced_commands = 0
+
+    def post(self, func, args=(), posture=None, after=None):
+        """
+        :param func: the function that executes the command
+        :type func: function
+        :param args: the arguments of the function
+        :type args: tuple
+        :param posture: the posture reached by the command (see AWAKE and RESTING), None if it is not a posture
+                        command. A posture command that follows a command reaching the same posture is redundant :
+                        the future of the last command is returned instead.
+        :type posture: str
+        :param after: the future of the command this one depends on : it fails if that command has failed
+        :type after: MotionFuture
+        :return: the future of the command
+        :rtype: MotionFuture
+        """
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("The motion queue is stopped")
+            last = self._pending[-1] if len(self._pending) > 0 else self._current
+            if posture is not None and last is not None and last[3] == posture:
+                self.nb_of_coalesced_commands += 1
+                return last[0]
+            command = (MotionFuture(), func, tuple(args), posture, after)
+            self._pending.append(command)
+            self._condition.notify_all()
+            return command[0]
+
+    def run(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0 and not self._stopped:
+                    self._condition.wait()
+                if len(self._pending) == 0:
+                    return
+                self._current = self._pending.popleft()
+            future, func, args, posture, after = self._current
+            future._run(func, args, after)
+            with self._condition:
+                self._current = None
+                self.nb_of_commands += 1
+                self._condition.notify_all()
+
+    def countPending(self):
+        """
+        :return: the number of commands not executed yet, including the one executing
+        :rtype: int
+        """
+        with self._condition:
+            return len(self._pending) + (1 if self._current is not None else 0)
+
+    def waitUntilIdle(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait, in seconds. If None, wait until every command is executed
+        :type timeout: float
+        :return: True if every command posted has been executed
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while len(self._pending) > 0 or self._current is not None:
+                if deadline is None:
+                    self._condition.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+            return True
+
+    def stop(self, timeout=None):
+        """
+        :param timeout: the maximum time to wait for the pending commands to be executed, in seconds
+        :type timeout: float
+        Stop the queue once the pending commands are executed
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self.is_alive():
+            self.join(timeout)
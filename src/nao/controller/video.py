@@ -1,7 +1,9 @@
-import numpy as np
-from naoqi import ALProxy
+import time
 
 import nao.data as nao
+from nao.controller.capture import CaptureThread, FrameRingBuffer, decode_image
+from nao.proxy import create_proxy
+from utils.camera.frame import Frame
 
 __author__ = 'Anthony Rouneau'
 
@@ -12,10 +14,11 @@ class VideoController(object):
     """
     Represents a virtual controller for NAO's videos devices
     """
-    def __init__(self, robot_ip=None, robot_port=None):
+    def __init__(self, robot_ip=None, robot_port=None, video_device=None):
         """
         :param robot_ip: the ip address of the robot
         :param robot_port: the port of the robot
+        :param video_device: the object to use instead of the ALVideoDevice proxy (e.g. a ReplayVideoDevice)
         Connect to the robot camera proxy
         """
         if robot_ip is None:
@@ -24,9 +27,14 @@ class VideoController(object):
             robot_port = nao.PORT
         self.ip = robot_ip
         self.port = robot_port
-        self.video_device = ALProxy("ALVideoDevice", robot_ip, robot_port)
-        self.disconnectFromCamera()
+        if video_device is None:
+            video_device = create_proxy("ALVideoDevice", robot_ip, robot_port)
+        self.video_device = video_device
         self.subscriber_ids = [SUBSCRIBER_ID + "_CAM_0", SUBSCRIBER_ID + "_CAM_1"]
+        self.disconnectFromCamera()
+        # The parameters of the last connection to each camera, used to reconnect
+        self.camera_settings = [None, None]
+        self.captures = [None, None]
         self.cam_connected = False
         self.cam_matrix = nao.CAM_MATRIX
         self.cam_distorsion = nao.CAM_DISTORSION
@@ -47,6 +55,7 @@ class VideoController(object):
         :return: -1 in case of error, 0 else
         :rtype: int
         """
+        self.camera_settings[camera_num] = (res, fps, color_space, subscriber_id)
         try:
             self.subscriber_ids[camera_num] = subscriber_id + "_CAM_" + str(camera_num)
             self.disconnectFromCamera(camera_num)
@@ -88,18 +97,156 @@ class VideoController(object):
         :param camera_num: 0 : the top camera, 1 : the bottom camera
         :type camera_num: int
         :return: The picture taken or None if there was a connection problem
-        :rtype: np.matrix
-        Take a picture that can be used by OpenCV
+        :rtype: np.ndarray
+        Take a picture that can be used by OpenCV.
+        If the camera is captured in background (see startCapture), the latest frame is returned without waiting.
+        """
+        if self.isCapturing(camera_num):
+            frame = self.captures[camera_num].ring_buffer.latest()
+            if frame is not None:
+                return frame[1]
+        return self._grabImage(camera_num)
+
+    def getFrameFromCamera(self, camera_num=0):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: The frame of the picture taken or None if there was a connection problem
+        :rtype: Frame
+        Same as getImageFromCamera, but the picture is wrapped in a Frame, that keeps its timestamp and color space.
+        If the camera is not captured in background, the frame is a view on the buffer received, without copy.
+        """
+        color_space = 13 if self.camera_settings[camera_num] is None else self.camera_settings[camera_num][2]
+        if self.isCapturing(camera_num):
+            frame = self.captures[camera_num].ring_buffer.latest()
+            if frame is not None:
+                return Frame(frame[1], color_space, frame[0])
+        frame = self._grabFrame(camera_num)
+        if frame is None:
+            return None
+        return Frame(frame[1], color_space, frame[0])
+
+    def _grabImage(self, camera_num=0):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: The picture taken or None if there was a connection problem
+        :rtype: np.ndarray
+        Take a picture from the robot, waiting for the network round trip
+        """
+        frame = self._grabFrame(camera_num)
+        if frame is None:
+            return None
+        return frame[1]
+
+    def _grabFrame(self, camera_num=0):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: (timestamp, picture) : the time at which the picture was received, in seconds, and the picture,
+                 or None if there was a connection problem
+        :rtype: tuple
         """
         if not self.cam_connected:
             self.connectToCamera()
         try:
             img = self.video_device.getImageRemote(self.subscriber_ids[camera_num])
             if img is not None:
-                converted_img = np.reshape(np.frombuffer(img[6], dtype='%iuint8' % img[2]), (img[1], img[0], img[2]))
-                return converted_img
+                # The clock of the robot may differ from ours : the frames are stamped with their reception time,
+                # unless the proxy stamps them with our clock (a replay or a simulation)
+                if getattr(self.video_device, "local_timestamps", False) is True:
+                    return img[4] + img[5] / 1e6, decode_image(img)
+                return time.time(), decode_image(img)
             else:
                 return None
         except BaseException, err:
             print "ERR: cannot get image from camera : %s" % err
             return None
+
+    def _reconnect(self, camera_num):
+        settings = self.camera_settings[camera_num]
+        if settings is None:
+            self.connectToCamera(camera_num=camera_num)
+        else:
+            res, fps, color_space, subscriber_id = settings
+            self.connectToCamera(res, fps, camera_num, color_space, subscriber_id)
+
+    def startCapture(self, camera_num=0, buffer_size=4, retry_delay=0.5):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :param buffer_size: the number of frames kept in the ring buffer
+        :type buffer_size: int
+        :param retry_delay: the time to wait before reconnecting after a failed grab, in seconds
+        :type retry_delay: float
+        Start a thread that continuously grabs the frames of the camera into a ring buffer.
+        The camera must be connected first (see connectToCamera), or it will be with the default parameters.
+        """
+        if self.isCapturing(camera_num):
+            return
+        if self.camera_settings[camera_num] is None:
+            self.connectToCamera(camera_num=camera_num)
+        # A replay can serve its frames on demand, as fast as they are consumed, instead of at the pace of a camera
+        on_demand = getattr(self.video_device, "frames_on_demand", False) is True
+        capture = CaptureThread(lambda: self._grabFrame(camera_num), FrameRingBuffer(buffer_size),
+                                reconnect=lambda: self._reconnect(camera_num), retry_delay=retry_delay,
+                                on_demand=on_demand)
+        self.captures[camera_num] = capture
+        capture.start()
+
+    def stopCapture(self, camera_num=None):
+        """
+        :param camera_num: the camera of which the capture is stopped. If None, every capture is stopped
+        :type camera_num: int
+        """
+        cameras = range(len(self.captures)) if camera_num is None else [camera_num]
+        for camera in cameras:
+            if self.captures[camera] is not None:
+                self.captures[camera].stop()
+                self.captures[camera] = None
+
+    def isCapturing(self, camera_num=0):
+        return self.captures[camera_num] is not None and self.captures[camera_num].is_alive()
+
+    def latest(self, camera_num=0):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: (timestamp, picture) of the newest frame captured (see startCapture), or None if there is none yet
+        :rtype: tuple
+        """
+        if self.captures[camera_num] is None:
+            return None
+        return self.captures[camera_num].ring_buffer.latest()
+
+    def nextAfter(self, timestamp=None, camera_num=0, timeout=1.0):
+        """
+        :param timestamp: the frame must have been taken strictly after this time, in seconds.
+                          If None, the current time is used
+        :type timestamp: float
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :param timeout: the maximum time to wait for the frame, in seconds. If None, wait until it comes
+        :type timeout: float
+        :return: (timestamp, picture) of the first frame captured after timestamp (see startCapture),
+                 or None if the timeout expired
+        :rtype: tuple
+        """
+        if self.captures[camera_num] is None:
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        return self.captures[camera_num].ring_buffer.nextAfter(timestamp, timeout)
+
+    def frames(self, camera_num=0, timeout=1.0):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :param timeout: the maximum time to wait for each frame, in seconds. If None, wait until it comes
+        :type timeout: float
+        :return: an iterator on the (timestamp, picture) of the frames captured (see startCapture)
+        :rtype: generator
+        """
+        if self.captures[camera_num] is None:
+            return iter([])
+        return self.captures[camera_num].ring_buffer.frames(timeout)
@@ -0,0 +1,57 @@
+import nao.data as nao
+
+__author__ = 'Anthony Rouneau'
+
+# The function that creates the proxies instead of NAOqi : (module_name, robot_ip, robot_port) -> proxy
+_backend = None
+
+
+def set_backend(backend):
+    """
+    :param backend: the function that creates the proxies : (module_name, robot_ip, robot_port) -> proxy,
+                    or None to create NAOqi proxies
+    :type backend: function
+    Replace the NAOqi proxies, e.g. to record or replay them (see nao.recording)
+    """
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def create_proxy(module_name, robot_ip=None, robot_port=None):
+    """
+    :param module_name: the name of the NAOqi module (e.g. "ALMotion")
+    :type module_name: str
+    :param robot_ip: the ip address of the robot
+    :type robot_ip: str
+    :param robot_port: the port of the robot
+    :type robot_port: int
+    :return: the proxy of the module, given by the backend if one is set (see set_backend)
+    :rtype: naoqi.ALProxy
+    """
+    if robot_ip is None:
+        robot_ip = nao.IP
+    if robot_port is None:
+        robot_port = nao.PORT
+    if _backend is not None:
+        return _backend(module_name, robot_ip, robot_port)
+    return create_naoqi_proxy(module_name, robot_ip, robot_port)
+
+
+def create_naoqi_proxy(module_name, robot_ip, robot_port):
+    """
+    :param module_name: the name of the NAOqi module (e.g. "ALMotion")
+    :type module_name: str
+    :param robot_ip: the ip address of the robot
+    :type robot_ip: str
+    :param robot_port: the port of the robot
+    :type robot_port: int
+    :return: the NAOqi proxy of the module
+    :rtype: naoqi.ALProxy
+    """
+    # NAOqi is only needed to talk to a real robot
+    from naoqi import ALProxy
+    return ALProxy(module_name, robot_ip, robot_port)
@@ -0,0 +1,365 @@
+import bisect
+import collections
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+import nao.proxy as proxy
+from nao.controller.capture import decode_image
+
+__author__ = 'Anthony Rouneau'
+
+CALLS_FILE = "calls.jsonl"
+FRAMES_PREFIX = "frames_"
+IMAGE_METHOD = "getImageRemote"
+
+
+def _to_json(value):
+    """
+    :param value: an argument or a result of a NAOqi call
+    :return: the value, with the numpy arrays and the tuples converted to lists so that it can be written in JSON
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _to_json(item) for key, item in value.items()}
+    return value
+
+
+def _args_key(args):
+    """
+    :param args: the arguments of a call, as given to the proxy or as read from the recording
+    :return: the arguments written in JSON, so that the recorded arguments and the replayed ones can be compared
+    :rtype: str
+    """
+    return json.dumps(_to_json(list(args)), sort_keys=True)
+
+
+class FrameWriter(object):
+    """
+    Writes frames in compressed chunks : "<directory>/frames_<index of the first frame>.npz"
+    """
+
+    def __init__(self, directory, chunk_size=32):
+        """
+        :param directory: the directory of the chunks
+        :type directory: str
+        :param chunk_size: the maximum number of frames in a chunk
+        :type chunk_size: int
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.nb_of_frames = 0
+        self._chunk = []
+
+    def append(self, img):
+        """
+        :param img: the frame to write
+        :type img: np.ndarray
+        :return: the index of the frame
+        :rtype: int
+        """
+        # The frames of a chunk are stored in a single array : they must have the same shape
+        if len(self._chunk) > 0 and self._chunk[0].shape != img.shape:
+            self.flush()
+        self._chunk.append(np.array(img, dtype=np.uint8))
+        self.nb_of_frames += 1
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+        return self.nb_of_frames - 1
+
+    def flush(self):
+        """
+        Write the frames that are not written yet in a new chunk
+        """
+        if len(self._chunk) > 0:
+            first = self.nb_of_frames - len(self._chunk)
+            np.savez_compressed(os.path.join(self.directory, FRAMES_PREFIX + "%08d.npz" % first),
+                                frames=np.array(self._chunk))
+            self._chunk = []
+
+
+class FrameReader(object):
+    """
+    Reads the frames written by a FrameWriter. The last chunk read is kept in memory.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: the directory of the chunks
+        :type directory: str
+        """
+        self.directory = directory
+        self._firsts = sorted(int(os.path.basename(file_name)[len(FRAMES_PREFIX):-len(".npz")])
+                              for file_name in glob.glob(os.path.join(directory, FRAMES_PREFIX + "*.npz")))
+        self._chunk_first = None
+        self._chunk = None
+
+    def get(self, index):
+        """
+        :param index: the index of the frame
+        :type index: int
+        :return: the frame
+        :rtype: np.ndarray
+        """
+        position = bisect.bisect_right(self._firsts, index) - 1
+        if position < 0:
+            raise IndexError("No frame " + str(index))
+        first = self._firsts[position]
+        if first != self._chunk_first:
+            with np.load(os.path.join(self.directory, FRAMES_PREFIX + "%08d.npz" % first)) as chunk:
+                self._chunk = chunk["frames"]
+            self._chunk_first = first
+        return self._chunk[index - first]
+
+
+class Recorder(object):
+    """
+    Writes the calls made to the NAOqi proxies, with their arguments and results, in "<directory>/calls.jsonl".
+    The frames of the cameras are written in chunks (see FrameWriter).
+    """
+
+    def __init__(self, directory, chunk_size=32):
+        """
+        :param directory: the directory of the recording, created if needed
+        :type directory: str
+        :param chunk_size: the maximum number of frames in a chunk
+        :type chunk_size: int
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.frames = FrameWriter(directory, chunk_size)
+        self._calls_file = open(os.path.join(directory, CALLS_FILE), 'w')
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def record(self, module_name, method, args, result):
+        """
+        :param module_name: the name of the NAOqi module
+        :type module_name: str
+        :param method: the name of the method called
+        :type method: str
+        :param args: the arguments of the call
+        :type args: tuple
+        :param result: the result of the call
+        """
+        with self._lock:
+            if self._calls_file is None:
+                return
+            if method == IMAGE_METHOD and result is not None:
+                index = self.frames.append(decode_image(result))
+                result = {"frame": index, "header": _to_json(result[:6])}
+            self._calls_file.write(json.dumps({"time": time.time() - self._start, "module": module_name,
+                                               "method": method, "args": _to_json(args),
+                                               "result": _to_json(result)}) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._calls_file is not None:
+                self.frames.flush()
+                self._calls_file.close()
+                self._calls_file = None
+
+
+class RecordingProxy(object):
+    """
+    Forwards the calls to a proxy and records them
+    """
+
+    def __init__(self, proxy_to_record, recorder, module_name):
+        self._proxy = proxy_to_record
+        self._recorder = recorder
+        self._module_name = module_name
+
+    def __getattr__(self, name):
+        attribute = getattr(self._proxy, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args):
+            result = attribute(*args)
+            self._recorder.record(self._module_name, name, args, result)
+            return result
+        return call
+
+
+class Replay(object):
+    """
+    Serves the results of a recording, in the order of the recording for each method of each module and each
+        arguments given to it.
+    """
+
+    def __init__(self, directory, speed=None):
+        """
+        :param directory: the directory of the recording
+        :type directory: str
+        :param speed: the speed of the replay (1. = the speed of the recording), at least 1.
+                      If None, the results are served as fast as possible and the frames are served on demand : a
+                      capture thread grabs a frame only when it is consumed (see frames_on_demand), so that every
+                      frame is processed, in order.
+        :type speed: float
+        """
+        if speed is not None and speed < 1:
+            raise ValueError("The speed of a paced replay must be at least 1 : " + str(speed))
+        self.directory = directory
+        self.speed = speed
+        self.frames_on_demand = speed is None
+        self.frames = FrameReader(directory)
+        # (module, method) -> {arguments in JSON: deque of (time, result)}
+        self._calls = collections.defaultdict(dict)
+        # (module, method, arguments in JSON) -> the last result served
+        self._last_results = {}
+        with open(os.path.join(directory, CALLS_FILE)) as calls_file:
+            for line in calls_file:
+                call = json.loads(line)
+                calls = self._calls[(call["module"], call["method"])]
+                calls.setdefault(_args_key(call["args"]), collections.deque()).append((call["time"], call["result"]))
+        self._lock = threading.Lock()
+        # (real time, recording time) at which the replay started
+        self._origin = None
+
+    def _replayTime(self, call_time, speed):
+        """
+        :param call_time: the time of the call in the recording
+        :type call_time: float
+        :return: the time, in seconds since the epoch, at which the call is replayed
+        :rtype: float
+        """
+        with self._lock:
+            if self._origin is None:
+                self._origin = (time.time(), call_time)
+            return self._origin[0] + (call_time - self._origin[1]) / speed
+
+    def _wait(self, replay_time):
+        delay = replay_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _popCall(self, key, args_key):
+        """
+        :return: (time, result) : the next call recorded with these arguments. If there is none and the arguments
+                 were never recorded (e.g. computed differently), the earliest call of the method not served yet.
+                 None if there is no such call.
+        :rtype: tuple
+        """
+        calls = self._calls.get(key, {})
+        if args_key in calls:
+            return calls[args_key].popleft() if calls[args_key] else None
+        pending = [queue for queue in calls.values() if queue]
+        if len(pending) == 0:
+            return None
+        return min(pending, key=lambda queue: queue[0][0]).popleft()
+
+    def call(self, module_name, method, args=()):
+        """
+        :param module_name: the name of the NAOqi module
+        :type module_name: str
+        :param method: the name of the method called
+        :type method: str
+        :param args: the arguments of the call
+        :type args: tuple
+        :return: the next result recorded for this method and these arguments. Once the recorded results are
+                 exhausted, the last one is served again, except for the frames : None is returned, as if the camera
+                 was disconnected.
+        """
+        key = (module_name, method)
+        args_key = _args_key(args)
+        with self._lock:
+            call = self._popCall(key, args_key)
+            if call is not None:
+                call_time, result = call
+                self._last_results[key + (args_key,)] = result
+                self._last_results[key] = result
+            elif method == IMAGE_METHOD:
+                return None
+            else:
+                return self._last_results.get(key + (args_key,), self._last_results.get(key))
+        if method == IMAGE_METHOD and result is not None:
+            if self.speed is not None:
+                self._wait(self._replayTime(call_time, self.speed))
+            # The frame is stamped with the time it is served at
+            replay_time = time.time()
+            header = result["header"][0:4] + [int(replay_time), int((replay_time % 1) * 1e6)]
+            return header + [self.frames.get(result["frame"]).tostring()]
+        if self.speed is not None:
+            self._wait(self._replayTime(call_time, self.speed))
+        return result
+
+    def countRemainingCalls(self, module_name=None, method=None):
+        """
+        :return: the number of recorded calls not served yet, for a module and a method if they are given
+        :rtype: int
+        """
+        with self._lock:
+            return sum(len(calls) for (module, name), queues in self._calls.items()
+                       if module_name in (None, module) and method in (None, name) for calls in queues.values())
+
+
+class ReplayProxy(object):
+    """
+    Stands in for the proxy of a NAOqi module by serving the results of a recording
+    """
+
+    # The replayed frames are stamped with our clock (see VideoController._grabFrame)
+    local_timestamps = True
+
+    def __init__(self, replay, module_name):
+        self._replay = replay
+        self._module_name = module_name
+
+    @property
+    def frames_on_demand(self):
+        """
+        :return: True if the frames are served as fast as they are consumed (see VideoController.startCapture)
+        :rtype: bool
+        """
+        return self._replay.frames_on_demand
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return lambda *args: self._replay.call(self._module_name, name, args)
+
+
+def start_recording(directory, chunk_size=32):
+    """
+    :param directory: the directory of the recording, created if needed
+    :type directory: str
+    :param chunk_size: the maximum number of frames in a chunk
+    :type chunk_size: int
+    :return: the recorder, that must be closed at the end of the recording
+    :rtype: Recorder
+    Record the calls made to every proxy created from now on (see nao.proxy.create_proxy)
+    """
+    recorder = Recorder(directory, chunk_size)
+    inner_backend = proxy.get_backend()
+    if inner_backend is None:
+        inner_backend = proxy.create_naoqi_proxy
+    proxy.set_backend(lambda module_name, robot_ip, robot_port:
+                      RecordingProxy(inner_backend(module_name, robot_ip, robot_port), recorder, module_name))
+    return recorder
+
+
+def start_replay(directory, speed=None):
+    """
+    :param directory: the directory of the recording
+    :type directory: str
+    :param speed: the speed of the replay (1. = the speed of the recording), at least 1.
+                  If None, the results are served as fast as possible and the frames on demand (see Replay).
+    :type speed: float
+    :return: the replay
+    :rtype: Replay
+    Replace every proxy created from now on (see nao.proxy.create_proxy) by the recording
+    """
+    replay = Replay(directory, speed)
+    proxy.set_backend(lambda module_name, robot_ip, robot_port: ReplayProxy(replay, module_name))
+    return replay
@@ -0,0 +1,564 @@
+import functools
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import nao.data as nao
+import nao.proxy as proxy
+from connect4.model.default_model import DefaultModel
+from nao.controller.capture import encode_image
+from utils.camera import geom
+
+__author__ = 'Anthony Rouneau'
+
+# The IP address (see --ip) that selects the simulated robot instead of a real one
+SIMULATOR_IP = "simulator"
+
+# Height of the torso from the ground, in meters
+STAND_TORSO_HEIGHT = 0.333
+CROUCH_TORSO_HEIGHT = 0.22
+# Position of the neck (HeadYaw and HeadPitch joints) from the torso
+NECK_OFFSET = np.array([0., 0., 0.1265])
+# Position of the cameras from the neck, and their pitch in the head, in radians
+CAMERA_OFFSETS = [(np.array([0.05871, 0., 0.06364]), 0.0209),
+                  (np.array([0.05071, 0., 0.01774]), 0.6929)]
+# Transformation from the camera axes of OpenCV to the axes of NAO (see Connect4Tracker)
+NAO_AXES = np.array([[0, 0, 1],
+                     [-1, 0, 0],
+                     [0, -1, 0]], dtype=np.float64)
+# Width of the image for each resolution parameter of ALVideoDevice (0 = 160x120, 1 = 320x240, 2 = 640x480)
+RESOLUTION_WIDTHS = {0: 160, 1: 320, 2: 640}
+# The camera matrix of nao.data is the one of the 320x240 resolution
+REFERENCE_WIDTH = 320
+# Size of a pixel of the image of reference of the board (Connect4.png), in meters
+REFERENCE_PIXEL_SIZE = 0.001
+
+# BGR colors of the rendering
+BACKGROUND_COLOR = (110, 110, 110)
+FRONT_FACE_COLOR = (150, 60, 20)
+UPPER_FACE_COLOR = (170, 80, 40)
+HOLE_COLOR = (235, 235, 235)
+UPPER_HOLE_COLOR = (20, 20, 20)
+
+
+def _with_latency(method):
+    """
+    Make a method of a simulated proxy wait for the latency of the robot before it is executed
+    """
+    @functools.wraps(method)
+    def call(self, *args):
+        self.robot.wait()
+        return method(self, *args)
+    return call
+
+
+def _as_list(names):
+    return [names] if isinstance(names, basestring) else list(names)
+
+
+def marker_id(hole_index):
+    """
+    :param hole_index: the index of the hole, [0, 6]
+    :type hole_index: int
+    :return: the id of the Hamming code of the hole (see UpperHolesDetector.getCorrespondences)
+    :rtype: int
+    """
+    return (hole_index + 1) * 1000
+
+
+def hamming_marker_images():
+    """
+    :return: the images of the Hamming codes of the 7 holes, drawn by hampy : index of the hole -> image
+    :rtype: dict
+    """
+    from hampy import HammingMarker
+    return {hole_index: np.uint8(HammingMarker(marker_id(hole_index)).generate_image())
+            for hole_index in range(7)}
+
+
+class SimulatedRobot(object):
+    """
+    The state of a simulated NAO and of the Connect 4 in front of it, shared by the simulated proxies
+    """
+
+    def __init__(self, latency=0., board_distance=1.0, board_lateral=0., board_angle=0., board_elevation=0.,
+                 model=None, camera_matrix=None, camera_dist=None, marker_images=None):
+        """
+        :param latency: the time waited by every call made to the robot, in seconds
+        :type latency: float
+        :param board_distance: the distance between the robot and the front of the board, in meters
+        :type board_distance: float
+        :param board_lateral: the lateral shift of the middle of the board, in meters (positive = on the left)
+        :type board_lateral: float
+        :param board_angle: the rotation of the board around the vertical axis, in radians
+        :type board_angle: float
+        :param board_elevation: the height of the surface on which the board stands, in meters
+        :type board_elevation: float
+        :param model: the model of the Connect 4 rendered. If None, the default model is used.
+        :type model: DefaultModel
+        :param camera_matrix: the intrinsic matrix of the cameras, for the 320x240 resolution.
+                              If None, the one of nao.data is used.
+        :type camera_matrix: np.matrix
+        :param camera_dist: the distortion coefficients of the cameras, applied to the visible markers (see
+                            getVisibleMarkers) but not to the rendered images. If None, the ones of nao.data are used.
+        :type camera_dist: np.matrix
+        :param marker_images: the images of the Hamming codes drawn on the upper face : index of the hole -> image.
+                              The upper face is drawn without markers if there is no image.
+        :type marker_images: dict
+        """
+        self.latency = latency
+        self.model = model if model is not None else DefaultModel()
+        self.camera_matrix = np.array(camera_matrix if camera_matrix is not None else nao.CAM_MATRIX,
+                                      dtype=np.float64)
+        self.camera_dist = np.array(camera_dist if camera_dist is not None else nao.CAM_DISTORSION, dtype=np.float64)
+        self.marker_images = marker_images if marker_images is not None else {}
+        # The position (x, y, theta) of the robot on the ground
+        self.robot_pose = np.zeros(3)
+        self.awake = False
+        self.joints = {"HeadYaw": 0., "HeadPitch": 0.}
+        self.stiffnesses = {}
+        self.hand_position = [0.0, 0.11, -0.10, 0., 0., 0.]
+        self.hand_opened = False
+        # The positions (x, y, z) in the world of the hand each time it was opened
+        self.drops = []
+        # The discs in the board : (column, row) -> BGR color, row 0 being the bottom of the board
+        self.discs = {}
+        self._lock = threading.RLock()
+        # The board is facing the robot : the x axis of the model goes to the right of the robot,
+        # its y axis goes down and its z axis goes away from the robot
+        self.board_to_world = np.eye(4)
+        self.placeBoard(board_distance, board_lateral, board_angle, board_elevation)
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def placeBoard(self, distance, lateral=0., angle=0., elevation=0.):
+        """
+        :param distance: the distance between the robot and the front of the board, in meters
+        :type distance: float
+        :param lateral: the lateral shift of the middle of the board, in meters (positive = on the left)
+        :type lateral: float
+        :param angle: the rotation of the board around the vertical axis, in radians
+        :type angle: float
+        :param elevation: the height of the surface on which the board stands, in meters
+        :type elevation: float
+        Place the board in front of the robot, as it currently stands
+        """
+        with self._lock:
+            facing = np.array([[0, 0, 1],
+                               [-1, 0, 0],
+                               [0, -1, 0]], dtype=np.float64)
+            rotation = np.dot(geom.convert_euler_to_matrix((0, 0, angle)), facing)
+            # The origin of the model is the upper left front corner
+            middle = np.array([self.model.length / 2, 0, 0])
+            position = np.array([distance, lateral, elevation + self.model.height]) - np.dot(rotation, middle)
+            board_to_robot = geom.transform_matrix(rotation, position)
+            self.board_to_world = geom.compose_transforms(self._robotToWorld(), board_to_robot)
+
+    def _robotToWorld(self):
+        x, y, theta = self.robot_pose
+        return geom.transform_matrix(geom.convert_euler_to_matrix((0, 0, theta)), [x, y, 0])
+
+    def move(self, x, y, theta):
+        """
+        Move the robot, as ALMotion.moveTo : (x, y) in the frame of the robot, then rotate it of theta
+        """
+        with self._lock:
+            cos, sin = np.cos(self.robot_pose[2]), np.sin(self.robot_pose[2])
+            self.robot_pose += [cos * x - sin * y, sin * x + cos * y, theta]
+
+    def torsoToWorld(self):
+        """
+        :return: the 4x4 homogeneous matrix that transforms coordinates from the torso into world coordinates
+        :rtype: np.ndarray
+        """
+        with self._lock:
+            height = STAND_TORSO_HEIGHT if self.awake else CROUCH_TORSO_HEIGHT
+            torso_to_robot = geom.transform_matrix(np.eye(3), [0, 0, height])
+            return geom.compose_transforms(self._robotToWorld(), torso_to_robot)
+
+    def getCameraPosition(self, camera_num):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: the position 6D (x, y, z, Wx, Wy, Wz) of the camera from the torso, as ALMotion.getPosition
+        :rtype: list
+        """
+        with self._lock:
+            yaw, pitch = self.joints["HeadYaw"], self.joints["HeadPitch"]
+        offset, camera_pitch = CAMERA_OFFSETS[camera_num]
+        position = NECK_OFFSET + np.dot(geom.convert_euler_to_matrix((0, pitch, yaw)), offset)
+        return position.tolist() + [0., pitch + camera_pitch, yaw]
+
+    def getBoardPoseFromCamera(self, camera_num):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :return: the 4x4 homogeneous matrix that transforms coordinates of the model into coordinates from the
+                 camera (OpenCV axes), i.e. the pose that solvePnP should find
+        :rtype: np.ndarray
+        """
+        position = self.getCameraPosition(camera_num)
+        camera_to_torso = geom.transform_matrix(
+            np.dot(geom.convert_euler_to_matrix(position[3:6]), NAO_AXES), position[0:3])
+        camera_to_world = geom.compose_transforms(self.torsoToWorld(), camera_to_torso)
+        with self._lock:
+            return geom.compose_transforms(geom.invert_transform(camera_to_world), self.board_to_world)
+
+    def getVisibleMarkers(self, camera_num, width=320, height=240):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :param width: the width of the image
+        :type width: int
+        :param height: the height of the image
+        :type height: int
+        :return: the Hamming codes drawn on the board and entirely seen by the camera, as a list of
+                 (id, corners) : the id read by hampy and the (4, 2) corners [NW, NE, SW, SE] in the image,
+                 distorted by the lens, i.e. what a perfect detection would find
+        :rtype: list
+        """
+        board_to_camera = self.getBoardPoseFromCamera(camera_num)
+        rvec, _ = cv2.Rodrigues(board_to_camera[0:3, 0:3])
+        camera_matrix = self.camera_matrix * (float(width) / REFERENCE_WIDTH)
+        camera_matrix[2, 2] = 1
+        markers = []
+        for hole_index in sorted(self.marker_images):
+            points = np.array(self.model.getHamcode(hole_index), dtype=np.float64).reshape(-1, 3)
+            if np.any(geom.apply_transform(board_to_camera, points)[:, 2] < 0.05):
+                continue
+            corners = cv2.projectPoints(points, rvec, board_to_camera[0:3, 3], camera_matrix,
+                                        self.camera_dist)[0].reshape(-1, 2)
+            if (corners >= 0).all() and (corners[:, 0] < width).all() and (corners[:, 1] < height).all():
+                markers.append((marker_id(hole_index), corners))
+        return markers
+
+    def render(self, camera_num, width=320, height=240):
+        """
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :param width: the width of the image
+        :type width: int
+        :param height: the height of the image
+        :type height: int
+        :return: the BGR image of the board seen by the camera
+        :rtype: np.ndarray
+        """
+        board_to_camera = self.getBoardPoseFromCamera(camera_num)
+        rvec, _ = cv2.Rodrigues(board_to_camera[0:3, 0:3])
+        tvec = board_to_camera[0:3, 3]
+        camera_matrix = self.camera_matrix * (float(width) / REFERENCE_WIDTH)
+        camera_matrix[2, 2] = 1
+
+        def project(points):
+            points = np.array(points, dtype=np.float64).reshape(-1, 3)
+            # The points behind the camera cannot be drawn
+            if np.any(geom.apply_transform(board_to_camera, points)[:, 2] < 0.05):
+                return None
+            projected, _ = cv2.projectPoints(points, rvec, tvec, camera_matrix, None)
+            return projected.reshape(-1, 2)
+
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[:] = BACKGROUND_COLOR
+        model = self.model
+        upper_face = project([model.getCorner(index) for index in (model.UPPER_LEFT_FRONT_CORNER,
+                                                                     model.UPPER_RIGHT_FRONT_CORNER,
+                                                                     model.UPPER_RIGHT_BACK_CORNER,
+                                                                     model.UPPER_LEFT_BACK_CORNER)])
+        if upper_face is not None:
+            self._fillPolygon(img, upper_face, UPPER_FACE_COLOR)
+            for hole_index in range(7):
+                corners = project(model.getUpperHole(hole_index))
+                if corners is not None:
+                    self._fillPolygon(img, corners[[0, 1, 3, 2]], UPPER_HOLE_COLOR)
+                if hole_index in self.marker_images:
+                    corners = project(model.getHamcode(hole_index))
+                    if corners is not None:
+                        self._drawImage(img, self.marker_images[hole_index], corners)
+        front_face = project([model.getCorner(index) for index in (model.UPPER_LEFT_FRONT_CORNER,
+                                                                     model.UPPER_RIGHT_FRONT_CORNER,
+                                                                     model.LOWER_RIGHT_FRONT_CORNER,
+                                                                     model.LOWER_LEFT_FRONT_CORNER)])
+        if front_face is not None:
+            self._fillPolygon(img, front_face, FRONT_FACE_COLOR)
+            angles = np.linspace(0, 2 * np.pi, 24, endpoint=False)
+            circle = np.column_stack([np.cos(angles), np.sin(angles), np.zeros(len(angles))])
+            with self._lock:
+                discs = dict(self.discs)
+            # The front holes are placed as in the image of reference, a regular grid like on the real board
+            for position, pixel in model.image_of_reference.pixel_mapping.items():
+                centre = np.array([pixel[0], pixel[1], 0]) * REFERENCE_PIXEL_SIZE
+                contour = project(centre + circle * model.circle_diameter / 2)
+                if contour is not None:
+                    self._fillPolygon(img, contour, discs.get(position, HOLE_COLOR))
+        return img
+
+    @staticmethod
+    def _fillPolygon(img, points, color):
+        cv2.fillPoly(img, [np.round(points * 16).astype(np.int32)], color, cv2.LINE_AA, shift=4)
+
+    @staticmethod
+    def _drawImage(img, marker, corners):
+        """
+        Draw an image on a quadrilateral of img, whose corners are [NW, NE, SW, SE]
+        """
+        marker = np.atleast_3d(marker)
+        if marker.shape[2] == 1:
+            marker = np.repeat(marker, 3, axis=2)
+        height, width = marker.shape[0:2]
+        source = np.array([[0, 0], [width, 0], [0, height], [width, height]], dtype=np.float32)
+        homography = cv2.getPerspectiveTransform(source, corners.astype(np.float32))
+        size = (img.shape[1], img.shape[0])
+        warped = cv2.warpPerspective(marker, homography, size)
+        mask = cv2.warpPerspective(np.full((height, width), 255, dtype=np.uint8), homography, size)
+        img[mask > 0] = warped[mask > 0]
+
+
+class SimulatedMotion(object):
+    """
+    Stands in for the ALMotion proxy
+    """
+
+    def __init__(self, robot):
+        """
+        :param robot: the simulated robot
+        :type robot: SimulatedRobot
+        """
+        self.robot = robot
+
+    @_with_latency
+    def getPosition(self, name, frame, use_sensors):
+        if name == "CameraTop":
+            return self.robot.getCameraPosition(0)
+        if name == "CameraBottom":
+            return self.robot.getCameraPosition(1)
+        if name in ("LHand", "LArm"):
+            return list(self.robot.hand_position)
+        if name == "Torso":
+            # The position of the torso from the ground below it (FRAME_ROBOT)
+            return [0., 0., self.robot.torsoToWorld()[2, 3], 0., 0., 0.]
+        return [0.] * 6
+
+    @_with_latency
+    def getRobotPosition(self, use_sensors):
+        return self.robot.robot_pose.tolist()
+
+    @_with_latency
+    def getBodyNames(self, group):
+        return ["Head", "LArm", "LLeg", "RLeg", "RArm"] if group == "Chains" else sorted(self.robot.joints)
+
+    @_with_latency
+    def setCollisionProtectionEnabled(self, chain_name, enable):
+        return True
+
+    @_with_latency
+    def setMoveArmsEnabled(self, left_arm_enable, right_arm_enable):
+        pass
+
+    @_with_latency
+    def wakeUp(self):
+        self.robot.awake = True
+
+    @_with_latency
+    def rest(self):
+        self.robot.awake = False
+
+    @_with_latency
+    def robotIsWakeUp(self):
+        return self.robot.awake
+
+    @_with_latency
+    def setStiffnesses(self, names, stiffnesses):
+        names = _as_list(names)
+        if not isinstance(stiffnesses, (list, tuple)):
+            stiffnesses = [stiffnesses] * len(names)
+        self.robot.stiffnesses.update(zip(names, stiffnesses))
+
+    @_with_latency
+    def openHand(self, hand_name):
+        with self.robot._lock:
+            self.robot.hand_opened = True
+            hand = np.array(self.robot.hand_position[0:3], dtype=np.float64).reshape(1, 3)
+            self.robot.drops.append(geom.apply_transform(self.robot.torsoToWorld(), hand)[0])
+
+    @_with_latency
+    def closeHand(self, hand_name):
+        self.robot.hand_opened = False
+
+    @_with_latency
+    def angleInterpolation(self, names, angles, times, is_absolute):
+        names = _as_list(names)
+        if not isinstance(angles, (list, tuple)):
+            angles = [angles]
+        with self.robot._lock:
+            for name, angle in zip(names, angles):
+                if isinstance(angle, (list, tuple)):
+                    angle = angle[-1]
+                self.robot.joints[name] = angle if is_absolute else self.robot.joints.get(name, 0.) + angle
+
+    @_with_latency
+    def getAngles(self, names, use_sensors):
+        with self.robot._lock:
+            return [self.robot.joints.get(name, 0.) for name in _as_list(names)]
+
+    @_with_latency
+    def positionInterpolations(self, effector_names, frame, paths, axis_masks, times):
+        # The effector reaches the last position of the path
+        self.robot.hand_position = list(paths[-1])
+
+    @_with_latency
+    def moveTo(self, x, y, theta):
+        self.robot.move(x, y, theta)
+
+
+class SimulatedVideoDevice(object):
+    """
+    Stands in for the ALVideoDevice proxy by rendering the board seen by the simulated robot
+    """
+
+    # The images are stamped with our clock (see VideoController._grabFrame)
+    local_timestamps = True
+
+    def __init__(self, robot):
+        """
+        :param robot: the simulated robot
+        :type robot: SimulatedRobot
+        """
+        self.robot = robot
+        # subscriber -> [camera index, resolution, fps, time of the last image]
+        self.subscribers = {}
+
+    @_with_latency
+    def subscribeCamera(self, name, camera_index, resolution, color_space, fps):
+        subscriber = name + "_" + str(len(self.subscribers))
+        self.subscribers[subscriber] = [camera_index, resolution, fps, None]
+        return subscriber
+
+    @_with_latency
+    def unsubscribe(self, subscriber):
+        return self.subscribers.pop(subscriber, None) is not None
+
+    @_with_latency
+    def getSubscribers(self):
+        return list(self.subscribers)
+
+    @_with_latency
+    def setAllCameraParametersToDefault(self, subscriber):
+        pass
+
+    @_with_latency
+    def setCameraParameter(self, subscriber, parameter, value):
+        return True
+
+    @_with_latency
+    def getImageRemote(self, subscriber):
+        """
+        :return: the image of the camera of the subscriber, in the format of ALVideoDevice,
+                 or None if the subscriber is unknown. The images are served at the frame rate of the subscriber.
+        :rtype: list
+        """
+        settings = self.subscribers.get(subscriber)
+        if settings is None:
+            return None
+        camera_index, resolution, fps, last_time = settings
+        if fps and last_time is not None:
+            delay = last_time + 1. / fps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        settings[3] = time.time()
+        width = RESOLUTION_WIDTHS.get(resolution, REFERENCE_WIDTH)
+        img = self.robot.render(camera_index, width, width * 3 / 4)
+        return encode_image(img, timestamp=settings[3])
+
+    @_with_latency
+    def releaseImage(self, subscriber):
+        pass
+
+
+class SimulatedMemory(object):
+    """
+    Stands in for the ALMemory proxy : keeps the data inserted and the subscriptions to the events
+    """
+
+    def __init__(self, robot):
+        """
+        :param robot: the simulated robot
+        :type robot: SimulatedRobot
+        """
+        self.robot = robot
+        self.data = {}
+        # event -> {module name : callback name}
+        self.subscriptions = {}
+
+    @_with_latency
+    def insertData(self, key, value):
+        self.data[key] = value
+
+    @_with_latency
+    def getData(self, key):
+        return self.data.get(key)
+
+    @_with_latency
+    def subscribeToEvent(self, event, module_name, callback_name):
+        self.subscriptions.setdefault(event, {})[module_name] = callback_name
+
+    @_with_latency
+    def unsubscribeToEvent(self, event, module_name):
+        self.subscriptions.get(event, {}).pop(module_name, None)
+
+    @_with_latency
+    def raiseEvent(self, event, value):
+        """
+        :return: the (module name, callback name) of the subscribers of the event.
+                 The simulator has no broker : the callbacks are not called.
+        :rtype: list
+        """
+        self.data[event] = value
+        return self.subscriptions.get(event, {}).items()
+
+
+class SimulatedTextToSpeech(object):
+    """
+    Stands in for the ALTextToSpeech proxy : keeps the sentences said
+    """
+
+    def __init__(self, robot):
+        """
+        :param robot: the simulated robot
+        :type robot: SimulatedRobot
+        """
+        self.robot = robot
+        self.sentences = []
+
+    @_with_latency
+    def say(self, sentence):
+        print "NAO says : " + sentence
+        self.sentences.append(sentence)
+
+
+SIMULATED_MODULES = {"ALMotion": SimulatedMotion,
+                     "ALVideoDevice": SimulatedVideoDevice,
+                     "ALMemory": SimulatedMemory,
+                     "ALTextToSpeech": SimulatedTextToSpeech}
+
+
+def start_simulator(latency=0., **kwargs):
+    """
+    :param latency: the time waited by every call made to the robot, in seconds
+    :type latency: float
+    :param kwargs: the other parameters of the simulated robot (see SimulatedRobot)
+    :return: the simulated robot
+    :rtype: SimulatedRobot
+    Replace every proxy created from now on (see nao.proxy.create_proxy) by a proxy of the simulated robot
+    """
+    robot = SimulatedRobot(latency, **kwargs)
+
+    def create_simulated_proxy(module_name, robot_ip, robot_port):
+        if module_name not in SIMULATED_MODULES:
+            raise ValueError("The module " + module_name + " is not simulated")
+        return SIMULATED_MODULES[module_name](robot)
+    proxy.set_backend(create_simulated_proxy)
+    return robot
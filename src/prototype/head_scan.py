@@ -0,0 +1,268 @@
+import math
+
+import numpy as np
+
+__author__ = 'Anthony Rouneau'
+
+TOP_CAMERA = 0
+BOTTOM_CAMERA = 1
+
+# The maximum angles, in degrees, of the head poses of a search without any idea of the board position
+MAX_YAW = 30
+MAX_PITCH = 30
+# The distances, in meters, at which the board is searched if its position is unknown
+SEARCH_DISTANCES = [0.5, 1.0, 1.3, 1.75, 2.2, 2.5, 3.0]
+
+# Limits of NAO's head joints, in radians
+HEAD_YAW_LIMITS = (-2.0857, 2.0857)
+HEAD_PITCH_LIMITS = (-0.6720, 0.5149)
+# Height of the head joints from the torso, in meters
+NECK_HEIGHT = 0.1265
+# Pitch of the optical axis of each camera from the head, in radians
+CAMERA_PITCHES = (0.0209, 0.6929)
+# Height, in meters, of NAO's head above the game board (see MotionController.lookAtGameBoard)
+HEAD_HEIGHT_ABOVE_BOARD = 0.165
+# Error of the odometry, in meters per meter walked
+ODOMETRY_DRIFT = 0.1
+
+
+def cover(center, half_width, step, centered=False):
+    """
+    :param center: the middle of the range to cover
+    :type center: float
+    :param half_width: half of the width of the range to cover
+    :type half_width: float
+    :param step: the width covered by one view
+    :type step: float
+    :param centered: if True, one of the views is centered on the middle of the range
+    :type centered: bool
+    :return: the middles of the minimal set of views that cover the range, sorted by distance from its middle
+    :rtype: list
+    """
+    nb_of_views = max(1, int(math.ceil(2 * half_width / step - 1e-9)))
+    if centered and nb_of_views % 2 == 0:
+        nb_of_views += 1
+    spacing = 2 * half_width / nb_of_views
+    views = [center + (i - (nb_of_views - 1) / 2.) * spacing for i in range(nb_of_views)]
+    return sorted(views, key=lambda view: abs(view - center))
+
+
+class HeadScanPlanner(object):
+    """
+    Plans the head poses from which NAO searches the game board, from the most likely to the least likely.
+    The last known position of the board is kept with the position of the robot at that time, so that the board
+        position can be predicted after the robot walked, using its odometry.
+    """
+
+    def __init__(self, model, camera_matrix, resolution=(320, 240), overlap=0.2, max_yaw=MAX_YAW, max_pitch=MAX_PITCH,
+                 search_distances=SEARCH_DISTANCES, position_uncertainty=0.1):
+        """
+        :param model: the model of the Connect 4
+        :type model: DefaultModel
+        :param camera_matrix: the intrinsic camera matrix, used to compute the field of view of the cameras
+        :type camera_matrix: np.matrix
+        :param resolution: the (width, height) of the images for which the camera matrix was computed
+        :type resolution: tuple
+        :param overlap: the part of the field of view shared by two neighbour head poses, in [0, 1[
+        :type overlap: float
+        :param max_yaw: the maximum yaw, in degrees, of the head during a search without a predicted position
+        :type max_yaw: float
+        :param max_pitch: the maximum pitch difference, in degrees, from the default pitch of the head during a
+                          search without a predicted position
+        :type max_pitch: float
+        :param search_distances: the distances at which the board is searched if its position is unknown
+        :type search_distances: list
+        :param position_uncertainty: the uncertainty, in meters, of the last known position of the board
+        :type position_uncertainty: float
+        """
+        # The points of the model looked at to search the front holes and the landmarks of the upper face
+        self.front_holes_middle = np.mean(model.three_d[model.FRONT_HOLES], axis=0)
+        self.upper_holes_middle = np.mean(model.three_d[model.UPPER_HOLES], axis=0)
+        camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        # Horizontal and vertical field of view of the cameras, in radians
+        self.fov = (2 * math.atan(resolution[0] / 2. / camera_matrix[0, 0]),
+                    2 * math.atan(resolution[1] / 2. / camera_matrix[1, 1]))
+        self.overlap = overlap
+        self.max_yaw = math.radians(max_yaw)
+        self.max_pitch = math.radians(max_pitch)
+        self.search_distances = list(search_distances)
+        self.position_uncertainty = position_uncertainty
+        # The last known board pose from the ground below the torso (FRAME_ROBOT), so that it does not depend on the
+        #   posture of the robot, and the position (x, y, theta) of the robot in the world at that time
+        self.board_pose = None
+        self.board_robot_position = None
+
+    def getStep(self, axis):
+        """
+        :param axis: 0 for the yaw, 1 for the pitch
+        :type axis: int
+        :return: the angle, in radians, between two neighbour head poses along the axis
+        :rtype: float
+        """
+        return self.fov[axis] * (1 - self.overlap)
+
+    def getSearchedYawWidth(self):
+        """
+        :return: the horizontal angle, in radians, covered by a search without a predicted position.
+                 The robot can turn by this angle to search somewhere else.
+        :rtype: float
+        """
+        return 2 * self.max_yaw + self.getStep(0)
+
+    def setBoardPose(self, board_pose, robot_position, torso_height=0.):
+        """
+        :param board_pose: the board pose from the torso, 4x4 homogeneous matrix (see Connect4Tracker.board_pose)
+        :type board_pose: np.ndarray
+        :param robot_position: the position (x, y, theta) of the robot in the world (see ALMotion.getRobotPosition)
+        :type robot_position: list
+        :param torso_height: the height of the torso above the ground when the board pose was found
+                             (see MotionController.getTorsoHeight)
+        :type torso_height: float
+        """
+        self.board_pose = np.array(board_pose, dtype=np.float64)
+        self.board_pose[2, 3] += torso_height
+        self.board_robot_position = np.array(robot_position[0:3], dtype=np.float64)
+
+    def forgetBoardPose(self):
+        self.board_pose = None
+        self.board_robot_position = None
+
+    def predictPosition(self, model_point, robot_position, torso_height=0.):
+        """
+        :param model_point: a point (x, y, z) of the model of the Connect 4
+        :type model_point: np.array
+        :param robot_position: the current position (x, y, theta) of the robot in the world
+        :type robot_position: list
+        :param torso_height: the current height of the torso above the ground
+        :type torso_height: float
+        :return: the predicted position (x, y, z) of the point from the torso and the uncertainty of the prediction,
+                 in meters, or None if the board pose is unknown
+        :rtype: tuple
+        """
+        if self.board_pose is None:
+            return None
+        x0, y0, theta0 = self.board_robot_position
+        x1, y1, theta1 = robot_position[0:3]
+        # Position of the point from the torso when the board was seen, in the world, then from the current torso
+        bx, by, bz = np.dot(self.board_pose[0:3, 0:3], model_point) + self.board_pose[0:3, 3]
+        world_x = x0 + math.cos(theta0) * bx - math.sin(theta0) * by
+        world_y = y0 + math.sin(theta0) * bx + math.cos(theta0) * by
+        dx, dy = world_x - x1, world_y - y1
+        position = np.array([math.cos(theta1) * dx + math.sin(theta1) * dy,
+                             -math.sin(theta1) * dx + math.cos(theta1) * dy,
+                             bz - torso_height])
+        rotation = abs(math.atan2(math.sin(theta1 - theta0), math.cos(theta1 - theta0)))
+        walked = math.hypot(x1 - x0, y1 - y0) + rotation * math.hypot(position[0], position[1])
+        return position, self.position_uncertainty + ODOMETRY_DRIFT * walked
+
+    @staticmethod
+    def getHeadAnglesToward(position, camera_num=TOP_CAMERA):
+        """
+        :param position: the position (x, y, z) from the torso to look at
+        :type position: list
+        :param camera_num: the camera that must look at the position
+        :type camera_num: int
+        :return: the (pitch, yaw) of the head, in radians, that centers the position in the image of the camera
+        :rtype: tuple
+        """
+        x, y, z = position[0:3]
+        yaw = math.atan2(y, x)
+        pitch = math.atan2(NECK_HEIGHT - z, math.hypot(x, y)) - CAMERA_PITCHES[camera_num]
+        return pitch, yaw
+
+    @staticmethod
+    def clip(pitch, yaw):
+        """
+        :return: the (pitch, yaw) of the head, inside the limits of its joints
+        :rtype: tuple
+        """
+        return (float(np.clip(pitch, HEAD_PITCH_LIMITS[0], HEAD_PITCH_LIMITS[1])),
+                float(np.clip(yaw, HEAD_YAW_LIMITS[0], HEAD_YAW_LIMITS[1])))
+
+    def _coverRegion(self, pitch, yaw, pitch_half_width, yaw_half_width, centered=False):
+        """
+        :param centered: if True, the first head pose is centered on the region (see cover)
+        :type centered: bool
+        :return: the minimal set of head poses (pitch, yaw) that cover the region, sorted by angle from its middle
+        :rtype: list
+        """
+        poses = []
+        for view_pitch in cover(pitch, pitch_half_width, self.getStep(1), centered):
+            for view_yaw in cover(yaw, yaw_half_width, self.getStep(0), centered):
+                pose = self.clip(view_pitch, view_yaw)
+                if pose not in poses:
+                    poses.append(pose)
+        return sorted(poses, key=lambda pose: math.hypot(pose[0] - pitch, pose[1] - yaw))
+
+    def _predictedPoses(self, model_point, robot_position, camera_num, torso_height):
+        """
+        :return: the head poses that cover the predicted position of the model point, with its predicted distance,
+                 as a list of (distance, pitch, yaw), empty if the board pose is unknown
+        :rtype: list
+        """
+        if self.board_pose is None or robot_position is None:
+            return []
+        position, uncertainty = self.predictPosition(model_point, robot_position, torso_height)
+        distance = math.hypot(position[0], position[1])
+        if position[0] <= 0:
+            # The board is behind the robot : the head cannot look at it
+            return []
+        pitch, yaw = self.getHeadAnglesToward(position, camera_num)
+        half_width = math.atan2(uncertainty, distance)
+        return [(distance, view_pitch, view_yaw)
+                for view_pitch, view_yaw in self._coverRegion(pitch, yaw, half_width, half_width)]
+
+    def planBoardSearch(self, robot_position=None, distance=-1, torso_height=0.):
+        """
+        :param robot_position: the current position (x, y, theta) of the robot in the world, None if unknown
+        :type robot_position: list
+        :param distance: the estimated distance of the board, -1 if unknown
+        :type distance: float
+        :param torso_height: the height of the torso above the ground during the search
+        :type torso_height: float
+        :return: the views from which the front holes of the board are searched with the top camera, from the most
+                 likely to the least likely, as a list of (distance, pitch, yaw).
+                 The consecutive views that share a head pose only differ by the distance given to the detection.
+        :rtype: list
+        """
+        views = self._predictedPoses(self.front_holes_middle, robot_position, TOP_CAMERA, torso_height)
+        distances = self.search_distances
+        if distance > 0:
+            distances = sorted(set(distances + [distance]), key=lambda search_distance: abs(search_distance - distance))
+        # The pitches needed to see the board at each distance, covered by as few head poses as possible
+        board_height = NECK_HEIGHT - HEAD_HEIGHT_ABOVE_BOARD
+        pitches = [self.getHeadAnglesToward((search_distance, 0, board_height))[0] for search_distance in distances]
+        head_pitches = cover((max(pitches) + min(pitches)) / 2., (max(pitches) - min(pitches)) / 2., self.getStep(1))
+        for yaw in cover(0, self.max_yaw, self.getStep(0), centered=True):
+            for head_pitch in head_pitches:
+                for search_distance, pitch in zip(distances, pitches):
+                    # The distance is searched from the head pose that sees it the best
+                    if min(head_pitches, key=lambda other: abs(other - pitch)) == head_pitch:
+                        view = (search_distance,) + self.clip(head_pitch, yaw)
+                        if view not in views:
+                            views.append(view)
+        return views
+
+    def planLandmarkSearch(self, robot_position=None, default_pitch=0., default_yaw=0., camera_num=BOTTOM_CAMERA,
+                           torso_height=0.):
+        """
+        :param robot_position: the current position (x, y, theta) of the robot in the world, None if unknown
+        :type robot_position: list
+        :param default_pitch: the pitch, in radians, around which the head searches if the board position is unknown
+        :type default_pitch: float
+        :param default_yaw: the yaw, in radians, around which the head searches if the board position is unknown
+        :type default_yaw: float
+        :param camera_num: the camera that searches the landmarks
+        :type camera_num: int
+        :param torso_height: the height of the torso above the ground during the search
+        :type torso_height: float
+        :return: the head poses from which the landmarks of the board are searched, from the most likely to the least
+                 likely, as a list of (pitch, yaw) in radians
+        :rtype: list
+        """
+        poses = [(pitch, yaw) for _, pitch, yaw in self._predictedPoses(self.upper_holes_middle, robot_position,
+                                                                         camera_num, torso_height)]
+        for pose in self._coverRegion(default_pitch, default_yaw, self.max_pitch, self.max_yaw, centered=True):
+            if pose not in poses:
+                poses.append(pose)
+        return poses
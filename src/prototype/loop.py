@@ -11,15 +11,24 @@ from connect4.detector.front_holes import FrontHolesGridNotFoundException
 from connect4.detector.upper_hole import NotEnoughLandmarksException
 from connect4.model.default_model import DefaultModel
 from nao import data
+from prototype.head_scan import HeadScanPlanner
+from prototype.pipeline import DualCameraPipeline
 from utils.ai.game_state import InvalidStateException
 from utils.camera import geom
+from utils.camera.frame import Frame
 
 __author__ = 'Anthony Rouneau'
 
-
-HEAD_STEP = 5
-MAX_YAW = 30
-MAX_PITCH = 30
+# The part of the remaining error of the hand position corrected at each step of the visual servoing
+SERVO_GAIN = 0.8
+# The duration, in seconds, of each correction of the hand position
+SERVO_STEP_DURATION = 0.2
+# The maximum duration, in seconds, of the visual servoing
+SERVO_TIMEOUT = 3.0
+# The maximum correction of the hand position in meters, beyond which the hole is considered as out of reach
+SERVO_MAX_CORRECTION = 0.05
+# The number of times a new frame is waited for (see VideoController.nextAfter) before giving up
+NEW_FRAME_TRIES = 3
 
 
 class LogicalLoop(object):
@@ -28,7 +37,8 @@ class LogicalLoop(object):
     """
 
     def __init__(self, nao_motion, nao_video, nao_tts, wait_disc_func, ppA=0.05, cA=0.005, rA=0.8, min_detections=3,
-                 dist=-1, sloped=True, nao_strategy=Basic, other_strategy=NAOVision):
+                 dist=-1, sloped=True, nao_strategy=Basic, other_strategy=NAOVision, use_pipeline=False,
+                 visual_servo=True):
         """
         :param nao_motion: an instance of the motion controller of NAO
         :type nao_motion: nao.controller.motion.MotionController
@@ -47,6 +57,10 @@ class LogicalLoop(object):
         :param sloped: True if the game board is sloped from NAO
         :param nao_strategy: the class that defines NAO's strategy
         :param other_strategy: the class that defines the other player's strategy
+        :param use_pipeline: if True, both cameras are captured and the board is detected in their frames
+                             in background (see DualCameraPipeline)
+        :param visual_servo: if True, the hand is placed above the hole by following the markers from a frame to the
+                             next and correcting its position at each frame (see servoLeftHand)
         """
         self.rA = rA
         self.cA = cA
@@ -54,22 +68,35 @@ class LogicalLoop(object):
         self.estimated_distance = dist
         self.min_detections = min_detections
         self.sloped = sloped
+        self.visual_servo = visual_servo
         self.wait_disc_func = wait_disc_func
         # Setting NAO's controllers
         self.tts = nao_tts
         self.nao_motion = nao_motion
         self.nao_video = nao_video
         self.camera_subscribed = [False, False]
-        self.current_yaw = self.nao_motion.DEFAULT_HEAD_YAW
-        self.current_pitch = self.nao_motion.DEFAULT_HEAD_PITCH
-        self.yaw_sign = 1
-        self.pitch_sign = -1
+        # The time of reception of the last frame used, for each camera
+        self.last_frame_times = [None, None]
 
         # Connect 4 detectors and models
         self.c4_model = DefaultModel()
         self.c4_tracker = Connect4Tracker(self.c4_model)
         self.c4_handler = Connect4Handler(self.getNaoImage)
         self.c4_coords = [0, 0, 0, 0, 0, 0]
+        # The head poses are planned from the last known board pose (see moveHeadToNextPosition)
+        self.head_scan = HeadScanPlanner(self.c4_model, data.CAM_MATRIX)
+        self.head_poses = None
+        # The time at which NAO stopped moving : the frames and the detections made before are not valid anymore
+        self.last_move_time = 0
+        # The motions are executed in background, so that NAO can think while it walks
+        self.nao_motion.startMotionQueue()
+        # The duration of each turn played by the loop, in seconds
+        self.turn_durations = []
+        self.pipeline = None
+        if use_pipeline:
+            self.pipeline = DualCameraPipeline(self.nao_video, self.nao_motion, data.CAM_MATRIX, data.CAM_DISTORSION,
+                                               sloped=self.sloped)
+            self.pipeline.start()
         # Creating the strategies that will play the game
         self.strategy = nao_strategy()
         if other_strategy is NAOVision:
@@ -92,7 +119,9 @@ class LogicalLoop(object):
         :param res: The resolution parameter
         :param camera_num: 0 : TopCamera, 1 : BottomCamera
         :type camera_num: int
-        :return: An OpenCV readable image that comes from NAO's camera
+        :return: The frame of an image that comes from NAO's camera, taken after its last move,
+                 or None if no such frame could be taken
+        :rtype: Frame
         """
         if not self.camera_subscribed[camera_num]:
             ret = self.nao_video.connectToCamera(res=camera_num + 1, fps=30, camera_num=camera_num,
@@ -101,97 +130,282 @@ class LogicalLoop(object):
             if ret < 0:
                 print "Could not open camera"
                 return None
-        return self.nao_video.getImageFromCamera(camera_num=camera_num)
+            self.nao_video.startCapture(camera_num=camera_num)
+        # The frames captured while NAO moves are blurred and do not match the position of the camera
+        self.nao_motion.waitForMotions()
+        since = self.last_move_time
+        if self.last_frame_times[camera_num] is not None:
+            since = max(since, self.last_frame_times[camera_num])
+        # A frame that has not been used yet is taken from the capture thread
+        frame = None
+        if self.last_frame_times[camera_num] is None:
+            frame = self.nao_video.latest(camera_num=camera_num)
+            if frame is not None and frame[0] <= since:
+                frame = None
+        tries = 0
+        while frame is None and self.nao_video.isCapturing(camera_num) and tries < NEW_FRAME_TRIES:
+            frame = self.nao_video.nextAfter(since, camera_num=camera_num)
+            tries += 1
+        if frame is None:
+            if self.nao_video.isCapturing(camera_num):
+                # The latest frame captured may have been taken before or during the last move
+                print "ERR: no new frame from camera " + str(camera_num)
+                return None
+            # The frame is grabbed now, after the last move
+            return self.nao_video.getFrameFromCamera(camera_num=camera_num)
+        self.last_frame_times[camera_num] = frame[0]
+        return Frame(frame[1], timestamp=frame[0])
 
-    def findGameBoard(self):
+    def close(self):
         """
+        Stop the threads started by the loop : the detection pipeline, the capture of the cameras and the motion queue
+        """
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        self.nao_video.stopCapture()
+        self.camera_subscribed = [False, False]
+        self.nao_motion.stopMotionQueue()
 
+    def findGameBoard(self):
+        """
+        Search the game board from the head poses planned by the head scan planner, from the most likely to the
+            least likely. NAO turns to search somewhere else if the board could not be found from any of them.
         """
-        i = 0
-        distances = [self.estimated_distance]
-        if self.estimated_distance == -1:
-            distances = [0.5, 1.0, 1.3, 1.75, 2.2, 2.5, 3.0]
         while True:
-            for dist in distances:
+            head_pose = None
+            # NAO searches crouched : the predicted position of the board depends on the height of its torso
+            self.nao_motion.crouch()
+            # Crouching only stiffens the pitch of the head : the yaw is needed to turn the head
+            self.nao_motion.stiffHead()
+            for dist, pitch, yaw in self.head_scan.planBoardSearch(self.getRobotPosition(), self.estimated_distance,
+                                                                   self.nao_motion.getTorsoHeight()):
                 try:
-                    self.nao_motion.lookAtGameBoard(dist)
+                    if (pitch, yaw) != head_pose:
+                        self._trackMotion(self.nao_motion.moveHeadAsync(pitch, yaw, radians=True))
+                        head_pose = (pitch, yaw)
+                    self.fusePipelineResults(dist)
                     coords = self.c4_handler \
                         .getUpperHoleCoordinatesUsingFrontHoles(dist, self.sloped, 3,
                                                                 self.nao_motion.getCameraTopPositionFromTorso(),
                                                                 nao.data.CAM_MATRIX, nao.data.CAM_DISTORSION,
-                                                                debug=True, tries=self.min_detections)
+                                                                debug=True, tries=self.min_detections,
+                                                                use_cache=self.pipeline is not None)
+                    self.rememberBoardPose()
                     coords[0] += 0.25  # Fix calibration error
                     self.estimated_distance = coords[0]
                     self.c4_coords = coords
                     return 0
                 except FrontHolesGridNotFoundException:
-                    i += 1
-                    if i > 5:
-                        i = 0
-                        self.tts.say("Je ne trouve pas le Puissance 4...")
-                        self.nao_motion.moveAt(0, 0, 0.8)
                     continue
+            self.tts.say("Je ne trouve pas le Puissance 4...")
+            self.moveRobot(0, 0, self.head_scan.getSearchedYawWidth())
+
+    def getRobotPosition(self):
+        """
+        :return: the position (x, y, theta) of the robot in the world, once it has stopped moving
+        :rtype: list
+        """
+        self.nao_motion.waitForMotions()
+        return self.nao_motion.getRobotPosition()
+
+    def rememberBoardPose(self):
+        """
+        Give the board pose kept by the tracker to the head scan planner, so that it can predict where the board is
+            once NAO has walked
+        """
+        # The board pose is reset when NAO walks (see moveRobot) : if it is kept, NAO has not walked since
+        if self.c4_handler.tracker.board_pose is not None:
+            self.head_scan.setBoardPose(self.c4_handler.tracker.board_pose, self.nao_motion.getRobotPosition(),
+                                        self.nao_motion.getTorsoHeight())
+
+    def moveRobot(self, x, y, theta):
+        """
+        :param x: the distance to travel forward (negative value = backward) in meters
+        :type x: float
+        :param y: the distance to travel to the left (negative value = to the right) in meters
+        :type y: float
+        :param theta: the rotation to apply to NAO, in radians
+        :type theta: float
+        :return: the future of the walk, that goes on in background
+        :rtype: nao.controller.motion_queue.MotionFuture
+        Move NAO and forget the board pose, as it is no longer valid once the robot has walked
+        """
+        self.rememberBoardPose()
+        future = self.nao_motion.moveAtAsync(x, y, theta)
+        self.c4_handler.tracker.resetBoardPose()
+        self._trackMotion(future)
+        return future
+
+    def _trackMotion(self, future):
+        """
+        :param future: the future of a motion of NAO
+        :type future: nao.controller.motion_queue.MotionFuture
+        Invalidate the frames and the detections made until the end of the motion
+        """
+        self.last_move_time = time.time()
+        # The markers can not be followed from a frame to the next while the camera moves
+        self.c4_handler.marker_flow.stop()
+        future.addDoneCallback(lambda done: setattr(self, "last_move_time", time.time()))
+
+    def fusePipelineResults(self, distance=None):
+        """
+        :param distance: the estimated distance of the board, given to the front holes detection if not None
+        :type distance: float
+        :return: the number of detections of the pipeline fused into the tracker of the handler
+        :rtype: int
+        Wait until NAO has stopped moving, so that the position of its cameras can be read.
+        If the pipeline is used, fuse its latest detections into the tracker, so that the handler can use them
+            instead of waiting for its own detection.
+        """
+        # The results of the frames captured while NAO moves are ignored (see last_move_time)
+        self.nao_motion.waitForMotions()
+        if self.pipeline is None:
+            return 0
+        if distance is not None:
+            self.pipeline.distance = distance
+        return self.pipeline.applyTo(self.c4_handler.tracker, since=self.last_move_time)
+
+    def getUpperHoleCoordinates(self, hole_index):
+        """
+        :param hole_index: the index of the hole
+        :type hole_index: int
+        :return: the hand position 6D above the hole, from the torso
+        :rtype: list
+        Get the coordinates of an upper hole using the Hamming codes seen by the bottom camera. If less than two codes
+            are seen, the front holes seen by the same camera are used with them (see
+            Connect4Handler.getUpperHolesCoordinatesUsingAllLandmarks).
+        Raises a NotEnoughLandmarksException if the landmarks seen are not enough to find the board.
+        """
+        camera_position = self.nao_motion.getCameraBottomPositionFromTorso()
+        try:
+            return self.c4_handler.getUpperHoleCoordinatesUsingMarkers(hole_index, camera_position, data.CAM_MATRIX,
+                                                                       data.CAM_DISTORSION,
+                                                                       tries=self.min_detections, use_cache=True)
+        except NotEnoughLandmarksException:
+            if self.estimated_distance <= 0:
+                raise
+            coords = self.c4_handler.getUpperHolesCoordinatesUsingAllLandmarks(self.estimated_distance, self.sloped,
+                                                                               camera_position, data.CAM_MATRIX,
+                                                                               data.CAM_DISTORSION,
+                                                                               tries=self.min_detections)
+            return coords[hole_index].tolist()
 
     def inverseKinematicsConvergence(self, hole_index):
         """
         :param hole_index: the number of the hole above which we want to move NAO's hand
         :return:
         """
-        self.nao_motion.moveHead(self.nao_motion.DEFAULT_HEAD_PITCH, self.nao_motion.DEFAULT_HEAD_YAW, True)
+        # The landmarks are first searched where the board is expected
+        self.head_poses = None
+        self.moveHeadToNextPosition()
         max_tries = 4  # If we don't see any marker after 2 tries, we move NAO's head
         i = 0
         stable = False
         while not stable:
             while i < max_tries:
                 try:
-                    hole_coord = self.c4_handler \
-                        .getUpperHoleCoordinatesUsingMarkers(hole_index,
-                                                             self.nao_motion.getCameraBottomPositionFromTorso(),
-                                                             data.CAM_MATRIX, data.CAM_DISTORSION,
-                                                             tries=self.min_detections)
-                    self.resetHead()
+                    self.fusePipelineResults()
+                    hole_coord = self.getUpperHoleCoordinates(hole_index)
+                    # The landmarks were found : the head stays where it sees them and the scan is over
+                    self.head_poses = None
                     if abs(hole_coord[5] + 0.505) > self.rA:  # If the board is sloped from NAO, we need to rotate NAO
-                        self.nao_motion.moveAt(0, 0, (hole_coord[5] + 0.505)/3)
+                        self.moveRobot(0, 0, (hole_coord[5] + 0.505)/3)
                         continue
                     dist_from_optimal = geom.vectorize((0.161, 0.113), (hole_coord[0], hole_coord[1]))
                     if abs(dist_from_optimal[0]) > self.ppA or abs(dist_from_optimal[1]) > 2 * self.ppA:
-                        self.nao_motion.moveAt(dist_from_optimal[0], dist_from_optimal[1], hole_coord[5] + 0.505)
+                        self.moveRobot(dist_from_optimal[0], dist_from_optimal[1], hole_coord[5] + 0.505)
                         continue
                     self.estimated_distance = hole_coord[0]
                     i = 0
-                    self.nao_motion.setLeftHandPosition(hole_coord, mask=63)
-                    diff = self.nao_motion.compareToLeftHandPosition(hole_coord)
-                    if abs(diff[0]) < self.cA and abs(diff[1]) < 2 * self.cA:
+                    if self.visual_servo:
+                        hand_coord = self.servoLeftHand(hole_index, hole_coord)
+                    else:
+                        hand_coord = self.placeLeftHand(hole_coord)
+                    if hand_coord is not None:
                         stable = True
-                        self.nao_motion.playDisc(hole_coord)
+                        self.nao_motion.playDisc(hand_coord)
                         break
                     else:
+                        diff = self.nao_motion.compareToLeftHandPosition(hole_coord)
                         self.nao_motion.setLeftArmRaised()
-                        self.nao_motion.moveAt(diff[0], diff[1], hole_coord[5] + 0.505)
+                        self.moveRobot(diff[0], diff[1], hole_coord[5] + 0.505)
                         i += 1
                 except NotEnoughLandmarksException:
                     i += 1
             if not stable:
                 # self.tts.say("Je ne trouve pas les marqueurs dans mon champ de vision")
+                # The next frame is taken once the head has reached its position (see getNaoImage)
                 self.moveHeadToNextPosition()
-                time.sleep(0.500)
                 i = 0
 
+    def placeLeftHand(self, hole_coord):
+        """
+        :param hole_coord: the hand position 6D above the hole, from the torso
+        :type hole_coord: list
+        :return: the position given to the hand, or None if the hand could not reach the hole accurately enough
+        :rtype: list
+        Move the hand above the hole once, without looking at it
+        """
+        self.nao_motion.setLeftHandPosition(hole_coord, mask=63)
+        diff = self.nao_motion.compareToLeftHandPosition(hole_coord)
+        if abs(diff[0]) < self.cA and abs(diff[1]) < 2 * self.cA:
+            return hole_coord
+        return None
+
+    def servoLeftHand(self, hole_index, hole_coord):
+        """
+        :param hole_index: the number of the hole above which NAO's hand is placed
+        :type hole_index: int
+        :param hole_coord: the hand position 6D above the hole, from the torso
+        :type hole_coord: list
+        :return: the position given to the hand that placed it above the hole, or None if the hand could not
+                 reach the hole accurately enough
+        :rtype: list
+        Move the hand above the hole, then correct its position with the error between the hand and the hole at
+            each frame, until the error is below the coordinates accuracy.
+        The hole is followed from a frame to the next, the markers are only detected again if they are lost.
+        """
+        # The head does not move while the hand is placed
+        camera_position = self.nao_motion.getCameraBottomPositionFromTorso()
+        command = list(hole_coord)
+        self.nao_motion.setLeftHandPosition(command, mask=63)
+        start = time.time()
+        while time.time() - start < SERVO_TIMEOUT:
+            hole_coord = self.c4_handler.trackUpperHoleCoordinatesUsingMarkers(hole_index, camera_position,
+                                                                                data.CAM_MATRIX, data.CAM_DISTORSION)
+            diff = self.nao_motion.compareToLeftHandPosition(hole_coord)
+            if abs(diff[0]) < self.cA and abs(diff[1]) < 2 * self.cA:
+                return command
+            correction = geom.vectorize(hole_coord[0:2], command[0:2]) + SERVO_GAIN * diff
+            if abs(correction).max() > SERVO_MAX_CORRECTION:
+                return None
+            command = [hole_coord[0] + correction[0], hole_coord[1] + correction[1]] + list(hole_coord[2:])
+            self.nao_motion.setLeftHandPosition(command, mask=63, time_limit=SERVO_STEP_DURATION)
+        return None
+
     def loop(self):
         self.findGameBoard()
         self.walkTowardConnect4(analysis=not self.game.checkPlayerTurn(self.NAO_player))
         finished = 0
         while not finished:
+            turn_start = time.time()
             if not self.game.checkPlayerTurn(self.NAO_player):
                 finished = self.analyseGameState()
             if not finished:
                 self.playingRoutine()
+            self.turn_durations.append(time.time() - turn_start)
+            print "Turn {0} played in {1:.2f} s".format(len(self.turn_durations), self.turn_durations[-1])
 
     def playingRoutine(self):
+        walk = None
+        if self.estimated_distance > 0.3:
+            # NAO chooses its action while it walks
+            walk = self.walkTowardConnect4()
         action = self.strategy.chooseNextAction(self.game.game_state)
         self.game.makeMove(action)
-        if self.estimated_distance > 0.3:
-            self.walkTowardConnect4()
+        if walk is not None:
+            walk.result()
         self.wait_disc_func()
         self.inverseKinematicsConvergence(action)
         if type(self.other_strategy) is NAOVision:
@@ -201,20 +415,22 @@ class LogicalLoop(object):
         """
         Move NAO back so it can see the game board entirely
         """
-        self.nao_motion.moveAt(-0.50, 0, 0)
+        self.moveRobot(-0.50, 0, 0)
         self.estimated_distance = 0.50
         self.nao_motion.crouch()
 
     def walkTowardConnect4(self, analysis=False):
         """
+        :return: the future of the walk, that goes on in background
+        :rtype: nao.controller.motion_queue.MotionFuture
         Move NAO to the game board
         """
-        self.nao_motion.motion_proxy.wakeUp()
         next_dist = 0.25
         if analysis:
             next_dist = 0.5
-        self.nao_motion.moveAt(self.c4_coords[0] - next_dist, self.c4_coords[1], 0)
+        walk = self.moveRobot(self.c4_coords[0] - next_dist, self.c4_coords[1], 0)
         self.estimated_distance = next_dist
+        return walk
         # self.nao_motion.moveAt(coords[0], coords[1], coords[5])
 
     def analyseGameState(self):
@@ -277,37 +493,19 @@ class LogicalLoop(object):
 
     def moveHeadToNextPosition(self):
         """
-        Move NAO's head to the next position of the spiral
-        """
-        if self.pitch_sign == -1:
-            if self.yaw_sign == 1:
-                self.yaw_sign = -1
-                self.current_yaw += HEAD_STEP
-            else:
-                if self.yaw_sign == -1:
-                    self.pitch_sign = 1
-                    self.current_pitch += HEAD_STEP
-        elif self.yaw_sign == -1:
-            self.yaw_sign = 1
-            self.current_yaw += HEAD_STEP
-        else:
-            self.pitch_sign = -1
-            self.current_pitch += HEAD_STEP
-        if self.current_yaw > 40 or self.current_pitch > 40:
+        Move NAO's head to the next pose of the landmarks search, planned from the last known board pose
+        """
+        if self.head_poses is None:
+            self.head_poses = self.head_scan.planLandmarkSearch(self.getRobotPosition(),
+                                                                self.nao_motion.DEFAULT_HEAD_PITCH,
+                                                                self.nao_motion.DEFAULT_HEAD_YAW,
+                                                                torso_height=self.nao_motion.getTorsoHeight())
+        if len(self.head_poses) == 0:
+            self.head_poses = None
             self.nao_motion.releaseHead()
             self.tts.say("Veuillez placer ma tete au bon endroit s'il vous plait")
             time.sleep(5)
         else:
-            self.nao_motion.moveHead(self.current_pitch * self.pitch_sign,
-                                     self.current_yaw * self.yaw_sign,
-                                     radians=False)
-
-    def resetHead(self):
-        """
-        Set the head to the default position
-        """
-        self.nao_motion.moveHead(self.nao_motion.DEFAULT_HEAD_PITCH, self.nao_motion.DEFAULT_HEAD_YAW, True)
-        self.current_pitch = self.nao_motion.DEFAULT_HEAD_PITCH
-        self.current_yaw = self.nao_motion.DEFAULT_HEAD_YAW
-        self.pitch_sign = -1
-        self.yaw_sign = 1
+            pitch, yaw = self.head_poses.pop(0)
+            self.nao_motion.stiffHead()
+            self._trackMotion(self.nao_motion.moveHeadAsync(pitch, yaw, radians=True))
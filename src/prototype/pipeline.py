@@ -0,0 +1,256 @@
+import threading
+import time
+from collections import namedtuple
+
+from connect4.connect4handler import Connect4Handler
+from connect4.detector.front_holes import FrontHolesGridNotFoundException
+from connect4.detector.upper_hole import NotEnoughLandmarksException
+from utils.camera.circle_grid_detector import CircleGridNotFoundException
+from utils.camera.frame import Frame
+
+__author__ = 'Anthony Rouneau'
+
+TOP_CAMERA = 0
+BOTTOM_CAMERA = 1
+
+# The result of a detection : the time at which the frame was received, the pose of the board seen from the camera
+#   (rvec, tvec, both None if the detection failed) and the position 6D of the camera from the torso
+BoardPoseEstimation = namedtuple("BoardPoseEstimation", ["timestamp", "rvec", "tvec", "camera_position"])
+
+
+class DetectionWorker(threading.Thread):
+    """
+    Runs a detection on each new frame of a camera and publishes the latest result
+    """
+
+    def __init__(self, nao_video, camera_num, detect, frame_timeout=1.0):
+        """
+        :param nao_video: the video controller, that captures the frames of the camera (see startCapture)
+        :type nao_video: nao.controller.video.VideoController
+        :param camera_num: 0 : the top camera, 1 : the bottom camera
+        :type camera_num: int
+        :param detect: the function that takes a frame and returns (rvec, tvec, camera_position).
+                       It can raise the exceptions of the detectors if the board is not found.
+        :type detect: function
+        :param frame_timeout: the maximum time to wait for a new frame before checking if the worker must stop
+        :type frame_timeout: float
+        """
+        super(DetectionWorker, self).__init__()
+        self.daemon = True
+        self.nao_video = nao_video
+        self.camera_num = camera_num
+        self.detect = detect
+        self.frame_timeout = frame_timeout
+        self.nb_of_detections = 0
+        self._result = None
+        self._success = None
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last_timestamp = 0
+        while not self._stop_event.is_set():
+            frame = self.nao_video.nextAfter(last_timestamp, camera_num=self.camera_num, timeout=self.frame_timeout)
+            if frame is None:
+                # The camera is not captured (yet)
+                self._stop_event.wait(0.1)
+                continue
+            last_timestamp, img = frame
+            try:
+                rvec, tvec, camera_position = self.detect(Frame(img, timestamp=last_timestamp))
+            except (FrontHolesGridNotFoundException, NotEnoughLandmarksException, CircleGridNotFoundException):
+                rvec, tvec, camera_position = None, None, None
+            except Exception, err:
+                # An error on one frame (e.g. a degenerate one) must not stop the worker
+                print "ERR: detection failed on camera %d : %s" % (self.camera_num, err)
+                rvec, tvec, camera_position = None, None, None
+            self._publish(BoardPoseEstimation(last_timestamp, rvec, tvec, camera_position))
+
+    def _publish(self, result):
+        with self._condition:
+            self.nb_of_detections += 1
+            self._result = result
+            if result.rvec is not None:
+                self._success = result
+            self._condition.notify_all()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def latest(self, successful=True):
+        """
+        :param successful: if True, the failed detections are ignored
+        :type successful: bool
+        :return: the result of the latest detection, or None if there is none yet
+        :rtype: BoardPoseEstimation
+        """
+        with self._condition:
+            return self._success if successful else self._result
+
+    def waitForResult(self, since, timeout=None, successful=True):
+        """
+        :param since: the result must come from a frame received after this time, in seconds
+        :type since: float
+        :param timeout: the maximum time to wait for the result, in seconds. If None, wait until it comes
+        :type timeout: float
+        :param successful: if True, the failed detections are ignored
+        :type successful: bool
+        :return: the result of the latest detection, or None if the timeout expired
+        :rtype: BoardPoseEstimation
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while True:
+                result = self._success if successful else self._result
+                if result is not None and result.timestamp > since:
+                    return result
+                if deadline is None:
+                    self._condition.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+
+class DualCameraPipeline(object):
+    """
+    Captures both cameras of NAO at once and detects the board in their frames on separate threads :
+        the front holes in the frames of the top camera and the Hamming codes in the frames of the bottom one.
+    The board poses found are fused into a Connect4Tracker by the owner of the tracker (see applyTo).
+    """
+
+    def __init__(self, nao_video, nao_motion, camera_matrix, camera_dist, distance=1.0, sloped=False,
+                 top_res=1, bottom_res=2):
+        """
+        :param nao_video: the video controller of NAO
+        :type nao_video: nao.controller.video.VideoController
+        :param nao_motion: the motion controller of NAO, used to get the position of the cameras
+        :type nao_motion: nao.controller.motion.MotionController
+        :param camera_matrix: The intrinsic camera matrix that can be get via camera calibration
+        :type camera_matrix: np.matrix
+        :param camera_dist: The intrinsic camera distortion coefficients that can be get via camera calibration
+        :type camera_dist: np.array
+        :param distance: the estimated distance between the robot and the board, used by the front holes detection
+        :type distance: float
+        :param sloped: True if the board is sloped from the robot
+        :type sloped: bool
+        :param top_res: the resolution parameter of the top camera (1 = 320x240, 2 = 640x480)
+        :type top_res: int
+        :param bottom_res: the resolution parameter of the bottom camera (1 = 320x240, 2 = 640x480)
+        :type bottom_res: int
+        """
+        self.nao_video = nao_video
+        self.nao_motion = nao_motion
+        self.camera_matrix = camera_matrix
+        self.camera_dist = camera_dist
+        self.distance = distance
+        self.sloped = sloped
+        self.resolutions = [top_res, bottom_res]
+        # Each worker has its own detectors
+        self._top_handler = Connect4Handler(None)
+        self._bottom_handler = Connect4Handler(None)
+        self.workers = [None, None]
+        # The timestamp of the last result fused into a tracker, for each camera
+        self._applied = [-1, -1]
+
+    def start(self):
+        """
+        Subscribe to both cameras, start their capture and the detection workers
+        """
+        for camera_num in (TOP_CAMERA, BOTTOM_CAMERA):
+            if self.workers[camera_num] is not None:
+                continue
+            self.nao_video.connectToCamera(res=self.resolutions[camera_num], fps=30, camera_num=camera_num,
+                                           subscriber_id="C4N_Pipeline" + str(camera_num))
+            self.nao_video.startCapture(camera_num=camera_num)
+        if self.workers[TOP_CAMERA] is None:
+            self.workers[TOP_CAMERA] = DetectionWorker(self.nao_video, TOP_CAMERA, self._detectFrontHoles)
+            self.workers[TOP_CAMERA].start()
+        if self.workers[BOTTOM_CAMERA] is None:
+            self.workers[BOTTOM_CAMERA] = DetectionWorker(self.nao_video, BOTTOM_CAMERA, self._detectMarkers)
+            self.workers[BOTTOM_CAMERA].start()
+
+    def stop(self):
+        for camera_num, worker in enumerate(self.workers):
+            if worker is not None:
+                worker.stop()
+                self.workers[camera_num] = None
+        self.nao_video.stopCapture()
+
+    def _resolutionWidth(self, camera_num):
+        return 640 if self.resolutions[camera_num] == 2 else 320
+
+    def _detectFrontHoles(self, frame):
+        """
+        :param frame: a frame of the top camera
+        :type frame: Frame
+        :return: (rvec, tvec, camera_position)
+        :rtype: tuple
+        """
+        camera_position = self.nao_motion.getCameraTopPositionFromTorso()
+        rvec, tvec = self._top_handler.estimateBoardPoseUsingFrontHoles(
+            frame, self.distance, self.sloped, self.camera_matrix, self.camera_dist,
+            res=self._resolutionWidth(TOP_CAMERA))
+        return rvec, tvec, camera_position
+
+    def _detectMarkers(self, frame):
+        """
+        :param frame: a frame of the bottom camera
+        :type frame: Frame
+        :return: (rvec, tvec, camera_position)
+        :rtype: tuple
+        """
+        camera_position = self.nao_motion.getCameraBottomPositionFromTorso()
+        rvec, tvec = self._bottom_handler.estimateBoardPoseUsingMarkers(
+            frame, self.camera_matrix, self.camera_dist, res=self._resolutionWidth(BOTTOM_CAMERA))
+        return rvec, tvec, camera_position
+
+    def latest(self, camera_num):
+        """
+        :param camera_num: 0 : the front holes detection (top camera), 1 : the markers detection (bottom camera)
+        :type camera_num: int
+        :return: the latest successful detection of the camera, or None if there is none
+        :rtype: BoardPoseEstimation
+        """
+        if self.workers[camera_num] is None:
+            return None
+        return self.workers[camera_num].latest()
+
+    def waitForResult(self, camera_num, since, timeout=None):
+        """
+        :param camera_num: 0 : the front holes detection (top camera), 1 : the markers detection (bottom camera)
+        :type camera_num: int
+        :param since: the result must come from a frame received after this time, in seconds
+        :type since: float
+        :param timeout: the maximum time to wait for the result, in seconds. If None, wait until it comes
+        :type timeout: float
+        :return: the first successful detection on a frame received after "since", or None if the timeout expired
+        :rtype: BoardPoseEstimation
+        """
+        if self.workers[camera_num] is None:
+            return None
+        return self.workers[camera_num].waitForResult(since, timeout)
+
+    def applyTo(self, tracker, since=-1):
+        """
+        :param tracker: the tracker that keeps the pose of the board
+        :type tracker: connect4.connect4tracker.Connect4Tracker
+        :param since: the results that come from frames received before this time are ignored
+                      (e.g. because the robot has walked since)
+        :type since: float
+        :return: the number of new results fused into the tracker
+        :rtype: int
+        Fuse the board poses found since the last call into the tracker.
+        Must be called from the thread that uses the tracker.
+        """
+        nb_of_results = 0
+        for camera_num in (TOP_CAMERA, BOTTOM_CAMERA):
+            result = self.latest(camera_num)
+            if result is not None and result.timestamp > max(since, self._applied[camera_num]):
+                tracker.updateBoardPose(result.rvec, result.tvec, result.camera_position, camera_num=camera_num)
+                self._applied[camera_num] = result.timestamp
+                nb_of_results += 1
+        return nb_of_results
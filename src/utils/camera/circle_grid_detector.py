@@ -1,8 +1,8 @@
-from Queue import Queue
+from collections import deque
 
 import cv2
 import numpy as np
-from scipy.spatial import KDTree
+from scipy.spatial import cKDTree
 
 import utils.camera.geom as geom
 
@@ -42,6 +42,9 @@ class CircleGridDetector(object):
         self._bounds = [0, 0, 0, 0]
         self._exception = CircleGridNotFoundException()
         self._relative_coordinates = None
+        self._grid_coordinates = None
+        self._lines_table = None
+        self._connections_tables = None
         self._filtered_arc_indices = None
         self._filtered_arc_vectors = None
         self._noise_circles = []
@@ -58,6 +61,9 @@ class CircleGridDetector(object):
         Private method: Clear the private parameters of the object
         """
         self._relative_coordinates = None
+        self._grid_coordinates = None
+        self._lines_table = None
+        self._connections_tables = None
         self._filtered_arc_indices = None
         self._filtered_arc_vectors = None
         self._noise_circles = []
@@ -116,7 +122,9 @@ class CircleGridDetector(object):
             if img is not None:
                 # TODO : 3D Model
                 if ref_img is not None:
-                    self.findPerspective()
+                    # The image is only warped if the perspective is asked (see getPerspective)
+                    self.mappingHomography()
+                    self.object_perspective = None
 
     def getCircleGrid(self):
         """
@@ -151,8 +159,7 @@ class CircleGridDetector(object):
         Method to call before self.connectCircles to set the object parameters properly
         """
         self._circles = circles
-        for i in range(len(circles)):
-            self._noise_circles.append(False)
+        self._noise_circles.extend([False] * len(circles))
         if bounds is None:
             tuple_max = geom.max_tuple(circles)
             tuple_min = geom.min_tuple(circles)
@@ -163,64 +170,91 @@ class CircleGridDetector(object):
     def connectCircles(self):
         """
         Private method.
-        Computes a list with connections between circle centres.
-        For every couple of centres (a, b) such that a is not b:
-               if there's no centre c such that ((dist(a,c) < dist(a,b)) and (dist(c, b) < dist(a, c)))
-               then add the vector (a,b) to the connection with the indices of the centres a and b
-        self.prepareGraph must be called before this one
+        Computes the arrays of connections between circle centres.
+        The centres are connected using a Delaunay triangulation, then the longest edge of every triangle is removed.
+        The triangulation is handled as a whole : edges are stored as (N, 4) arrays, triangles as (N, 6) arrays
+            and the edges are identified by the integer indices of their vertices in self._circles
+        self.prepareConnection must be called before this one
         """
-        keypoints = self._circles
-        circles_dict = {}
-        vectors_dict = {}
+        keypoints = np.float32(np.asarray(self._circles)[:, 0:2]) if len(self._circles) > 0 \
+            else np.zeros((0, 2), np.float32)
+        kept_indices = np.flatnonzero(np.logical_not(self._noise_circles))  # The non-noisy circles
 
         subdiv = cv2.Subdiv2D()
         subdiv.initDelaunay(self._bounds)
-        for i in range(len(keypoints)):
-            keypoint = keypoints[i]
-            if not self._noise_circles[i]:  # If the circle i is not a noisy circle
-                key = (float(keypoint[0]), float(keypoint[1]))
-                circles_dict[key] = i
-                subdiv.insert(key)
-
-        triangle_list = subdiv.getTriangleList()
-        edge_list = subdiv.getEdgeList()
+        if len(kept_indices) > 0:
+            subdiv.insert([(float(x), float(y)) for (x, y) in keypoints[kept_indices]])
+
         # An edge is the coordinates of two points. 1st coordinate = (edge[0], edge[1]), 2nd = (edge[2], edge[3])
-        for edge in edge_list:
-            pt1 = (edge[0], edge[1])
-            pt2 = (edge[2], edge[3])
-            if self.checkInBounds(pt1) and self.checkInBounds(pt2):
-                vectors_dict[(pt1, pt2)] = geom.vectorize(pt1, pt2)
-                vectors_dict[(pt2, pt1)] = geom.vectorize(pt2, pt1)
-
-        for triangle in triangle_list:
-            pt1 = (triangle[0], triangle[1])
-            pt2 = (triangle[2], triangle[3])
-            pt3 = (triangle[4], triangle[5])
-            if self.checkInBounds(pt1) and self.checkInBounds(pt2) and self.checkInBounds(pt3):
-                dist1 = geom.point_distance(pt1, pt2)
-                dist2 = geom.point_distance(pt2, pt3)
-                dist3 = geom.point_distance(pt3, pt1)
-                max_dist = max(dist1, dist2, dist3)
-                if max_dist == dist1:
-                    if (pt1, pt2) in vectors_dict and (pt2, pt1) in vectors_dict:
-                        vectors_dict.pop((pt1, pt2))
-                        vectors_dict.pop((pt2, pt1))
-                elif max_dist == dist2:
-                    if (pt2, pt3) in vectors_dict and (pt3, pt2) in vectors_dict:
-                        vectors_dict.pop((pt2, pt3))
-                        vectors_dict.pop((pt3, pt2))
-                else:
-                    if (pt1, pt3) in vectors_dict and (pt3, pt1) in vectors_dict:
-                        vectors_dict.pop((pt3, pt1))
-                        vectors_dict.pop((pt1, pt3))
-        vectors = []
-        indices = []
-        for (pt1, pt2) in vectors_dict:
-            vectors.append(vectors_dict[(pt1, pt2)])
-            indices.append((circles_dict[pt1], circles_dict[pt2]))
-        self._original_arc_vectors = vectors
+        edges = np.reshape(np.asarray(subdiv.getEdgeList(), np.float32), (-1, 4))
+        # A triangle is the coordinates of three points (pt1 = [0:2], pt2 = [2:4], pt3 = [4:6])
+        triangles = np.reshape(np.asarray(subdiv.getTriangleList(), np.float32), (-1, 6))
+        edges = edges[self._pointsInBounds(edges.reshape(-1, 2)).reshape(-1, 2).all(axis=1)]
+        triangles = triangles[self._pointsInBounds(triangles.reshape(-1, 2)).reshape(-1, 3).all(axis=1)]
+
+        # Convert the coordinates given by the triangulation into the indices of the circles
+        nb_of_circles = max(len(keypoints), 1)
+        edges = self._coordinatesToIndices(edges.reshape(-1, 2), keypoints, kept_indices).reshape(-1, 2)
+        vertices = self._coordinatesToIndices(triangles.reshape(-1, 2), keypoints, kept_indices).reshape(-1, 3)
+        # The edges and triangles with a point that is not a circle centre are discarded
+        edges = edges[(edges >= 0).all(axis=1)]
+        matched = (vertices >= 0).all(axis=1)
+        triangles, vertices = triangles[matched], vertices[matched]
+
+        # The longest edge of each triangle : edge 0 = (pt1, pt2), edge 1 = (pt2, pt3), edge 2 = (pt3, pt1)
+        corners = triangles.reshape(-1, 3, 2)
+        lengths = geom.points_distances(corners, corners[:, [1, 2, 0]])
+        longest = np.argmax(lengths, axis=1) if len(lengths) > 0 else np.zeros(0, np.intp)
+        rows = np.arange(len(vertices))
+        longest_edges = np.column_stack((vertices[rows, longest], vertices[rows, (longest + 1) % 3]))
+
+        # Each directed edge (a, b) is encoded as a * nb_of_circles + b so that set operations apply on integers
+        arcs = np.concatenate((edges, edges[:, ::-1]))
+        removed = np.concatenate((longest_edges, longest_edges[:, ::-1]))
+        arc_codes = np.setdiff1d(arcs[:, 0] * nb_of_circles + arcs[:, 1],
+                                 removed[:, 0] * nb_of_circles + removed[:, 1])
+        indices = np.column_stack((arc_codes // nb_of_circles, arc_codes % nb_of_circles)).astype(np.intp)
+        self._original_arc_vectors = keypoints[indices[:, 1]].astype(np.float64) - \
+            keypoints[indices[:, 0]].astype(np.float64)
         self._original_arc_indices = indices
 
+    def _pointsInBounds(self, points):
+        """
+        :param points: The (N, 2) array of points to check
+        :type points: np.ndarray
+        :return: A boolean mask that is True for the points included in the boundaries of the analysis
+        :rtype: np.ndarray
+        Vectorized version of self.checkInBounds
+        """
+        return (points[:, 0] >= self._bounds[0]) & (points[:, 1] >= self._bounds[1]) & \
+               (points[:, 0] <= self._bounds[2]) & (points[:, 1] <= self._bounds[3])
+
+    @staticmethod
+    def _coordinatesToIndices(points, keypoints, kept_indices):
+        """
+        :param points: The (N, 2) float32 array of coordinates given by the triangulation
+        :type points: np.ndarray
+        :param keypoints: The (M, 2) float32 array of circle centres
+        :type keypoints: np.ndarray
+        :param kept_indices: The indices of the circle centres inserted in the triangulation
+        :type kept_indices: np.ndarray
+        :return: The indices of the circle centres located at the given coordinates, -1 for the coordinates that
+                 do not match any circle centre
+        :rtype: np.ndarray
+        Match the coordinates with the circle centres using their exact float32 values.
+        If two centres are located at the same coordinates, the last one is kept.
+        """
+        if len(points) == 0 or len(kept_indices) == 0:
+            return np.full(len(points), -1, np.intp)
+        # The two float32 coordinates of a point are viewed as one int64, which makes an exact and sortable key
+        keys = np.ascontiguousarray(keypoints[kept_indices]).view(np.int64).ravel()
+        order = np.argsort(keys, kind='mergesort')
+        point_keys = np.ascontiguousarray(points).view(np.int64).ravel()
+        positions = np.searchsorted(keys[order], point_keys, side='right') - 1
+        # searchsorted gives the insertion place of the unknown coordinates, which is not a match
+        matched = (positions >= 0) & (keys[order][np.maximum(positions, 0)] == point_keys)
+        return np.where(matched, kept_indices[order[np.maximum(positions, 0)]], -1)
+
     def prepareFiltering(self, pixel_error_margin=10., min_similar_vectors=15):
         """
         :param pixel_error_margin: The error margin allowed to consider two vector as equal
@@ -237,23 +271,23 @@ class CircleGridDetector(object):
 
     def filterConnections(self):
         """
+        :return: The boolean mask of the original connections that passed through the filter
+        :rtype: np.ndarray
         For every existing connection, check that there's minimum "min_similar_vectors" other vectors with the same
         values (Same value following the threshold). If it's True, keep the connection, otherwise discard it
         """
-        filtered_arc_vectors = []
-        filtered_arc_indices = []
         if self._min_similar_vectors > len(self._original_arc_vectors):
             raise self._exception
+        mask = np.zeros(len(self._original_arc_vectors), dtype=bool)
         if len(self._original_arc_vectors) > 0:
-            space_tree = KDTree(self._original_arc_vectors)
-            for j, connection in enumerate(self._original_arc_vectors):
-                nearest_neighbours = space_tree.query(connection, self._min_similar_vectors)[1]
-                if (geom.point_distance(connection, self._original_arc_vectors[nearest_neighbours
-                                                            [(self._min_similar_vectors - 1)]])) <= self._pixel_error_margin:
-                    filtered_arc_vectors.append(connection)
-                    filtered_arc_indices.append(self._original_arc_indices[j])
-        self._filtered_arc_vectors = filtered_arc_vectors
-        self._filtered_arc_indices = filtered_arc_indices
+            space_tree = cKDTree(self._original_arc_vectors)
+            # One query for all the vectors, the last column holds the distance to the k-th nearest neighbour
+            distances = space_tree.query(self._original_arc_vectors, self._min_similar_vectors)[0]
+            distances = np.reshape(distances, (len(self._original_arc_vectors), -1))
+            mask = distances[:, -1] <= self._pixel_error_margin
+        self._filtered_arc_vectors = self._original_arc_vectors[mask]
+        self._filtered_arc_indices = self._original_arc_indices[mask]
+        return mask
 
     def doublePassFilter(self):
         """
@@ -264,14 +298,9 @@ class CircleGridDetector(object):
              4) Re-connect couple of centres, ignoring the centers removed in 3) and re-filter
         """
         self.filterConnections()
-        centers_to_remove = []
-        for i in range(len(self._circles)):
-            centers_to_remove.append(True)
-        for (center1, center2) in self._filtered_arc_indices:
-            if centers_to_remove[center1]:  # If the node was assumed as noisy, we set it as non-noisy
-                centers_to_remove[center1] = False
-            if centers_to_remove[center2]:  # If the node was assumed as noisy, we set it as non-noisy
-                centers_to_remove[center2] = False
+        # Every centre is assumed as noisy, except the ones that are linked with another centre
+        centers_to_remove = np.ones(len(self._circles), dtype=bool)
+        centers_to_remove[np.ravel(self._filtered_arc_indices)] = False
         # Second pass into the filters with a set of circles detected as noise
         self._noise_circles = centers_to_remove
         self.connectCircles()
@@ -281,39 +310,50 @@ class CircleGridDetector(object):
         """
         Private method.
         Computes vectors belonging to the cluster right and the cluster up
-        Sets self.upVectors and self.rightVectors lists of index couples that forms vectors belonging
+        Sets self.upVectors and self.rightVectors (N, 2) arrays of index couples that forms vectors belonging
                  either to the "up" or the "right" cluster.
         """
         if len(self._filtered_arc_vectors) == 0:
             raise self._exception
-        clustering = geom.cluster_vectors(self._filtered_arc_vectors)
-        clusters_centroids = clustering[2]
-        max_x = (-np.infty, None)
-        min_y = (np.infty, None)
-        for i in range(len(clusters_centroids)):
-            centroid = clusters_centroids[i]
-            if centroid[0] > max_x[0]:
-                max_x = (centroid[0], i)
-            if centroid[1] < min_y[0]:
-                min_y = (centroid[1], i)
-        x = max_x[1]
-        y = min_y[1]
-        belongs_to_cluster = clustering[1]
-        right_vectors = []
-        up_vectors = []
-        for index, cluster in enumerate(belongs_to_cluster):
-            if cluster == x:
-                right_vectors.append(self._filtered_arc_indices[index])
-            if cluster == y:
-                up_vectors.append(self._filtered_arc_indices[index])
-        self._up_vectors = up_vectors
-        self._right_vectors = right_vectors
+        clustering = geom.cluster_grid_vectors(self._filtered_arc_vectors)
+        clusters_centroids = np.reshape(clustering[2], (-1, 2))
+        if len(clusters_centroids) == 0:
+            self._right_vectors = np.zeros((0, 2), np.intp)
+            self._up_vectors = np.zeros((0, 2), np.intp)
+            return
+        x = np.argmax(clusters_centroids[:, 0])
+        y = np.argmin(clusters_centroids[:, 1])
+        belongs_to_cluster = np.ravel(clustering[1])
+        self._right_vectors = self._filtered_arc_indices[belongs_to_cluster == x]
+        self._up_vectors = self._filtered_arc_indices[belongs_to_cluster == y]
 
     def prepareBFS(self):
         if self._filtered_arc_indices is None or self._filtered_arc_vectors is None or self._circles is None:
             raise CircleGridException("filtering must be performed before prepareBFS")
         self.filterRightUpVectors()
 
+    def buildAdjacency(self):
+        """
+        :return: the CSR representation of the moves in the grid : (indptr, neighbours, col_moves, row_moves).
+                 The moves from the node i are stored between indptr[i] and indptr[i+1]
+        :rtype: tuple
+        Private method.
+        Builds the adjacency of the circle centres from the right and up vectors.
+        For each node, the moves are ordered as follows : right, up, left (reversed right), down (reversed up).
+        """
+        right = np.reshape(self._right_vectors, (-1, 2))
+        up = np.reshape(self._up_vectors, (-1, 2))
+        sources = np.concatenate((right[:, 0], up[:, 0], right[:, 1], up[:, 1])).astype(np.intp)
+        neighbours = np.concatenate((right[:, 1], up[:, 1], right[:, 0], up[:, 0])).astype(np.intp)
+        move_types = np.repeat(np.arange(4), [len(right), len(up), len(right), len(up)])
+        col_moves = np.array([1, 0, -1, 0])[move_types]
+        row_moves = np.array([0, 1, 0, -1])[move_types]
+        # Sort the moves by node, then by type of move. The sort is stable so the original order of the vectors is kept
+        order = np.lexsort((move_types, sources))
+        indptr = np.zeros(len(self._circles) + 1, np.intp)
+        indptr[1:] = np.cumsum(np.bincount(sources, minlength=len(self._circles)))
+        return indptr, neighbours[order], col_moves[order], row_moves[order]
+
     def bfsMarking(self):
         """
         Private method.
@@ -321,68 +361,36 @@ class CircleGridDetector(object):
         Explore circle centres as a graph using vectors (filtered before) marking
         with relative positions.
         Use Breadth First Search.
+        Sets self.gridCoordinates, a (N, 3) integer array in which each line is [column, row, circle index]
         """
-        frontier = Queue()  # Contains nodes and position of node
-        start_node = 0
-        while self._noise_circles[start_node]:
-            start_node += 1
-        frontier.put([start_node, (0, 0)])
-        adj_right_dict = {}
-        adj_up_dict = {}
-        mapping = {}
-        explored = []
-
-        for i in range(len(self._circles)):
-            explored.append(False)
-
-        for (x, y) in self._right_vectors:
-            if x in adj_right_dict:
-                adj_right_dict[x][0].append((x, y))
-            else:
-                adj_right_dict[x] = [[(x, y)], []]
-                adj_up_dict[x] = [[], []]
-            if y in adj_right_dict:
-                adj_right_dict[y][1].append((x, y))
-            else:
-                adj_right_dict[y] = [[], [(x, y)]]
-                adj_up_dict[y] = [[], []]
-
-        for (x, y) in self._up_vectors:
-            if x in adj_up_dict:
-                adj_up_dict[x][0].append((x, y))
-            else:
-                adj_up_dict[x] = [[(x, y)], []]
-                if x not in adj_right_dict:
-                    adj_right_dict[x] = [[], []]
-            if y in adj_up_dict:
-                adj_up_dict[y][1].append((x, y))
-            else:
-                adj_up_dict[y] = [[], [(x, y)]]
-                if y not in adj_right_dict:
-                    adj_right_dict[y] = [[], []]
-        if start_node not in adj_right_dict:
-            self._relative_coordinates = {(0, 0): start_node}
+        start_node = np.flatnonzero(np.logical_not(self._noise_circles))[0]
+        indptr, neighbours, col_moves, row_moves = self.buildAdjacency()
+        if indptr[start_node] == indptr[start_node + 1]:
+            self._grid_coordinates = np.array([[0, 0, start_node]], np.intp)
+            self._updateRelativeCoordinates()
             return
-
-        while not frontier.empty():
-            [current_node, (right_cost, up_cost)] = frontier.get()
+        # Python lists are faster than numpy arrays for element-wise access
+        indptr = indptr.tolist()
+        neighbours = neighbours.tolist()
+        col_moves = col_moves.tolist()
+        row_moves = row_moves.tolist()
+
+        frontier = deque([(start_node, 0, 0)])  # Contains nodes and position of node
+        explored = np.zeros(len(self._circles), dtype=bool)
+        marked = []
+        while frontier:
+            (current_node, right_cost, up_cost) = frontier.popleft()
             if not explored[current_node]:
                 explored[current_node] = True
-                mapping[(right_cost, up_cost)] = current_node
-
-                right_vectors = adj_right_dict[current_node][0]
-                up_vectors = adj_up_dict[current_node][0]
-                neg_right_vectors = adj_right_dict[current_node][1]
-                neg_up_vectors = adj_up_dict[current_node][1]
-                for vector in right_vectors:
-                    frontier.put([vector[1], (right_cost + 1, up_cost)])
-                for vector in up_vectors:
-                    frontier.put([vector[1], (right_cost, up_cost + 1)])
-                for vector in neg_right_vectors:
-                    frontier.put([vector[0], (right_cost - 1, up_cost)])
-                for vector in neg_up_vectors:
-                    frontier.put([vector[0], (right_cost, up_cost - 1)])
-        self._relative_coordinates = mapping
+                marked.append((right_cost, up_cost, current_node))
+                for i in xrange(indptr[current_node], indptr[current_node + 1]):
+                    frontier.append((neighbours[i], right_cost + col_moves[i], up_cost + row_moves[i]))
+        marked = np.array(marked, np.intp)[::-1]
+        # If two nodes were marked with the same relative position, the last one marked is kept.
+        # The relative positions are bounded by the number of nodes, hence they can be encoded as one integer
+        nb_of_nodes = len(marked)
+        positions = (marked[:, 0] + nb_of_nodes) * (2 * nb_of_nodes + 1) + (marked[:, 1] + nb_of_nodes)
+        self._grid_coordinates = marked[np.unique(positions, return_index=True)[1]]
         self.normalizeRelativeCoordinates()
 
     def normalizeRelativeCoordinates(self, x_shift=None, y_shift=None):
@@ -395,31 +403,53 @@ class CircleGridDetector(object):
         If x_shift is None, The lowest x value will be 0 and other x values are adapted in consequence.
         If y_shift is None, The lowest y value will be 0 and other y values are adapted in consequence.
         """
-        if x_shift is None and y_shift is None:
-            (x_shift, y_shift) = geom.min_tuple(self._relative_coordinates.keys())
-        elif x_shift is None:
-            (x_shift, _) = geom.min_tuple(self._relative_coordinates.keys())
-        elif y_shift is None:
-            (_, y_shift) = geom.min_tuple(self._relative_coordinates.keys())
-        new_mapping = {}
-        if x_shift != 0 and y_shift != 0:
-            keys = self._relative_coordinates.keys()
-            for key in keys:
-                value = self._relative_coordinates.pop(key)
-                new_mapping[(key[0] - x_shift, key[1] - y_shift)] = value
-        elif x_shift != 0:
-            keys = self._relative_coordinates.keys()
-            for key in keys:
-                value = self._relative_coordinates.pop(key)
-                new_mapping[(key[0] - x_shift, key[1])] = value
-        elif y_shift != 0:
-            keys = self._relative_coordinates.keys()
-            for key in keys:
-                value = self._relative_coordinates.pop(key)
-                new_mapping[(key[0], key[1] - y_shift)] = value
-        else:
-            new_mapping = self._relative_coordinates
-        self._relative_coordinates = new_mapping
+        if x_shift is None:
+            x_shift = self._grid_coordinates[:, 0].min()
+        if y_shift is None:
+            y_shift = self._grid_coordinates[:, 1].min()
+        self._grid_coordinates[:, 0] -= x_shift
+        self._grid_coordinates[:, 1] -= y_shift
+        self._updateRelativeCoordinates()
+
+    def _updateRelativeCoordinates(self):
+        """
+        Private method.
+        Sets self.relativeCoordinates, the dict view of self.gridCoordinates : {(column, row): circle index, ...}
+        """
+        self._relative_coordinates = {(col, row): index for (col, row, index) in self._grid_coordinates.tolist()}
+        # The scoring tables are computed from the previous coordinates
+        self._lines_table = None
+        self._connections_tables = None
+
+    def prepareRectangleScoring(self):
+        """
+        Private method.
+        Precomputes the tables used to score the rectangles of the grid in constant time :
+            self.linesTable : the cumulated number of circles along each line of the grid
+            self.connectionsTables : for each extent (dx, dy) of the vectors in the grid, the summed area table
+                                     of the number of vectors whose lowest corner lies in each cell of the grid
+        """
+        (cols, rows, nodes) = self._grid_coordinates.T
+        occupancy = np.zeros((rows.max() + 1, cols.max() + 1), dtype=np.intp)
+        np.add.at(occupancy, (rows, cols), 1)
+        self._lines_table = np.zeros((occupancy.shape[0], occupancy.shape[1] + 1), dtype=np.intp)
+        self._lines_table[:, 1:] = np.cumsum(occupancy, axis=1)
+
+        # The grid position of every circle, (-1, -1) if the circle is not in the grid
+        positions = np.full((len(self._circles), 2), -1, dtype=np.intp)
+        positions[nodes] = self._grid_coordinates[:, 0:2]
+        arcs = np.concatenate((np.reshape(self._right_vectors, (-1, 2)), np.reshape(self._up_vectors, (-1, 2))))
+        ends = positions[arcs]
+        ends = ends[(ends >= 0).all(axis=(1, 2))]
+        # A vector is inside a rectangle if and only if the box bounding its two ends is inside the rectangle
+        lowest_corners = ends.min(axis=1)
+        extents = ends.max(axis=1) - lowest_corners
+        self._connections_tables = []
+        for (dx, dy) in set(map(tuple, extents.tolist())):
+            same_extent = (extents[:, 0] == dx) & (extents[:, 1] == dy)
+            counts = np.zeros(occupancy.shape, dtype=np.intp)
+            np.add.at(counts, (lowest_corners[same_extent, 1], lowest_corners[same_extent, 0]), 1)
+            self._connections_tables.append((dx, dy, geom.summed_area_table(counts)))
 
     def countRectangleConnections(self, rectangle):
         """
@@ -428,27 +458,29 @@ class CircleGridDetector(object):
         :type rectangle: list
         Count the keypoints connections inside a rectangle in the grid.
         """
-        lines_counter = {}  # Will assure that the top and the bottom lines have at least MIN_CIRCLES_PER_LINE circles
+        if self._lines_table is None or self._connections_tables is None:
+            self.prepareRectangleScoring()
         [[(min_x, max_y), (max_x, _)], [(_, min_y), (_, _)]] = rectangle
-        circles = []
-        for (x, y) in self._relative_coordinates.keys():
-            if min_x <= x <= max_x and min_y <= y <= max_y:
-                circles.append(self._relative_coordinates[(x, y)])
-                lines_counter[y] = lines_counter.get(x, 0) + 1
-        if len(lines_counter.keys()) > 0 and lines_counter[max(lines_counter.keys())] < self._MIN_CIRCLES_PER_LINE \
-                or lines_counter[min(lines_counter.keys())] < self._MIN_CIRCLES_PER_LINE:
+        # The top and the bottom lines must have at least MIN_CIRCLES_PER_LINE circles
+        lines_counter = self._lines_table[min_y:max_y + 1, max_x + 1] - self._lines_table[min_y:max_y + 1, min_x]
+        occupied_lines = np.flatnonzero(lines_counter)
+        if len(occupied_lines) == 0 \
+                or lines_counter[occupied_lines[-1]] < self._MIN_CIRCLES_PER_LINE \
+                or lines_counter[occupied_lines[0]] < self._MIN_CIRCLES_PER_LINE:
             return -1
 
-        nb_connection = filter(lambda (x0, y0): x0 in circles and y0 in circles, self._right_vectors)
-        nb_connection += filter(lambda (x1, y1): x1 in circles and y1 in circles, self._up_vectors)
-        return len(nb_connection)
+        nb_connection = 0
+        for (dx, dy, table) in self._connections_tables:
+            if max_x - dx >= min_x and max_y - dy >= min_y:
+                nb_connection += geom.rectangle_sum(table, min_x, min_y, max_x - dx, max_y - dy)
+        return nb_connection
 
     def prepareGrid(self, grid_shape):
         """
         :param grid_shape: the shape of the grid to detect
         :type grid_shape: tuple
         """
-        if self._relative_coordinates is None or self._right_vectors is None or self._up_vectors is None:
+        if self._grid_coordinates is None or self._right_vectors is None or self._up_vectors is None:
             raise CircleGridException("prepareBFS and bfsMarking must be called before prepareForGrid")
         self._grid_shape = grid_shape
 
@@ -460,7 +492,7 @@ class CircleGridDetector(object):
         It will also decide, in the case of multiple possible grids, which grid is the good one by counting the
           number of vectors detected earlier inside the grid (the bigger amount of vectors, the better the grid)
         """
-        (max_x, max_y) = geom.max_tuple(self._relative_coordinates.keys())
+        (max_x, max_y) = self._grid_coordinates[:, 0:2].max(axis=0)
         if max_x + 1 < self._grid_shape[1] or max_y + 1 < self._grid_shape[0]:
             raise self._exception
         elif max_x + 1 != self._grid_shape[1] or max_y + 1 != self._grid_shape[0]:
@@ -470,8 +502,8 @@ class CircleGridDetector(object):
             max_connection = -np.infty
             max_rectangle = None
             unsure = False
+            self.prepareRectangleScoring()
             for rectangle in rectangles:
-                [[(_, _), (max_x, _)], [(_, min_y), (_, _)]] = rectangle
                 # Count the number of connection inside the rectangle
                 nb_connection = self.countRectangleConnections(rectangle)
                 if nb_connection == max_connection:
@@ -485,10 +517,11 @@ class CircleGridDetector(object):
             if unsure or max_rectangle is None:
                 raise self._exception
             [[(min_x, max_y), (max_x, _)], [(_, min_y), (_, _)]] = max_rectangle
-            # Returns the rectangle that has the more connection inside (filters the dict with the values of the rect)
-            new_mapping = {(x, y): v for (x, y), v in self._relative_coordinates.iteritems()
-                           if min_x <= x <= max_x and min_y <= y <= max_y}
-            self._relative_coordinates = new_mapping
+            # Keeps the rectangle that has the more connection inside
+            cols = self._grid_coordinates[:, 0]
+            rows = self._grid_coordinates[:, 1]
+            self._grid_coordinates = self._grid_coordinates[(min_x <= cols) & (cols <= max_x) &
+                                                            (min_y <= rows) & (rows <= max_y)]
             self.normalizeRelativeCoordinates()
 
     def mappingHomography(self):
@@ -516,15 +549,23 @@ class CircleGridDetector(object):
         Sets self.objectPerspective to the scene image, reshaped and transformed so that
         only the object in the scene is visible, formatted as object_img
         """
-        rows, cols, _ = self.reference_img.shape
         self.mappingHomography()
-        self.object_perspective = cv2.warpPerspective(self._img, self.homography, (cols, rows),
-                                                      flags=cv2.WARP_INVERSE_MAP)
+        self._warpPerspective()
         # for i in self.reference_mapping.values():
         #     cv2.circle(self.object_perspective, (i[0], i[1]), 2, (0, 0, 255), 2)
 
+    def _warpPerspective(self):
+        """
+        Warp the scene image with the current homography (see findPerspective)
+        """
+        rows, cols, _ = self.reference_img.shape
+        self.object_perspective = cv2.warpPerspective(self._img, self.homography, (cols, rows),
+                                                      flags=cv2.WARP_INVERSE_MAP)
+
     def getPerspective(self):
         """
         Get an image cropped and transformed of a specific object in a scene image
         """
+        if self.object_perspective is None and self._img is not None and self.reference_img is not None:
+            self._warpPerspective()
         return self.object_perspective
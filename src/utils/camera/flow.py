@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+
+__author__ = 'Anthony Rouneau'
+
+
+class PointFlowTracker(object):
+    """
+    Follows image points from a frame to the next using the pyramidal Lucas-Kanade optical flow.
+    A point is lost if it can not be followed back to where it was in the previous frame (forward-backward check).
+    """
+
+    def __init__(self, win_size=(21, 21), max_level=3, max_error=1.0):
+        """
+        :param win_size: the size of the search window at each level of the pyramid
+        :type win_size: tuple
+        :param max_level: the number of levels of the pyramid, 0 to use the original image only
+        :type max_level: int
+        :param max_error: the maximum distance in pixels between a point and the point followed back from the next
+                          frame, above which the point is lost
+        :type max_error: float
+        """
+        self.win_size = win_size
+        self.max_level = max_level
+        self.max_error = max_error
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        # The points followed in the last frame, and the index of each one in the points given to start
+        self.points = None
+        self.ids = None
+        self._gray = None
+
+    def start(self, gray, points):
+        """
+        :param gray: the grayscale image in which the points were found
+        :type gray: np.ndarray
+        :param points: the (N, 2) points to follow
+        :type points: np.ndarray
+        """
+        self._gray = gray
+        self.points = np.float32(points).reshape(-1, 1, 2)
+        self.ids = np.arange(len(self.points))
+
+    def stop(self):
+        self.points = None
+        self.ids = None
+        self._gray = None
+
+    def isTracking(self):
+        """
+        :return: True if there are points to follow
+        :rtype: bool
+        """
+        return self.points is not None and len(self.points) > 0
+
+    def track(self, gray):
+        """
+        :param gray: the next grayscale image
+        :type gray: np.ndarray
+        :return: (ids, points) : the index of each point still followed in the points given to start
+                 and its (N, 2) position in the image
+        :rtype: tuple
+        """
+        if not self.isTracking():
+            return np.zeros(0, dtype=int), np.zeros((0, 2), dtype=np.float32)
+        params = dict(winSize=self.win_size, maxLevel=self.max_level, criteria=self.criteria)
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, self.points, None, **params)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._gray, points, None, **params)
+        errors = np.linalg.norm((back_points - self.points).reshape(-1, 2), axis=1)
+        kept = (status.ravel() == 1) & (back_status.ravel() == 1) & (errors < self.max_error)
+        self._gray = gray
+        self.points = points[kept]
+        self.ids = self.ids[kept]
+        return self.ids, self.points.reshape(-1, 2)
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import cv2
+
+__author__ = 'Anthony Rouneau'
+
+# The NAOqi color spaces handled by the frames
+GRAY_COLOR_SPACE = 0  # kYuvColorSpace : only the luminance
+RGB_COLOR_SPACE = 11
+BGR_COLOR_SPACE = 13
+
+
+class Frame(object):
+    """
+    An image taken by a camera, with the views derived from it (grayscale, blurred grayscale, HSV).
+    Each view is computed once, the first time it is asked, and then shared by every consumer of the frame :
+        the views must not be modified.
+    """
+
+    def __init__(self, img, color_space=BGR_COLOR_SPACE, timestamp=None):
+        """
+        :param img: the (height, width, layers) image, that is not copied
+        :type img: np.ndarray
+        :param color_space: the NAOqi color space of the image (see GRAY_COLOR_SPACE, RGB_COLOR_SPACE...)
+        :type color_space: int
+        :param timestamp: the time at which the image was taken, in seconds. If None, the current time is used
+        :type timestamp: float
+        """
+        if color_space not in (GRAY_COLOR_SPACE, RGB_COLOR_SPACE, BGR_COLOR_SPACE):
+            raise ValueError("Unsupported color space : " + str(color_space))
+        if timestamp is None:
+            timestamp = time.time()
+        if img.ndim == 3 and img.shape[2] == 1:
+            img = img[:, :, 0]
+        self.img = img
+        self.color_space = color_space
+        self.timestamp = timestamp
+        self._views = {}
+        # The frame can be shared by detectors running in different threads
+        self._lock = threading.RLock()
+
+    @property
+    def shape(self):
+        return self.img.shape
+
+    def _getView(self, name, compute):
+        """
+        :param name: the name of the view
+        :type name: str
+        :param compute: the function that computes the view
+        :type compute: function
+        :return: the view, computed on the first call
+        :rtype: np.ndarray
+        """
+        with self._lock:
+            view = self._views.get(name)
+            if view is None:
+                view = compute()
+                self._views[name] = view
+            return view
+
+    def getBGR(self):
+        """
+        :return: the image in the BGR color space, used by OpenCV
+        :rtype: np.ndarray
+        """
+        if self.color_space == BGR_COLOR_SPACE:
+            return self.img
+        elif self.color_space == RGB_COLOR_SPACE:
+            return self._getView("bgr", lambda: cv2.cvtColor(self.img, cv2.COLOR_RGB2BGR))
+        return self._getView("bgr", lambda: cv2.cvtColor(self.img, cv2.COLOR_GRAY2BGR))
+
+    def getGray(self):
+        """
+        :return: the grayscale image
+        :rtype: np.ndarray
+        """
+        if self.color_space == GRAY_COLOR_SPACE:
+            return self.img
+        elif self.color_space == RGB_COLOR_SPACE:
+            return self._getView("gray", lambda: cv2.cvtColor(self.img, cv2.COLOR_RGB2GRAY))
+        return self._getView("gray", lambda: cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY))
+
+    def getBlurredGray(self):
+        """
+        :return: the grayscale image, blurred by a 3x3 gaussian filter, then by a 3x3 median filter.
+                 This is the image in which the front holes are searched.
+        :rtype: np.ndarray
+        """
+        return self._getView("blurred_gray",
+                             lambda: cv2.medianBlur(cv2.GaussianBlur(self.getGray(), (3, 3), 0), 3))
+
+    def getHSV(self):
+        """
+        :return: the image in the HSV color space of OpenCV
+        :rtype: np.ndarray
+        """
+        return self._getView("hsv", lambda: cv2.cvtColor(self.getBGR(), cv2.COLOR_BGR2HSV))
+
+
+def as_frame(img):
+    """
+    :param img: a frame, or the BGR image of a frame
+    :type img: Frame or np.ndarray
+    :return: the frame of the image, or None if img is None
+    :rtype: Frame
+    """
+    if img is None or isinstance(img, Frame):
+        return img
+    return Frame(img)
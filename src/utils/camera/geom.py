@@ -115,35 +115,198 @@ def normalize(vector):
     return vector[0] / norm, vector[1] / norm
 
 
+def vectorize_points(points1, points2, signed=True):
+    """
+    :param points1: the (N, D) array of the starting points (one point of D coordinates is broadcast)
+    :type points1: np.ndarray
+    :param points2: the (N, D) array of the ending points (one point of D coordinates is broadcast)
+    :type points2: np.ndarray
+    :param signed: false will make the vectors positive in each coordinate
+    :type signed: bool
+    :return: The (N, D) array of the vectors made by points1 and points2
+    :rtype: np.ndarray
+    Array version of vectorize
+    """
+    vectors = np.asarray(points2, dtype=np.float64) - np.asarray(points1, dtype=np.float64)
+    if not signed:
+        return np.abs(vectors)
+    return vectors
+
+
+def vectors_norms(vectors):
+    """
+    :param vectors: the (N, D) array of vectors
+    :type vectors: np.ndarray
+    :return: The (N,) array of the norms of the vectors
+    :rtype: np.ndarray
+    """
+    return np.sqrt(np.sum(np.square(np.asarray(vectors, dtype=np.float64)), axis=-1))
+
+
+def points_distances(points1, points2):
+    """
+    :param points1: the (N, D) array of the first points (one point of D coordinates is broadcast)
+    :type points1: np.ndarray
+    :param points2: the (N, D) array of the second points (one point of D coordinates is broadcast)
+    :type points2: np.ndarray
+    :return: The (N,) array of the distances between points1 and points2
+    :rtype: np.ndarray
+    Array version of point_distance
+    """
+    return vectors_norms(vectorize_points(points1, points2))
+
+
+def normalize_vectors(vectors):
+    """
+    :param vectors: the (N, D) array of vectors to normalize
+    :type vectors: np.ndarray
+    :return: The (N, D) array of the normalized vectors
+    :rtype: np.ndarray
+    Array version of normalize
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return vectors / vectors_norms(vectors)[..., np.newaxis]
+
+
+def similar_vectors_mask(vectors1, vectors2, max_distances):
+    """
+    :param vectors1: the (N, D) array of the first vectors
+    :type vectors1: np.ndarray
+    :param vectors2: the (N, D) array of the second vectors
+    :type vectors2: np.ndarray
+    :param max_distances: the maximum distance (or the (N,) array of maximum distances) to allow between
+                          two vectors to consider them as similar
+    :type max_distances: float
+    :return: The (N,) boolean array that is true where the two vectors are similar
+    :rtype: np.ndarray
+    Array version of are_vectors_similar (the orientation of the vectors does not change their distance)
+    """
+    return points_distances(vectors1, vectors2) < max_distances
+
+
+def parallel_vectors_mask(vectors1, vectors2, max_difference):
+    """
+    :param vectors1: the (N, D) array of the first vectors
+    :type vectors1: np.ndarray
+    :param vectors2: the (N, D) array of the second vectors
+    :type vectors2: np.ndarray
+    :param max_difference: the maximum allowed error to consider two vectors as parallels
+    :type max_difference: double
+    :return: The (N,) boolean array that is true where the two vectors can be considered as parallel
+    :rtype: np.ndarray
+    Array version of are_vectors_parallel. A null vector is never parallel to another one.
+    """
+    vectors1 = np.asarray(vectors1, dtype=np.float64)
+    vectors2 = np.asarray(vectors2, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosines = np.sum(vectors1 * vectors2, axis=-1) / (vectors_norms(vectors1) * vectors_norms(vectors2))
+        return np.abs(np.abs(cosines) - 1) < max_difference
+
+
 def transform_vector(vector, rmat, tvec):
     """
     :param vector: The coordinates to transform
     :type vector: np.array
     :param rmat: The rotation matrix
-    :type rmat: np.matrix
+    :type rmat: np.ndarray
     :param tvec: The translation vector
     :type tvec: np.array
     :return: The transformed coordinates
     :rtype: np.array
     Apply a rotation and a translation to a vector of coordinates
     """
+    rmat = np.asarray(rmat)
     # Assure that we can make the rotation using the matrix
     assert (rmat.shape[1] == len(vector))
     # Assure that we can translate the coordinates using tvec
     assert (tvec.size == len(vector))
-    # Rotate the coordinates
-    temp = np.dot(rmat, vector.reshape((3, 1))).reshape(1, 3)[0]
-    # Translate the coordinates
-    temp = temp + tvec.reshape(1, 3)[0]
-    return temp
-
-
-def cluster_vectors(vectors, nb_clusters=4):
+    # Rotate, then translate the coordinates
+    return np.dot(rmat, np.ravel(vector)) + np.ravel(tvec)
+
+
+def transform_matrix(rmat, tvec, out=None):
+    """
+    :param rmat: The 3x3 rotation matrix
+    :type rmat: np.ndarray
+    :param tvec: The translation vector (3 values)
+    :type tvec: np.ndarray
+    :param out: The 4x4 array in which the result is written. If None, a new array is allocated
+    :type out: np.ndarray
+    :return: The 4x4 homogeneous matrix that applies the rotation, then the translation
+    :rtype: np.ndarray
+    """
+    if out is None:
+        out = np.empty((4, 4))
+    out[0:3, 0:3] = rmat
+    out[0:3, 3] = np.ravel(tvec)
+    out[3, 0:3] = 0
+    out[3, 3] = 1
+    return out
+
+
+def compose_transforms(transform1, transform2, out=None):
+    """
+    :param transform1: The 4x4 homogeneous matrix of the transformation applied last
+    :type transform1: np.ndarray
+    :param transform2: The 4x4 homogeneous matrix of the transformation applied first
+    :type transform2: np.ndarray
+    :param out: The 4x4 float64 array in which the result is written, it must not be one of the inputs.
+                If None, a new array is allocated
+    :type out: np.ndarray
+    :return: The 4x4 homogeneous matrix that applies transform2, then transform1
+    :rtype: np.ndarray
+    """
+    return np.dot(transform1, transform2, out=out)
+
+
+def invert_transform(transform, out=None):
+    """
+    :param transform: The 4x4 homogeneous matrix of a rigid transformation (rotation and translation)
+    :type transform: np.ndarray
+    :param out: The 4x4 array in which the result is written, it must not be the input.
+                If None, a new array is allocated
+    :type out: np.ndarray
+    :return: The 4x4 homogeneous matrix of the inverse transformation
+    :rtype: np.ndarray
+    As the rotation is orthogonal, its inverse is its transpose
+    """
+    if out is None:
+        out = np.empty((4, 4))
+    out[0:3, 0:3] = transform[0:3, 0:3].T
+    out[0:3, 3] = -np.dot(out[0:3, 0:3], transform[0:3, 3])
+    out[3, 0:3] = 0
+    out[3, 3] = 1
+    return out
+
+
+def apply_transform(transform, points, out=None):
+    """
+    :param transform: The 4x4 homogeneous matrix of the transformation
+    :type transform: np.ndarray
+    :param points: The (N, 3) array of the points to transform
+    :type points: np.ndarray
+    :param out: The (N, 3) float64 array (a view is accepted) in which the result is written, it must not be
+                the input. If None, a new array is allocated
+    :type out: np.ndarray
+    :return: The (N, 3) array of the transformed points
+    :rtype: np.ndarray
+    """
+    if out is None:
+        out = np.empty((len(points), 3))
+    np.einsum('ij,kj->ki', transform[0:3, 0:3], points, out=out)
+    out += transform[0:3, 3]
+    return out
+
+
+def cluster_vectors(vectors, nb_clusters=4, max_tries=10):
     """
     :param vectors: A list containing vectors
     :type vectors: list
     :param nb_clusters: The number of clusters returned
     :type nb_clusters: int
+    :param max_tries: The maximum number of times the k-means clustering is run
+    :type max_tries: int
     :return: A list with clusters and mean of clusters
     :rtype: list
     Cluster vectors into "nb_clusters" clusters.
@@ -151,13 +314,84 @@ def cluster_vectors(vectors, nb_clusters=4):
     result = [[], [], []]
     if len(vectors) > 3:
         data = np.array(vectors, dtype=np.float32)
-        while len(result[2]) != nb_clusters:
+        tries = 0
+        while len(result[2]) != nb_clusters and tries < max_tries:
             result = cv2.kmeans(data, nb_clusters, None,
                                 (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
                                  10, 1.0), 10, cv2.KMEANS_PP_CENTERS)
+            tries += 1
     return result
 
 
+def cluster_grid_vectors(vectors, nb_bins=36, min_angle=np.pi / 6, nb_refinements=2):
+    """
+    :param vectors: The (N, 2) vectors that connect the neighbours of a grid
+    :type vectors: np.ndarray
+    :param nb_bins: The number of bins of the orientation histogram, over [0, pi[
+    :type nb_bins: int
+    :param min_angle: The minimum angle, in radians, between the two directions of the grid
+    :type min_angle: float
+    :param nb_refinements: The number of median refinements of the two directions
+    :type nb_refinements: int
+    :return: A list with the compactness, the (N, 1) cluster labels and the (4, 2) cluster centres,
+             in the same format as cluster_vectors
+    :rtype: list
+    Cluster the vectors of a grid into the 4 directions of the grid (2 orientations, 2 ways)
+    using an histogram of the orientations of the vectors, their sign being ignored.
+    The cost is bounded by O(N * nb_refinements + nb_bins).
+    If the two directions can't be found, falls back on the k-means clustering (see cluster_vectors)
+    """
+    data = np.reshape(np.asarray(vectors, dtype=np.float64), (-1, 2))
+    if len(data) <= 3:
+        return cluster_vectors(data)
+    # Opposite vectors have the same orientation in [0, pi[
+    orientations = np.mod(np.arctan2(data[:, 1], data[:, 0]), np.pi)
+    histogram = np.bincount(np.minimum((orientations * nb_bins / np.pi).astype(np.intp), nb_bins - 1),
+                            minlength=nb_bins)
+    # Circular smoothing of the histogram, so that a peak split between two bins is not missed
+    histogram = 2 * histogram + np.roll(histogram, 1) + np.roll(histogram, -1)
+    bin_centres = (np.arange(nb_bins) + 0.5) * np.pi / nb_bins
+    first_peak = bin_centres[np.argmax(histogram)]
+    far_enough = np.abs(_orientation_difference(bin_centres, first_peak)) >= min_angle
+    if not (histogram * far_enough).any():
+        return cluster_vectors(data)
+    peaks = np.array([first_peak, bin_centres[np.argmax(histogram * far_enough)]])
+
+    for _ in range(nb_refinements + 1):
+        # Each vector belongs to the closest orientation
+        axes = np.argmin(np.abs(_orientation_difference(orientations[:, np.newaxis], peaks[np.newaxis, :])), axis=1)
+        for axis in range(2):
+            if not (axes == axis).any():
+                return cluster_vectors(data)
+            deviations = _orientation_difference(orientations[axes == axis], peaks[axis])
+            peaks[axis] = np.mod(peaks[axis] + np.median(deviations), np.pi)
+
+    # Each orientation is split into two ways
+    directions = np.column_stack((np.cos(peaks), np.sin(peaks)))
+    backward = np.einsum('ij,ij->i', data, directions[axes]) < 0
+    labels = (2 * axes + backward).astype(np.int32)
+    centres = np.zeros((4, 2), dtype=np.float32)
+    for label in range(4):
+        if not (labels == label).any():
+            return cluster_vectors(data)
+        centres[label] = np.median(data[labels == label], axis=0)
+    compactness = np.square(data - centres[labels]).sum()
+    return [compactness, labels.reshape(-1, 1), centres]
+
+
+def _orientation_difference(orientations1, orientations2):
+    """
+    :param orientations1: The first orientations, in radians
+    :type orientations1: np.ndarray
+    :param orientations2: The second orientations, in radians
+    :type orientations2: np.ndarray
+    :return: The signed differences between the orientations, in [-pi/2, pi/2[
+    :rtype: np.ndarray
+    Computes the difference between two orientations, knowing that an orientation is defined modulo pi
+    """
+    return np.mod(orientations1 - orientations2 + np.pi / 2, np.pi) - np.pi / 2
+
+
 def max_tuple(list_tuple):
     """
     :param list_tuple: A list of tuple to explore. [..., (x_i, y_i), ...]
@@ -166,15 +400,9 @@ def max_tuple(list_tuple):
     :rtype: tuple
     Get the two max values of a list of tuple
     """
-    x_max = -np.infty
-    y_max = -np.infty
-    for atuple in list_tuple:
-        a = atuple[0]
-        b = atuple[1]
-        if a > x_max:
-            x_max = a
-        if b > y_max:
-            y_max = b
+    if len(list_tuple) == 0:
+        return -np.infty, -np.infty
+    x_max, y_max = np.max(np.asarray(list_tuple)[:, 0:2], axis=0)
     return x_max, y_max
 
 
@@ -186,15 +414,9 @@ def min_tuple(list_tuple):
     :rtype: tuple
     Get the two min values of a list of tuple
     """
-    x_min = np.infty
-    y_min = np.infty
-    for atuple in list_tuple:
-        a = atuple[0]
-        b = atuple[1]
-        if a < x_min:
-            x_min = a
-        if b < y_min:
-            y_min = b
+    if len(list_tuple) == 0:
+        return np.infty, np.infty
+    x_min, y_min = np.min(np.asarray(list_tuple)[:, 0:2], axis=0)
     return x_min, y_min
 
 
@@ -240,6 +462,38 @@ def get_inner_rectangles(rectangle, y_max_length, x_max_length):
     return rectangles
 
 
+def summed_area_table(array):
+    """
+    :param array: The 2D array to integrate
+    :type array: np.ndarray
+    :return: The summed area table of the array, padded with a leading row and column of zeros
+    :rtype: np.ndarray
+    Computes the integral image of a 2D array : table[y, x] is the sum of array[:y, :x]
+    """
+    table = np.zeros((array.shape[0] + 1, array.shape[1] + 1), dtype=np.intp)
+    table[1:, 1:] = np.cumsum(np.cumsum(array, axis=0), axis=1)
+    return table
+
+
+def rectangle_sum(table, min_x, min_y, max_x, max_y):
+    """
+    :param table: The summed area table, as computed by summed_area_table
+    :type table: np.ndarray
+    :param min_x: The lowest column of the rectangle (included)
+    :type min_x: int
+    :param min_y: The lowest row of the rectangle (included)
+    :type min_y: int
+    :param max_x: The highest column of the rectangle (included)
+    :type max_x: int
+    :param max_y: The highest row of the rectangle (included)
+    :type max_y: int
+    :return: The sum of the values of the integrated array inside the rectangle
+    :rtype: int
+    Sum the values inside a rectangle in constant time, using a summed area table
+    """
+    return table[max_y + 1, max_x + 1] - table[min_y, max_x + 1] - table[max_y + 1, min_x] + table[min_y, min_x]
+
+
 def index_mapping_into_pixel_mapping(index_mapping, keypoints_list):
     """
     :param index_mapping: The index mapping to transform.
@@ -257,12 +511,15 @@ def index_mapping_into_pixel_mapping(index_mapping, keypoints_list):
     return mapping_pixels
 
 
-def convert_euler_to_matrix(rvec):
+def convert_euler_to_matrix(rvec, out=None):
     """
     :param rvec: The vector of roation in Euler angle in the form : [roll, pitch, yaw]
     :type rvec: tuple
+    :param out: The 3x3 array (a view is accepted) in which the result is written.
+                If None, a new array is allocated
+    :type out: np.ndarray
     :return: The rotation matrix that corresponds to the input rotation vector
-    :rtype: np.matrix
+    :rtype: np.ndarray
     Convert euler angles ZYX into a 3D rotation matrix
     """
     [roll, pitch, yaw] = rvec
@@ -282,9 +539,12 @@ def convert_euler_to_matrix(rvec):
     m20 = -s2
     m21 = c2 * s3
     m22 = c2 * c3
-    return np.matrix([[m00, m01, m02],
-                      [m10, m11, m12],
-                      [m20, m21, m22]])
+    if out is None:
+        out = np.empty((3, 3))
+    out[0, 0], out[0, 1], out[0, 2] = m00, m01, m02
+    out[1, 0], out[1, 1], out[1, 2] = m10, m11, m12
+    out[2, 0], out[2, 1], out[2, 2] = m20, m21, m22
+    return out
 
 
 # def common_area(rect1, rect2):
@@ -357,6 +617,24 @@ def get_box_info(box):
         return ((vector2, norm2), (vector1, norm1))
 
 
+def get_boxes_info(boxes):
+    """
+    :param boxes: the (N, 4, 2) array of boxes, consisting of 4 points each
+    :type boxes: np.ndarray
+    :return: (long_side_vectors, long_side_norms, short_side_norms) : a (N, 2) array and two (N,) arrays
+    :rtype: tuple
+    Array version of get_box_info
+    """
+    boxes = np.reshape(np.asarray(boxes, dtype=np.float64), (-1, 4, 2))
+    vectors1 = vectorize_points(boxes[:, 0], boxes[:, 2])
+    vectors2 = vectorize_points(boxes[:, 0], boxes[:, 1])
+    norms1 = vectors_norms(vectors1)
+    norms2 = vectors_norms(vectors2)
+    first_is_longer = norms1 > norms2
+    long_vectors = np.where(first_is_longer[:, np.newaxis], vectors1, vectors2)
+    return long_vectors, np.where(first_is_longer, norms1, norms2), np.where(first_is_longer, norms2, norms1)
+
+
 def are_ratio_similar(ratio1, ratio2, max_difference):
     """
     :param ratio1: the first ratio
@@ -391,13 +669,14 @@ def sort_rectangle_corners(rectangle):
     :return: the sorted corners of the rectangle ( [NW, NE, SW, SE] )
     :rtype: list
     """
-    ordered_corners = []
-    rect = rectangle.reshape(4, 2)
-    rect = rect[
-        np.lexsort((rect[:, 0], rect[:, 1]))]  # The contours are now ordered following the y-axis
-    # We take the two topmost points and we order it following the x-axis
-    ordered_corners.extend(rect[0:2][np.lexsort((rect[0:2][:, 1], rect[0:2][:, 0]))])
-    # Now we take the two other points and we order it following the x-axis
-    ordered_corners.extend(rect[-2:][np.lexsort((rect[-2:][:, 1], rect[-2:][:, 0]))])
-    # At this point, ordered contains [NW, NE, SW, SE]
-    return ordered_corners
+    rect = np.asarray(rectangle).reshape(4, 2)
+    # The corners are ordered clockwise (in the image, where the y-axis points downward) around their centre
+    centre = rect.mean(axis=0)
+    rect = rect[np.argsort(np.arctan2(rect[:, 1] - centre[1], rect[:, 0] - centre[0]))]
+    # The northern side is the side that points the most toward the x-axis, so that a slanted rectangle whose
+    #   corners are not sorted along the y-axis (a perspective view of a marker) keeps its orientation
+    sides = np.roll(rect, -1, axis=0) - rect
+    north_west = np.argmax(sides[:, 0] / np.maximum(np.linalg.norm(sides, axis=1), 1e-12))
+    rect = np.roll(rect, -north_west, axis=0)
+    # At this point, rect contains [NW, NE, SE, SW]
+    return [rect[0], rect[1], rect[3], rect[2]]
@@ -0,0 +1,36 @@
+import timeit
+
+import numpy as np
+
+from utils.camera.geom import point_distance, points_distances, normalize, normalize_vectors, vectorize_points
+
+__author__ = 'Anthony Rouneau'
+
+# Run from the root of the repository : PYTHONPATH=src python test/benchmark/geom_kernels.py
+
+
+def benchmark(nb_of_points=2000, repeat=5):
+    """
+    :param nb_of_points: the number of points given to the kernels
+    :type nb_of_points: int
+    :param repeat: the number of timings of each kernel, the best one is kept
+    :type repeat: int
+    Print the time taken by the scalar kernels of geom in a loop and by their array versions
+    """
+    rng = np.random.RandomState(0)
+    points1 = rng.uniform(-100, 100, (nb_of_points, 2))
+    points2 = rng.uniform(-100, 100, (nb_of_points, 2))
+    vectors = vectorize_points(points1, points2)
+    kernels = [("point_distance", lambda: [point_distance(p1, p2) for p1, p2 in zip(points1, points2)],
+                lambda: points_distances(points1, points2)),
+               ("normalize", lambda: [normalize(vector) for vector in vectors],
+                lambda: normalize_vectors(vectors))]
+    for name, loop, array in kernels:
+        loop_time = min(timeit.repeat(loop, number=1, repeat=repeat))
+        array_time = min(timeit.repeat(array, number=1, repeat=repeat))
+        print "%-16s loop : %8.3f ms    array : %8.3f ms    x%.0f" % (name, loop_time * 1e3, array_time * 1e3,
+                                                                        loop_time / array_time)
+
+
+if __name__ == '__main__':
+    benchmark()
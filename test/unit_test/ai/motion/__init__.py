@@ -0,0 +1 @@
+__author__ = 'Anthony Rouneau'
\ No newline at end of file
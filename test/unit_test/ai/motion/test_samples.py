@@ -0,0 +1,45 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ai.motion.samples import SampleWriter, load_samples, SAMPLE_DTYPE
+
+__author__ = 'Anthony Rouneau'
+
+
+class SampleWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def append(self, writer, i):
+        writer.append(i % 7, i, -i, np.arange(8) + i, [0.1 * i, 0.2, 0.3, 0.4, 0.5])
+
+    def test_write_and_load(self):
+        writer = SampleWriter(self.directory, chunk_size=5, initial_capacity=2)
+        for i in range(12):
+            self.append(writer, i)
+        # The two full chunks are written, the other samples wait for the end of the session
+        self.assertEqual([5, 5], [len(chunk) for chunk in load_samples(self.directory)])
+        writer.flush()
+        # A new session appends its samples to the ones of the previous sessions
+        writer = SampleWriter(self.directory, chunk_size=5)
+        self.append(writer, 12)
+        writer.flush()
+        chunks = load_samples(self.directory)
+        self.assertEqual([5, 5, 2, 1], [len(chunk) for chunk in chunks])
+        self.assertIsInstance(chunks[0], np.memmap)
+        self.assertEqual(SAMPLE_DTYPE, chunks[0].dtype)
+        samples = np.concatenate(chunks)
+        self.assertEqual(range(12 + 1), samples["head_pitch"].tolist())
+        self.assertEqual([3, 4, 5], samples["hole"][10:].tolist())
+        self.assertTrue(np.allclose([[12, 13], [14, 15], [16, 17], [18, 19]], samples["corners"][12]))
+        self.assertTrue(np.allclose(1.2, samples["arm_angles"][12, 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
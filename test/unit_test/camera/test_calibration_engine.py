@@ -0,0 +1,57 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from camera.calibration_engine import CalibrationEngine, best_values
+
+__author__ = 'Anthony Rouneau'
+
+
+class CalibrationEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        # A white image with a 6x7 grid of black circles, and a few noise circles
+        img = np.full((240, 320, 3), 255, dtype=np.uint8)
+        for row in range(6):
+            for col in range(7):
+                cv2.circle(img, (40 + col * 40, 20 + row * 36), 10, (0, 0, 0), -1)
+        self.images = [img, np.full((240, 320, 3), 255, dtype=np.uint8)]
+        self.radius_values = [(7, 13, 20, 55.), (20, 30, 40, 60.)]
+
+    def test_sweep(self):
+        engine = CalibrationEngine(self.images, processes=1)
+        results = engine.sweep([60], [8., 10., 12.], self.radius_values)
+        self.assertEqual(2 * 3 * 2, len(results))
+        self.assertTrue((results['image'][:6] == 0).all())
+        # No circle can be found on the blank image
+        self.assertTrue((results[results['image'] == 1]['total'] == 0).all())
+        self.assertEqual([], best_values(results[results['image'] == 1], 'param2', only_detected=True))
+        best = results[results['image'] == 0]
+        best = best[best['score'] == best['score'].max()]
+        self.assertEqual(42, best['grid_circles'][0])
+        self.assertEqual(1., best['score'][0])
+        self.assertEqual((7, 13), best_values(results[results['image'] == 0], ['min_radius', 'max_radius'])[0])
+
+    def test_pool_and_cache(self):
+        tasks = CalibrationEngine.buildTasks([0, 1], [60], [10.], self.radius_values)
+        serial = CalibrationEngine(self.images, processes=1).run(tasks)
+        engine = CalibrationEngine(self.images, processes=2)
+        parallel = engine.run(tasks)
+        self.assertTrue((serial == parallel).all())
+        # The results are taken from the cache, even in another order
+        engine.processes = None
+        self.assertTrue((engine.run(tasks[::-1]) == serial[::-1]).all())
+        self.assertEqual(len(tasks), len(engine._cache))
+
+    def test_coarse_to_fine(self):
+        engine = CalibrationEngine(self.images[0:1], processes=1)
+        (param1, param2, min_dist_factor), score = engine.coarseToFine(7, 13, 55., levels=2)
+        self.assertEqual(1., score)
+        results = engine.run(CalibrationEngine.buildTasks([0], [param1], [param2],
+                                                          [(7, 13, int(7 * min_dist_factor), 55.)]))
+        self.assertEqual(42, results['grid_circles'][0])
+        self.assertRaises(ValueError, CalibrationEngine([], processes=1).coarseToFine, 7, 13, 55.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from camera import dataset
+from camera.calibration_engine import CalibrationEngine, preprocess
+
+__author__ = 'Anthony Rouneau'
+
+
+class DatasetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image_files = []
+        for i in range(3):
+            img = np.full((60, 80, 3), 255, dtype=np.uint8)
+            cv2.circle(img, (20 + i * 20, 30), 8, (0, 0, 0), -1)
+            file_name = os.path.join(self.directory, "img_" + str(i) + ".png")
+            cv2.imwrite(file_name, img)
+            self.image_files.append(file_name)
+        self.cache_name = os.path.join(self.directory, "preprocessed")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_cache(self):
+        grays = dataset.load_cache(self.image_files, self.cache_name)
+        self.assertIsInstance(grays, np.memmap)
+        self.assertEqual((3, 60, 80), grays.shape)
+        for i, file_name in enumerate(self.image_files):
+            self.assertTrue((preprocess(cv2.imread(file_name)) == grays[i]).all())
+        engine = CalibrationEngine(grays, processes=1, preprocessed=True)
+        self.assertEqual(3, len(engine.grays))
+
+    def test_invalidation(self):
+        dataset.load_cache(self.image_files, self.cache_name)
+        os.utime(self.cache_name + ".npy", (0, 0))
+        # Neither reloading nor touching a source rebuilds the cache
+        dataset.load_cache(self.image_files, self.cache_name)
+        os.utime(self.image_files[0], None)
+        dataset.load_cache(self.image_files, self.cache_name)
+        self.assertEqual(0, os.stat(self.cache_name + ".npy").st_mtime)
+        # Modifying a source does
+        cv2.imwrite(self.image_files[1], np.zeros((60, 80, 3), dtype=np.uint8))
+        grays = dataset.load_cache(self.image_files, self.cache_name)
+        self.assertTrue((grays[1] == 0).all())
+        self.assertEqual(3, len(dataset.load_cache(self.image_files[:2] + self.image_files[:1], self.cache_name)))
+
+    def test_different_sizes(self):
+        cv2.imwrite(self.image_files[2], np.zeros((30, 80, 3), dtype=np.uint8))
+        self.assertRaises(ValueError, dataset.load_cache, self.image_files, self.cache_name)
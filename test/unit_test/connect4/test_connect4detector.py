@@ -111,7 +111,7 @@ class Connect4DetectorTestCase(unittest.TestCase):
         grid = self.circles_0
         self.circleGridDetector.prepareConnection(grid)
         self.circleGridDetector.connectCircles()
-        result = self.circleGridDetector._original_arc_indices
+        result = map(tuple, self.circleGridDetector._original_arc_indices)
         expected_1 = [(7, 2), (2, 7), (2, 4), (4, 2), (6, 8), (8, 6), (8, 3), (3, 8), (0, 1), (1, 0), (1, 5), (5, 1),
                       (7, 6), (6, 7), (6, 0), (0, 6), (2, 8), (8, 2), (8, 1), (1, 8), (4, 3), (3, 4), (3, 5), (5, 3)]
         self.assertItemsEqual(result, expected_1)
@@ -121,7 +121,7 @@ class Connect4DetectorTestCase(unittest.TestCase):
         expected_1 = [(3, 0), (0, 3), (0, 4), (4, 0), (4, 1), (1, 4), (1, 2), (2, 1)]
         self.circleGridDetector.prepareConnection(grid)
         self.circleGridDetector.connectCircles()
-        result = self.circleGridDetector._original_arc_indices
+        result = map(tuple, self.circleGridDetector._original_arc_indices)
         self.assertItemsEqual(result, expected_1)
 
     def test_connect_keypoints_missing_noise(self):
@@ -130,17 +130,27 @@ class Connect4DetectorTestCase(unittest.TestCase):
                       (5, 0), (0, 5), (6, 4), (4, 6), (3, 7), (7, 3), (7, 4), (4, 7)]
         self.circleGridDetector.prepareConnection(grid)
         self.circleGridDetector.connectCircles()
-        result = self.circleGridDetector._original_arc_indices
+        result = map(tuple, self.circleGridDetector._original_arc_indices)
         self.assertItemsEqual(result, expected_1)
 
+    def test_coordinates_to_indices(self):
+        keypoints = np.float32([(10.5, 20.), (30., 40.), (5., 5.), (30., 40.)])
+        kept_indices = np.array([0, 1, 3])
+        # The noisy centre (5, 5) and the coordinates of no circle, smaller or greater than every centre, do not match
+        points = np.float32([(30., 40.), (10.5, 20.), (5., 5.), (1., 1.), (50., 50.), (10.5, 20.5)])
+        self.assertEqual([3, 0, -1, -1, -1, -1],
+                         CircleGridDetector._coordinatesToIndices(points, keypoints, kept_indices).tolist())
+        self.assertEqual([-1], CircleGridDetector._coordinatesToIndices(points[0:1], keypoints,
+                                                                        np.zeros(0, np.intp)).tolist())
+
     def test_filter_connection_perfect(self):
         grid = self.circles_0
         self.circleGridDetector.prepareConnection(grid)
         self.circleGridDetector.connectCircles()
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0.33, min_similar_vectors=4)
         self.circleGridDetector.filterConnections()
-        expected = self.circleGridDetector._original_arc_indices
-        result = self.circleGridDetector._filtered_arc_indices
+        expected = map(tuple, self.circleGridDetector._original_arc_indices)
+        result = map(tuple, self.circleGridDetector._filtered_arc_indices)
         self.assertItemsEqual(result, expected)
 
     def test_filter_connection_missing(self):
@@ -149,8 +159,8 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.connectCircles()
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0.33, min_similar_vectors=2)
         self.circleGridDetector.filterConnections()
-        expected = self.circleGridDetector._original_arc_indices
-        result = self.circleGridDetector._filtered_arc_indices
+        expected = map(tuple, self.circleGridDetector._original_arc_indices)
+        result = map(tuple, self.circleGridDetector._filtered_arc_indices)
         self.assertItemsEqual(result, expected)
 
     def test_filter_connection_missing_noise(self):
@@ -159,8 +169,8 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.connectCircles()
         self.circleGridDetector.prepareFiltering(pixel_error_margin=1., min_similar_vectors=2)
         self.circleGridDetector.filterConnections()
-        expected = self.circleGridDetector._original_arc_indices
-        result = self.circleGridDetector._filtered_arc_indices
+        expected = map(tuple, self.circleGridDetector._original_arc_indices)
+        result = map(tuple, self.circleGridDetector._filtered_arc_indices)
         expected.remove((0, 6))
         expected.remove((6, 0))
         expected.remove((6, 4))
@@ -178,7 +188,8 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0.1, min_similar_vectors=2)
         self.circleGridDetector.filterConnections()
         self.circleGridDetector.filterRightUpVectors()
-        result = [self.circleGridDetector._right_vectors, self.circleGridDetector._up_vectors]
+        result = [map(tuple, self.circleGridDetector._right_vectors),
+                  map(tuple, self.circleGridDetector._up_vectors)]
         expected = [[(7, 2), (2, 4), (6, 8), (8, 3), (0, 1), (1, 5)], [(6, 0), (7, 6), (8, 1), (2, 8), (3, 5), (4, 3)]]
         self.assertItemsEqual(result[0], expected[0])
         self.assertItemsEqual(result[1], expected[1])
@@ -190,7 +201,8 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0.1, min_similar_vectors=2)
         self.circleGridDetector.filterConnections()
         self.circleGridDetector.filterRightUpVectors()
-        result = [self.circleGridDetector._right_vectors, self.circleGridDetector._up_vectors]
+        result = [map(tuple, self.circleGridDetector._right_vectors),
+                  map(tuple, self.circleGridDetector._up_vectors)]
         expected = [[(3, 0), (4, 1)], [(0, 4), (1, 2)]]
         self.assertItemsEqual(result[0], expected[0])
         self.assertItemsEqual(result[1], expected[1])
@@ -202,7 +214,8 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0.1, min_similar_vectors=2)
         self.circleGridDetector.filterConnections()
         self.circleGridDetector.filterRightUpVectors()
-        result = [self.circleGridDetector._right_vectors, self.circleGridDetector._up_vectors]
+        result = [map(tuple, self.circleGridDetector._right_vectors),
+                  map(tuple, self.circleGridDetector._up_vectors)]
         expected = [[(7, 4), (4, 1)], [(3, 7), (1, 2)]]
         self.assertItemsEqual(result[0], expected[0])
         self.assertItemsEqual(result[1], expected[1])
@@ -213,7 +226,7 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.connectCircles()
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0.22, min_similar_vectors=2)
         self.circleGridDetector.doublePassFilter()
-        result = self.circleGridDetector._filtered_arc_indices
+        result = map(tuple, self.circleGridDetector._filtered_arc_indices)
         expected = [(3, 7), (7, 3), (4, 1), (1, 4), (1, 2), (2, 1), (4, 7), (7, 4)]
         self.assertItemsEqual(expected, result)
 
@@ -223,7 +236,7 @@ class Connect4DetectorTestCase(unittest.TestCase):
         self.circleGridDetector.connectCircles()
         self.circleGridDetector.prepareFiltering(pixel_error_margin=0, min_similar_vectors=2)
         self.circleGridDetector.doublePassFilter()
-        result = self.circleGridDetector._filtered_arc_indices
+        result = map(tuple, self.circleGridDetector._filtered_arc_indices)
         expected = [(3, 6), (6, 3), (3, 0), (0, 3), (0, 4), (4, 0), (4, 1), (1, 4), (1, 2), (2, 1), (4, 6), (6, 4)]
         self.assertItemsEqual(expected, result)
 
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from connect4 import connect4handler
+from connect4.connect4handler import Connect4Handler, save_hough_parameters, DEFAULT_HOUGH_PARAMETERS, \
+    DEFAULT_SLOPED_HOUGH_PARAMETERS
+from nao import data
+from nao.simulator import SimulatedRobot
+from utils.camera import geom
+
+__author__ = 'Anthony Rouneau'
+
+
+class FakeMarker(object):
+    def __init__(self, marker_id, contours):
+        self.id = marker_id
+        self.contours = contours
+        self.center = contours.mean(axis=0)
+
+
+class Connect4HandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, "hough_parameters.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_default_hough_parameters(self):
+        handler = Connect4Handler(None)
+        self.assertEqual(DEFAULT_HOUGH_PARAMETERS, handler.getHoughParameters(1.0, False))
+        self.assertEqual(DEFAULT_SLOPED_HOUGH_PARAMETERS, handler.getHoughParameters(1.0, True))
+
+    def test_tuned_hough_parameters(self):
+        save_hough_parameters(self.file_name, 0.5, False, 60, 10.5, 2.0, 0.9)
+        save_hough_parameters(self.file_name, 1.5, False, 80, 8.25, 2.5)
+        save_hough_parameters(self.file_name, 0.5, False, 65, 10., 2.2, 0.95)  # Replaces the first one
+        handler = Connect4Handler(None, hough_parameters_file=self.file_name)
+        self.assertEqual((65, 10., 2.2), handler.getHoughParameters(0.4, False))
+        self.assertEqual((80, 8.25, 2.5), handler.getHoughParameters(1.2, False))
+        self.assertEqual(DEFAULT_SLOPED_HOUGH_PARAMETERS, handler.getHoughParameters(1.2, True))
+        handler.prepareFrontHolesDetection(1.2, False, 320)
+        self.assertEqual((80, 8.25), (handler.param1, handler.param2))
+        self.assertEqual(int(handler.min_radius * 2.5), handler.min_dist)
+
+    def test_detection_after_distance_change(self):
+        robot = SimulatedRobot(board_distance=0.8)
+        robot.awake = True
+        robot.joints["HeadPitch"] = 0.2
+        img = robot.render(0)
+        handler = Connect4Handler(None)
+        handler.prepareFrontHolesDetection(0.5, False, 320)
+        # The parameters prepared for another distance must not prevent the detection
+        rvec, tvec = handler.estimateBoardPoseUsingFrontHoles(img, 1.0, False, data.CAM_MATRIX,
+                                                              data.CAM_DISTORSION, res=320)
+        self.assertEqual(1.0, handler.distance)
+        self.assertAlmostEqual(robot.getBoardPoseFromCamera(0)[0, 3], tvec[0, 0], delta=0.02)
+
+    def test_hand_positions(self):
+        # The holes aligned in front of the robot, from its left to its right
+        coords = np.zeros((7, 6))
+        coords[:, 0] = np.linspace(0.17, 0.18, 7)
+        coords[:, 1] = np.linspace(0.2, -0.2, 7)
+        hands = Connect4Handler._getHandPositions(coords)
+        # Every hand has the same orientation, the last one included
+        self.assertTrue(np.allclose(hands[0, 3:6], hands[:, 3:6]))
+        self.assertTrue(np.allclose(coords[:, 2] + 0.12, hands[:, 2]))
+
+    def test_follow_markers(self):
+        rng = np.random.RandomState(0)
+        marker_images = dict((i, cv2.resize(rng.randint(0, 256, (8, 8)).astype(np.uint8), (64, 64),
+                                            interpolation=cv2.INTER_NEAREST)) for i in range(7))
+        robot = SimulatedRobot(board_distance=0.2, marker_images=marker_images)
+        robot.awake = True
+        robot.joints["HeadPitch"] = -0.05
+        camera_position = robot.getCameraPosition(1)
+        camera_matrix = robot.camera_matrix * 2.
+        camera_matrix[2, 2] = 1
+        detections = []
+
+        def detect_markers(img):
+            # The Hamming codes entirely visible in the image
+            detections.append(img)
+            board_to_camera = robot.getBoardPoseFromCamera(1)
+            markers = []
+            for i in range(7):
+                corners = cv2.projectPoints(np.array(robot.model.getHamcode(i), dtype=np.float64),
+                                            cv2.Rodrigues(board_to_camera[0:3, 0:3])[0], board_to_camera[0:3, 3],
+                                            camera_matrix, None)[0].reshape(-1, 2)
+                if (corners >= 0).all() and (corners[:, 0] < 640).all() and (corners[:, 1] < 480).all():
+                    markers.append(FakeMarker((i + 1) * 1000, corners))
+            return markers
+
+        def expected_coordinates():
+            board_to_torso = geom.compose_transforms(geom.invert_transform(robot.torsoToWorld()),
+                                                     robot.board_to_world)
+            return handler._getHandPositions(handler.tracker._getUpperHolesCoordinates(board_to_torso))
+
+        def assertPositionsClose(expected, coordinates):
+            # The orientations of the hand may differ by 2 pi
+            self.assertTrue(np.allclose(np.array(expected)[:, 0:3], np.array(coordinates)[:, 0:3], atol=0.005))
+
+        handler = Connect4Handler(lambda camera_num, res: robot.render(camera_num, 320 * res, 240 * res))
+        original_detect_markers = connect4handler.detect_markers
+        connect4handler.detect_markers = detect_markers
+        try:
+            coords = handler.trackUpperHolesCoordinatesUsingMarkers(camera_position, data.CAM_MATRIX, np.zeros(5))
+            self.assertEqual(1, len(detections))
+            assertPositionsClose(expected_coordinates(), coords)
+            # The board moves a little : the markers are followed without being detected again
+            robot.placeBoard(0.21, lateral=0.01)
+            for i in range(5):
+                coords = handler.trackUpperHolesCoordinatesUsingMarkers(camera_position, data.CAM_MATRIX,
+                                                                        np.zeros(5))
+            self.assertEqual(1, len(detections))
+            assertPositionsClose(expected_coordinates(), coords)
+            # The markers are detected again once they are lost
+            robot.marker_images = {}
+            handler.trackUpperHolesCoordinatesUsingMarkers(camera_position, data.CAM_MATRIX, np.zeros(5))
+            self.assertEqual(2, len(detections))
+        finally:
+            connect4handler.detect_markers = original_detect_markers
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from connect4.connect4tracker import Connect4Tracker
+from connect4.model.default_model import DefaultModel
+
+__author__ = 'Anthony Rouneau'
+
+
+class Connect4TrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = DefaultModel()
+        self.tracker = Connect4Tracker(self.model)
+        self.rvec = np.array([[0.1], [-0.3], [0.05]])
+        self.tvec = np.array([[0.02], [0.1], [0.8]])
+        self.camera_position = [0.05, 0.0, 0.2, 0.0, 0.4, 0.1]
+
+    def test_upper_holes_identity(self):
+        # No rotation nor translation : only the change of axes between the camera and NAO is applied
+        result = self.tracker.getUpperHolesCoordinates(np.zeros((3, 1)), np.zeros((3, 1)), [0, 0, 0, 0, 0, 0])
+        for i in range(7):
+            top_left, _, _, bottom_right = self.model.getUpperHole(i)
+            middle = (top_left + bottom_right) / 2
+            expected = [middle[2], -middle[0], -middle[1], 0, 0, 0]
+            for j in range(6):
+                self.assertAlmostEqual(expected[j], result[i][j])
+
+    def test_upper_holes_batch(self):
+        result = self.tracker.getUpperHolesCoordinates(self.rvec, self.tvec, self.camera_position)
+        self.assertEqual((7, 6), result.shape)
+        for i in range(7):
+            hole = self.tracker.getHoleCoordinates(self.rvec, self.tvec, self.camera_position, i)
+            for j in range(6):
+                self.assertAlmostEqual(hole[j], result[i][j])
+
+    def test_board_pose_cache(self):
+        self.assertFalse(self.tracker.isBoardPoseValid(self.camera_position))
+        self.assertIsNone(self.tracker.getExtrinsicGuess(self.camera_position))
+        self.tracker.updateBoardPose(self.rvec, self.tvec, self.camera_position)
+        self.assertTrue(self.tracker.isBoardPoseValid(self.camera_position))
+        moved_camera = list(self.camera_position)
+        moved_camera[4] += 0.1
+        self.assertFalse(self.tracker.isBoardPoseValid(moved_camera))
+        # The validity is kept for each camera : the bottom camera has not seen the board
+        self.assertFalse(self.tracker.isBoardPoseValid(self.camera_position, camera_num=1))
+        self.tracker.updateBoardPose(self.rvec, self.tvec, self.camera_position, camera_num=1)
+        self.assertTrue(self.tracker.isBoardPoseValid(self.camera_position, camera_num=0))
+        self.assertTrue(self.tracker.isBoardPoseValid(self.camera_position, camera_num=1))
+        # The guess must give back the pose estimation, even from another camera position
+        rvec, tvec = self.tracker.getExtrinsicGuess(moved_camera)
+        expected = self.tracker.getUpperHolesCoordinates(self.rvec, self.tvec, self.camera_position)
+        result = self.tracker.getUpperHolesCoordinates(rvec, tvec, moved_camera)
+        self.assertTrue(np.allclose(expected, result))
+        self.assertTrue(np.allclose(expected, self.tracker.getBoardPoseUpperHolesCoordinates()))
+        self.tracker.resetBoardPose()
+        self.assertFalse(self.tracker.isBoardPoseValid(self.camera_position))
+
+    def test_board_pose_fusion(self):
+        # With a camera aligned with the torso, the camera x axis is the opposite of the torso y axis
+        self.camera_position = [0, 0, 0, 0, 0, 0]
+        self.tracker.updateBoardPose(self.rvec, self.tvec, self.camera_position)
+        first = self.tracker.getBoardPoseUpperHolesCoordinates()
+        # A close estimation is averaged with the kept pose
+        self.tracker.updateBoardPose(self.rvec, self.tvec + np.array([[0.02], [0], [0]]), self.camera_position)
+        fused = self.tracker.getBoardPoseUpperHolesCoordinates()
+        self.assertTrue(np.allclose(first[:, 1] - 0.01, fused[:, 1]))
+        # A far estimation replaces the kept pose
+        self.tracker.updateBoardPose(self.rvec, self.tvec + np.array([[0.5], [0], [0]]), self.camera_position)
+        replaced = self.tracker.getBoardPoseUpperHolesCoordinates()
+        self.assertTrue(np.allclose(first[:, 1] - 0.5, replaced[:, 1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
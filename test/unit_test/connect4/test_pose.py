@@ -0,0 +1,49 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from connect4.detector.pose import PoseEstimator
+from connect4.detector.upper_hole import NotEnoughLandmarksException
+from connect4.model.default_model import DefaultModel
+
+__author__ = 'Anthony Rouneau'
+
+
+class PoseEstimatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = DefaultModel()
+        self.estimator = PoseEstimator()
+        self.camera_matrix = np.array([[300., 0, 160], [0, 300., 120], [0, 0, 1]])
+        self.camera_dist = np.zeros(5)
+        self.rvec = np.array([[0.1], [-0.2], [0.05]])
+        self.tvec = np.array([[-0.1], [-0.05], [0.9]])
+
+    def project(self, object_points):
+        projected, _ = cv2.projectPoints(object_points, self.rvec, self.tvec, self.camera_matrix, self.camera_dist)
+        return projected.reshape(-1, 2)
+
+    def test_fused_solve(self):
+        front_holes = np.array(self.model.three_d[self.model.FRONT_HOLES], dtype=np.float64)
+        hamcodes = np.array([corner for i in range(3) for corner in self.model.getHamcode(i)], dtype=np.float64)
+        image_points = self.project(front_holes)
+        image_points[0:3] += 40  # Wrong correspondences, that must be rejected
+        self.estimator.addCorrespondences(front_holes, image_points)
+        self.estimator.addCorrespondences(hamcodes, self.project(hamcodes))
+        self.assertEqual(42 + 12, self.estimator.countCorrespondences())
+        rvec, tvec, error = self.estimator.solve(self.camera_matrix, self.camera_dist)
+        self.assertTrue(np.allclose(self.rvec, rvec, atol=1e-3))
+        self.assertTrue(np.allclose(self.tvec, tvec, atol=1e-3))
+        self.assertLess(error, 0.1)
+        self.assertNotIn(0, self.estimator.inliers)
+
+    def test_not_enough_correspondences(self):
+        hamcode = np.array(self.model.getHamcode(0), dtype=np.float64)
+        self.estimator.addCorrespondences(hamcode, self.project(hamcode))
+        self.assertRaises(NotEnoughLandmarksException, self.estimator.solve, self.camera_matrix, self.camera_dist)
+        self.estimator.clear()
+        self.assertEqual(0, self.estimator.countCorrespondences())
+
+
+if __name__ == '__main__':
+    unittest.main()
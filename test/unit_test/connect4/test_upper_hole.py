@@ -0,0 +1,77 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from connect4.detector.upper_hole import UpperHolesDetector, ROTATED_CORNERS
+from connect4.model.default_model import DefaultModel
+from nao import data
+
+__author__ = 'Anthony Rouneau'
+
+
+class FakeMarker(object):
+    def __init__(self, marker_id, contours):
+        self.id = marker_id
+        self.contours = np.array(contours, dtype=np.float64)
+        self.center = self.contours.mean(axis=0)
+
+
+class UpperHolesDetectorTestCase(unittest.TestCase):
+    def test_hamcode_corners_sorted_without_rectangles(self):
+        model = DefaultModel()
+        detector = UpperHolesDetector(model)
+        # hampy gives the corners in a cyclic order
+        marker = FakeMarker(1000, [[10, 10], [10, 40], [40, 40], [40, 10]])
+        detector.runDetection([], [marker])
+        self.assertTrue(np.allclose([[10, 10], [40, 10], [10, 40], [40, 40]], marker.contours))
+        object_points, image_points = detector.getCorrespondences(res=320)
+        self.assertTrue(np.allclose(model.getHamcode(0), object_points))
+        self.assertTrue(np.allclose([[10, 10], [40, 10], [10, 40], [40, 40]], image_points))
+
+    def test_match_codes_rotated_in_image(self):
+        model = DefaultModel()
+        detector = UpperHolesDetector(model)
+        # The camera in front of the codes, rolled so that they are seen rotated by 70 degrees
+        facing = cv2.Rodrigues(np.array([np.pi / 2, 0., 0.]))[0]
+        rolled = cv2.Rodrigues(np.array([0., 0., np.radians(70)]))[0]
+        rvec = cv2.Rodrigues(np.dot(rolled, facing))[0].ravel()
+        tvec = np.array([-0.05, 0.15, 0.4])
+        markers = []
+        for i in (2, 3, 4):
+            corners = cv2.projectPoints(np.array(model.getHamcode(i), dtype=np.float64), rvec, tvec,
+                                        data.CAM_MATRIX, None)[0].reshape(-1, 2)
+            markers.append(FakeMarker((i + 1) * 1000, corners[[0, 1, 3, 2]] * 2))
+        detector.runDetection([], markers)
+        found_rvec, found_tvec = detector.match3DModel(data.CAM_MATRIX, None)
+        self.assertTrue(np.allclose(rvec, found_rvec.ravel(), atol=1e-3))
+        self.assertTrue(np.allclose(tvec, found_tvec.ravel(), atol=1e-3))
+        # The corners are kept in the order of the model for the next correspondences
+        object_points, image_points = detector.getCorrespondences()
+        projected = cv2.projectPoints(object_points, rvec, tvec, data.CAM_MATRIX, None)[0].reshape(-1, 2)
+        self.assertTrue(np.allclose(projected, image_points, atol=1e-3))
+
+    def test_match_codes_labeled_differently(self):
+        model = DefaultModel()
+        detector = UpperHolesDetector(model)
+        rvec = np.array([np.pi / 2 + 0.3, 0.4, 0.])
+        tvec = np.array([-0.1, 0.1, 0.35])
+        markers = []
+        for i in (1, 2, 3, 4):
+            corners = cv2.projectPoints(np.array(model.getHamcode(i), dtype=np.float64), rvec, tvec,
+                                        data.CAM_MATRIX, None)[0].reshape(-1, 2)
+            markers.append(FakeMarker((i + 1) * 1000, corners * 2))
+        detector.runDetection([], markers)
+        # Seen at a steep angle, the corners of each code can be labeled with a different rotation
+        for marker, rotation in zip(markers, [1, 1, 0, 3]):
+            marker.contours = np.array(marker.contours)[ROTATED_CORNERS[rotation]]
+        found_rvec, found_tvec = detector.match3DModel(data.CAM_MATRIX, None)
+        self.assertTrue(np.allclose(rvec, found_rvec.ravel(), atol=1e-3))
+        self.assertTrue(np.allclose(tvec, found_tvec.ravel(), atol=1e-3))
+        object_points, image_points = detector.getCorrespondences()
+        projected = cv2.projectPoints(object_points, rvec, tvec, data.CAM_MATRIX, None)[0].reshape(-1, 2)
+        self.assertTrue(np.allclose(projected, image_points, atol=1e-3))
+
+
+if __name__ == '__main__':
+    unittest.main()
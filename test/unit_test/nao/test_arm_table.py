@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import nao.proxy as proxy
+from nao.controller.arm_table import fit_arm_table, load_arm_table
+from nao.controller.motion import MotionController, LARM_JOINTS
+
+__author__ = 'Anthony Rouneau'
+
+
+def sample(x, y, z, angles):
+    return [x, y, z, -1.5, 0., -0.5] + list(angles)
+
+
+class ArmMotion(object):
+    """
+    Keeps the calls made to ALMotion with their arguments
+    """
+    def __init__(self):
+        self.calls = []
+
+    def robotIsWakeUp(self):
+        return True
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class ArmLookupTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.samples = np.array([sample(0.2, 0.1, 0.12, [0., 0.1, -1., -0.5, 0.]),
+                                 sample(0.2001, 0.1, 0.12, [0., 0.3, -1., -0.5, 0.]),
+                                 sample(0.2, 0.11, 0.12, [0.1, 0.2, -1., -0.5, 0.]),
+                                 sample(0.2, 0.2, 0.12, [1., 1., -1., -0.5, 0.])])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        proxy.set_backend(None)
+
+    def test_query(self):
+        table = fit_arm_table(self.samples, LARM_JOINTS, max_distance=0.02)
+        # The two first samples are merged
+        self.assertEqual(3, len(table))
+        self.assertTrue(np.allclose([0., 0.2, -1., -0.5, 0.], table.query([0.20005, 0.1, 0.12]), atol=1e-5))
+        # Halfway between two learned positions, the third one is too far to take part in the interpolation
+        self.assertTrue(np.allclose([0.05, 0.2, -1., -0.5, 0.], table.query(sample(0.20005, 0.105, 0.12, [])),
+                                    atol=1e-3))
+        self.assertIsNone(table.query([0.2, 0.15, 0.12]))
+        # The learned angles do not place the hand with another rotation
+        self.assertIsNone(table.query([0.2, 0.1, 0.12, -1.5, 0., 0.3]))
+        self.assertIsNotNone(table.query([0.2, 0.1, 0.12, -1.5 + 2 * np.pi, 0.05, -0.5]))
+        file_name = os.path.join(self.directory, "table.npz")
+        table.save(file_name)
+        loaded = load_arm_table(file_name)
+        self.assertEqual(LARM_JOINTS, loaded.joint_names)
+        self.assertEqual(table.query([0.2, 0.2, 0.12]), loaded.query([0.2, 0.2, 0.12]))
+        self.assertIsNone(loaded.query([0.2, 0.2, 0.12, 0., 0., 0.]))
+
+    def test_motion_uses_table(self):
+        file_name = os.path.join(self.directory, "table.npz")
+        fit_arm_table(self.samples, LARM_JOINTS).save(file_name)
+        motion = ArmMotion()
+        proxy.set_backend(lambda module_name, robot_ip, robot_port: motion)
+        nao_motion = MotionController(arm_table_file=file_name)
+        del motion.calls[:]
+        nao_motion.setLeftHandPosition(sample(0.2, 0.2, 0.12, [])[0:6], mask=63, time_limit=1.)
+        self.assertEqual("angleInterpolation", motion.calls[-1][0])
+        self.assertEqual(LARM_JOINTS, motion.calls[-1][1])
+        # The positions unknown by the table and the partial positions are given to the Cartesian solver
+        nao_motion.setLeftHandPosition(sample(0.3, 0.2, 0.12, [])[0:6], mask=63)
+        nao_motion.setLeftHandPosition(sample(0.2, 0.2, 0.12, [])[0:6], mask=7)
+        nao_motion.setLeftHandPosition([0.2, 0.2, 0.12, -1.5, 0., 0.3], mask=63)
+        self.assertEqual(["positionInterpolations"] * 3, [call[0] for call in motion.calls[-3:]])
+
+
+if __name__ == '__main__':
+    unittest.main()
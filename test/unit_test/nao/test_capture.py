@@ -0,0 +1,105 @@
+import time
+import unittest
+
+import numpy as np
+
+from nao.controller.capture import CaptureThread, FrameRingBuffer, ReplayVideoDevice, decode_image, encode_image
+
+__author__ = 'Anthony Rouneau'
+
+
+class CaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.images = [np.full((24, 32, 3), i, dtype=np.uint8) for i in range(5)]
+
+    def test_encode_decode(self):
+        img = np.arange(24 * 32 * 3, dtype=np.uint8).reshape((24, 32, 3))
+        nao_image = encode_image(img, timestamp=12.5)
+        self.assertEqual([32, 24, 3, 13, 12, 500000], nao_image[:6])
+        self.assertTrue((decode_image(nao_image) == img).all())
+        out = np.zeros_like(img)
+        self.assertIs(out, decode_image(nao_image, out))
+        self.assertTrue((out == img).all())
+
+    def test_ring_buffer(self):
+        ring_buffer = FrameRingBuffer(3)
+        self.assertIsNone(ring_buffer.latest())
+        self.assertIsNone(ring_buffer.nextAfter(0, timeout=0.01))
+        for i, img in enumerate(self.images):
+            ring_buffer.put(img, float(i))
+        slots = ring_buffer._frames
+        timestamp, frame = ring_buffer.latest()
+        self.assertEqual(4., timestamp)
+        self.assertEqual(4, frame[0, 0, 0])
+        # The slots are allocated once, and the consumers get their own copy
+        frame[:] = 42
+        ring_buffer.put(self.images[0], 5.)
+        self.assertIs(slots, ring_buffer._frames)
+        # The newest frame is returned, even if older ones were also taken after the timestamp
+        timestamp, frame = ring_buffer.nextAfter(3.)
+        self.assertEqual((5., 0), (timestamp, frame[0, 0, 0]))
+        self.assertIsNone(ring_buffer.nextAfter(5., timeout=0.01))
+        ring_buffer.close()
+        self.assertEqual([5.], [frame[0] for frame in ring_buffer.frames()])
+
+    def test_capture_thread(self):
+        device = ReplayVideoDevice(self.images, fps=200)
+        subscriber = device.subscribeCamera("C4N", 0, 1, 13, 30)
+
+        def grab():
+            img = device.getImageRemote(subscriber)
+            if img is None:
+                return None
+            return time.time(), decode_image(img)
+
+        reconnections = []
+        capture = CaptureThread(grab, FrameRingBuffer(4), reconnect=lambda: reconnections.append(True),
+                                retry_delay=0.01)
+        capture.start()
+        try:
+            timestamps = []
+            for timestamp, frame in capture.ring_buffer.frames(timeout=1.):
+                timestamps.append(timestamp)
+                if len(timestamps) == 5:
+                    break
+            self.assertEqual(sorted(timestamps), timestamps)
+            self.assertEqual(len(set(timestamps)), 5)
+            self.assertTrue(capture.connected)
+            # The consumer does not wait for the robot : the latest frame is still served while disconnected
+            device.available = False
+            time.sleep(0.05)
+            self.assertFalse(capture.connected)
+            self.assertGreater(len(reconnections), 0)
+            self.assertIsNotNone(capture.ring_buffer.latest())
+            device.available = True
+            self.assertIsNotNone(capture.ring_buffer.nextAfter(time.time(), timeout=1.))
+        finally:
+            capture.stop(1.)
+        self.assertFalse(capture.is_alive())
+        self.assertTrue(capture.ring_buffer.isClosed())
+
+    def test_capture_on_demand(self):
+        grabbed = []
+
+        def grab():
+            grabbed.append(len(grabbed))
+            return float(len(grabbed)), self.images[len(grabbed) - 1]
+
+        capture = CaptureThread(grab, FrameRingBuffer(2), retry_delay=0.01, on_demand=True)
+        capture.start()
+        try:
+            # No frame is grabbed until a consumer waits for one
+            time.sleep(0.05)
+            self.assertEqual([], grabbed)
+            frames = []
+            for timestamp, frame in capture.ring_buffer.frames(timeout=1.):
+                frames.append(frame[0, 0, 0])
+                time.sleep(0.01)  # The consumer is slower than the capture
+                if len(frames) == len(self.images):
+                    break
+            # Every frame is served, in order
+            self.assertEqual(range(len(self.images)), frames)
+            self.assertEqual(len(self.images), len(grabbed))
+        finally:
+            capture.stop(1.)
+        self.assertFalse(capture.is_alive())
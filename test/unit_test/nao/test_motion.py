@@ -0,0 +1,77 @@
+import unittest
+
+import nao.proxy as proxy
+from nao.controller.motion import MotionController
+from nao.controller.motion_queue import AWAKE, RESTING
+
+__author__ = 'Anthony Rouneau'
+
+
+class PostureMotion(object):
+    """
+    Counts the calls made to ALMotion and keeps the posture of the robot
+    """
+    def __init__(self):
+        self.calls = []
+        self.awake = False
+
+    def robotIsWakeUp(self):
+        self.calls.append("robotIsWakeUp")
+        return self.awake
+
+    def wakeUp(self):
+        self.calls.append("wakeUp")
+        self.awake = True
+
+    def rest(self):
+        self.calls.append("rest")
+        self.awake = False
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append(name)
+
+
+class PostureCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.motion = PostureMotion()
+        proxy.set_backend(lambda module_name, robot_ip, robot_port: self.motion)
+        self.nao_motion = MotionController()
+        del self.motion.calls[:]
+
+    def tearDown(self):
+        proxy.set_backend(None)
+
+    def test_redundant_postures(self):
+        self.nao_motion.moveAt(0.1, 0, 0)
+        self.nao_motion.setLeftHandPosition([0.1, 0.1, 0.1, 0, 0, 0])
+        self.nao_motion.moveAt(0.1, 0, 0)
+        self.assertEqual(["robotIsWakeUp", "wakeUp", "moveTo", "positionInterpolations", "moveTo"],
+                         self.motion.calls)
+        del self.motion.calls[:]
+        self.nao_motion.crouch()
+        self.nao_motion.crouch()
+        self.nao_motion.stiffHead()
+        self.nao_motion.stiffHead()
+        self.assertEqual(["rest", "setStiffnesses", "setStiffnesses"], self.motion.calls)
+        self.assertEqual(RESTING, self.nao_motion.getPosture())
+
+    def test_cache_expiration(self):
+        self.nao_motion.stand()
+        # Someone else made the robot rest
+        self.motion.rest()
+        self.nao_motion.stand()
+        self.assertEqual(["robotIsWakeUp", "wakeUp", "rest"], self.motion.calls)
+        self.nao_motion.POSTURE_CACHE_DURATION = 0.
+        self.nao_motion.stand()
+        self.assertEqual(["robotIsWakeUp", "wakeUp"], self.motion.calls[3:])
+        self.motion.rest()
+        self.nao_motion.invalidatePostureCache()
+        self.nao_motion.POSTURE_CACHE_DURATION = 60.
+        self.assertEqual(RESTING, self.nao_motion.getPosture())
+        self.nao_motion.stand()
+        self.assertEqual(AWAKE, self.nao_motion.getPosture())
+        self.assertEqual(["rest", "robotIsWakeUp", "wakeUp"], self.motion.calls[5:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import threading
+import time
+import unittest
+
+import nao.proxy as proxy
+from nao.controller.motion import MotionController
+from nao.controller.motion_queue import MotionFuture, MotionQueue, AWAKE, RESTING
+
+__author__ = 'Anthony Rouneau'
+
+
+class CountingMotion(object):
+    """
+    Counts the calls made to ALMotion, each one taking some time
+    """
+    def __init__(self, duration=0.):
+        self.duration = duration
+        self.calls = []
+        self.awake = False
+
+    def robotIsWakeUp(self):
+        self.calls.append("robotIsWakeUp")
+        return self.awake
+
+    def wakeUp(self):
+        self.calls.append("wakeUp")
+        time.sleep(self.duration)
+        self.awake = True
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.calls.append(name)
+            time.sleep(self.duration)
+        return call
+
+
+class MotionQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = MotionQueue()
+        self.queue.start()
+
+    def tearDown(self):
+        self.queue.stop(1.)
+
+    def test_order_and_results(self):
+        release = threading.Event()
+        executed = []
+        blocked = self.queue.post(release.wait, (1.,))
+        first = self.queue.post(executed.append, (1,))
+        second = self.queue.post(lambda: executed.append(2) or 2)
+        self.assertFalse(first.done())
+        self.assertEqual(3, self.queue.countPending())
+        release.set()
+        self.assertEqual(2, second.result(1.))
+        self.assertTrue(blocked.done())
+        self.assertEqual([1, 2], executed)
+        self.assertTrue(self.queue.waitUntilIdle(1.))
+
+    def test_failure(self):
+        failed = self.queue.post(lambda: 1 / 0)
+        dependent = self.queue.post(lambda: "executed", after=failed)
+        independent = self.queue.post(lambda: "executed")
+        self.assertRaises(ZeroDivisionError, failed.result, 1.)
+        self.assertRaises(ZeroDivisionError, dependent.result, 1.)
+        self.assertEqual("executed", independent.result(1.))
+
+    def test_coalesce_postures(self):
+        release = threading.Event()
+        self.queue.post(release.wait, (1.,))
+        stand = self.queue.post(lambda: "stand", posture=AWAKE)
+        self.assertIs(stand, self.queue.post(lambda: "wakeUp", posture=AWAKE))
+        self.queue.post(lambda: "move")
+        # A posture command is only redundant right after a command that reaches the same posture
+        self.assertIsNot(stand, self.queue.post(lambda: "stand", posture=AWAKE))
+        crouch = self.queue.post(lambda: "crouch", posture=RESTING)
+        self.assertIsNot(crouch, self.queue.post(lambda: "stand", posture=AWAKE))
+        release.set()
+        self.assertTrue(self.queue.waitUntilIdle(1.))
+        self.assertEqual(1, self.queue.nb_of_coalesced_commands)
+        self.assertEqual(6, self.queue.nb_of_commands)
+
+    def test_done_callback(self):
+        done = []
+        future = MotionFuture.execute(lambda: 3, ())
+        future.addDoneCallback(lambda f: done.append(f.result()))
+        self.assertEqual([3], done)
+
+
+class AsyncMotionControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.motion = CountingMotion(duration=0.05)
+        proxy.set_backend(lambda module_name, robot_ip, robot_port: self.motion)
+        self.nao_motion = MotionController()
+        del self.motion.calls[:]
+
+    def tearDown(self):
+        self.nao_motion.stopMotionQueue(1.)
+        proxy.set_backend(None)
+
+    def test_synchronous_without_queue(self):
+        self.nao_motion.moveAt(0.1, 0, 0)
+        self.assertEqual(["robotIsWakeUp", "wakeUp", "moveTo"], self.motion.calls)
+
+    def test_move_in_background(self):
+        self.nao_motion.startMotionQueue()
+        start = time.time()
+        stand = self.nao_motion.standAsync()
+        walk = self.nao_motion.moveAtAsync(0.1, 0, 0)
+        self.assertLess(time.time() - start, 0.05)
+        self.assertFalse(walk.done())
+        walk.result(1.)
+        # The stand of moveAt is coalesced with the previous one
+        self.assertTrue(stand.done())
+        self.assertEqual(["robotIsWakeUp", "wakeUp", "moveTo"], self.motion.calls)
+        # The synchronous methods wait for the commands posted before them
+        self.nao_motion.lookAtGameBoardAsync(1.0)
+        self.nao_motion.stiffHead()
+        self.assertEqual(["rest", "setStiffnesses", "angleInterpolation", "setStiffnesses"], self.motion.calls[3:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import nao.proxy as proxy
+from nao import recording
+from nao.controller.capture import ReplayVideoDevice
+from nao.controller.motion import MotionController
+from nao.controller.video import VideoController
+
+__author__ = 'Anthony Rouneau'
+
+
+class FakeMotion(object):
+    def __init__(self):
+        self.commands = []
+
+    def getPosition(self, name, frame, use_sensors):
+        return [0.1 * len(self.commands), 0., 0.2, 0., np.float64(0.5), 0.]
+
+    def moveTo(self, x, y, theta):
+        self.commands.append((x, y, theta))
+
+    def __getattr__(self, name):
+        return lambda *args: None
+
+
+class RecordingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.images = [np.full((24, 32, 3), i * 10, dtype=np.uint8) for i in range(5)]
+        self.motion = FakeMotion()
+        proxies = {"ALVideoDevice": ReplayVideoDevice(self.images), "ALMotion": self.motion}
+        proxy.set_backend(lambda module_name, robot_ip, robot_port: proxies[module_name])
+
+    def tearDown(self):
+        proxy.set_backend(None)
+        shutil.rmtree(self.directory)
+
+    def record(self):
+        recorder = recording.start_recording(self.directory, chunk_size=2)
+        nao_video = VideoController()
+        nao_motion = MotionController()
+        nao_video.connectToCamera(camera_num=1)
+        positions = []
+        for i in range(len(self.images)):
+            nao_video.getImageFromCamera(camera_num=1)
+            positions.append(nao_motion.getCameraBottomPositionFromTorso())
+            nao_motion.motion_proxy.moveTo(0.1, 0, 0)
+            time.sleep(0.01)
+        recorder.close()
+        return positions
+
+    def test_record_and_replay(self):
+        positions = self.record()
+        # 5 frames in chunks of 2 frames
+        self.assertEqual(3, len([name for name in os.listdir(self.directory) if name.endswith(".npz")]))
+        self.assertEqual(5, len(self.motion.commands))
+        replay = recording.start_replay(self.directory)
+        nao_video = VideoController()
+        nao_motion = MotionController()
+        nao_video.connectToCamera(camera_num=1)
+        for i, img in enumerate(self.images):
+            self.assertTrue((img == nao_video.getImageFromCamera(camera_num=1)).all())
+            self.assertEqual(positions[i], nao_motion.getCameraBottomPositionFromTorso())
+            nao_motion.motion_proxy.moveTo(0.1, 0, 0)
+        # The robot was not used by the replay
+        self.assertEqual(5, len(self.motion.commands))
+        self.assertEqual(0, replay.countRemainingCalls("ALVideoDevice", "getImageRemote"))
+        # Once the recording is exhausted, the camera is disconnected and the robot does not move anymore
+        self.assertIsNone(nao_video.getImageFromCamera(camera_num=1))
+        self.assertEqual(positions[-1], nao_motion.getCameraBottomPositionFromTorso())
+
+    def test_replay_speed(self):
+        self.record()
+        recording.start_replay(self.directory, speed=1.)
+        nao_video = VideoController()
+        start = time.time()
+        for i in range(len(self.images)):
+            nao_video.getImageFromCamera(camera_num=1)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_replay_on_demand(self):
+        self.record()
+        replay = recording.start_replay(self.directory)
+        nao_video = VideoController()
+        nao_video.connectToCamera(camera_num=1)
+        nao_video.startCapture(camera_num=1)
+        try:
+            # The frames are not grabbed until they are consumed
+            time.sleep(0.05)
+            self.assertEqual(len(self.images), replay.countRemainingCalls("ALVideoDevice", "getImageRemote"))
+            frames = []
+            for timestamp, img in nao_video.frames(camera_num=1):
+                frames.append(img)
+                time.sleep(0.02)  # A slow consumer does not miss any frame
+                if len(frames) == len(self.images):
+                    break
+            for img, frame in zip(self.images, frames):
+                self.assertTrue((img == frame).all())
+        finally:
+            nao_video.stopCapture()
+        self.assertRaises(ValueError, recording.Replay, self.directory, 0.5)
+
+    def test_replay_two_cameras(self):
+        recorder = recording.start_recording(self.directory)
+        nao_video = VideoController()
+        nao_video.connectToCamera(camera_num=0)
+        nao_video.connectToCamera(camera_num=1)
+        recorded = []
+        for i in range(3):
+            nao_video.getImageFromCamera(camera_num=0)
+            recorded.append(nao_video.getImageFromCamera(camera_num=1).copy())
+            time.sleep(0.02)
+        recorder.close()
+        recording.start_replay(self.directory, speed=1.)
+        nao_video = VideoController()
+        nao_video.connectToCamera(camera_num=0)
+        nao_video.connectToCamera(camera_num=1)
+        start = time.time()
+        # The capture of the top camera does not take the frames of the bottom camera
+        nao_video.startCapture(camera_num=0)
+        try:
+            frames = [nao_video.getFrameFromCamera(camera_num=1) for i in range(3)]
+            for img, frame in zip(recorded, frames):
+                self.assertTrue((img == frame.img).all())
+            # The frames are served at the pace of the recording and stamped with the time they were replayed at
+            self.assertGreaterEqual(time.time() - start, 0.04)
+            self.assertTrue(start <= frames[0].timestamp < frames[1].timestamp < frames[2].timestamp <= time.time())
+        finally:
+            nao_video.stopCapture()
@@ -0,0 +1,80 @@
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+import nao.proxy as proxy
+from connect4.connect4tracker import Connect4Tracker
+from connect4.model.default_model import DefaultModel
+from nao import simulator
+from nao.controller.motion import MotionController
+from nao.controller.video import VideoController
+from nao.proxy import create_proxy
+from utils.camera import geom
+
+__author__ = 'Anthony Rouneau'
+
+
+def count_board_pixels(img):
+    return np.count_nonzero(np.all(img == simulator.FRONT_FACE_COLOR, axis=2))
+
+
+class SimulatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.robot = simulator.start_simulator(board_distance=0.8)
+
+    def tearDown(self):
+        proxy.set_backend(None)
+
+    def test_render_board(self):
+        nao_motion = MotionController()
+        nao_video = VideoController()
+        nao_motion.stand()
+        nao_motion.moveHead(0.2, 0, radians=True)
+        nao_video.connectToCamera(res=1, fps=0, camera_num=0)
+        img = nao_video.getImageFromCamera(camera_num=0)
+        self.assertEqual((240, 320, 3), img.shape)
+        far_pixels = count_board_pixels(img)
+        self.assertGreater(far_pixels, 0)
+        # The board is bigger once the robot walked toward it
+        nao_motion.moveAt(0.3, 0, 0)
+        self.assertGreater(count_board_pixels(nao_video.getImageFromCamera(camera_num=0)), far_pixels)
+        # The board leaves the field of view when the robot turns
+        nao_motion.moveAt(0, 0, np.pi / 2)
+        self.assertEqual(0, count_board_pixels(nao_video.getImageFromCamera(camera_num=0)))
+
+    def test_board_pose_matches_tracker(self):
+        nao_motion = MotionController()
+        nao_motion.moveHead(0.3, -0.2, radians=True)
+        nao_motion.moveAt(0.1, 0.05, 0.1)
+        board_to_camera = self.robot.getBoardPoseFromCamera(1)
+        rvec, _ = cv2.Rodrigues(board_to_camera[0:3, 0:3])
+        tracker = Connect4Tracker(DefaultModel())
+        board_to_torso = tracker.getBoardToTorsoMatrix(rvec, board_to_camera[0:3, 3].reshape(3, 1),
+                                                       nao_motion.getCameraBottomPositionFromTorso())
+        expected = geom.compose_transforms(geom.invert_transform(self.robot.torsoToWorld()),
+                                           self.robot.board_to_world)
+        self.assertTrue(np.allclose(expected, board_to_torso))
+
+    def test_latency(self):
+        self.robot.latency = 0.02
+        nao_tts = create_proxy("ALTextToSpeech")
+        start = time.time()
+        for i in range(3):
+            nao_tts.say("Bonjour")
+        self.assertGreaterEqual(time.time() - start, 0.06)
+        self.assertEqual(["Bonjour"] * 3, nao_tts.sentences)
+
+    def test_memory_events(self):
+        memory = create_proxy("ALMemory")
+        memory.subscribeToEvent("FrontTactilTouched", "callbackObject", "headTouched")
+        self.assertEqual([("callbackObject", "headTouched")], memory.raiseEvent("FrontTactilTouched", 1.))
+        self.assertEqual(1., memory.getData("FrontTactilTouched"))
+        memory.unsubscribeToEvent("FrontTactilTouched", "callbackObject")
+        self.assertEqual([], memory.raiseEvent("FrontTactilTouched", 0.))
+        self.assertRaises(ValueError, create_proxy, "ALLandMarkDetection")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import math
+import unittest
+
+import numpy as np
+
+from connect4.model.default_model import DefaultModel
+from nao import data
+from prototype.head_scan import HeadScanPlanner, cover, SEARCH_DISTANCES, BOTTOM_CAMERA, HEAD_PITCH_LIMITS
+from utils.camera import geom
+
+__author__ = 'Anthony Rouneau'
+
+
+class HeadScanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.model = DefaultModel()
+        self.planner = HeadScanPlanner(self.model, data.CAM_MATRIX)
+        # The board 1 meter in front of the robot, its front face toward the robot
+        self.board_pose = geom.transform_matrix(np.array([[0, 0, -1], [1, 0, 0], [0, -1, 0]], dtype=np.float64),
+                                                np.array([1., -0.25, 0.1]))
+
+    def test_cover(self):
+        self.assertEqual([0.], cover(0., 0.2, 0.5))
+        views = cover(1., 1., 0.5)
+        self.assertEqual(4, len(views))
+        # Every point of the range is seen by a view
+        for point in np.linspace(0., 2., 21):
+            self.assertTrue(any(abs(point - view) <= 0.25 + 1e-9 for view in views))
+        self.assertEqual(1., cover(1., 1., 0.5, centered=True)[0])
+
+    def test_search_without_board_pose(self):
+        views = self.planner.planBoardSearch()
+        self.assertEqual(0., views[0][2])
+        self.assertEqual(SEARCH_DISTANCES, [view[0] for view in views[0:len(SEARCH_DISTANCES)]])
+        # Every distance is searched from each head pose, and the head pose changes as few times as possible
+        head_poses = [(pitch, yaw) for _, pitch, yaw in views]
+        nb_of_head_poses = len(set(head_poses))
+        self.assertEqual(len(SEARCH_DISTANCES) * nb_of_head_poses, len(views))
+        self.assertEqual(nb_of_head_poses - 1, sum(1 for i in range(1, len(views)) if head_poses[i] != head_poses[i - 1]))
+        self.assertLess(nb_of_head_poses, 5)
+        self.assertGreaterEqual(self.planner.getSearchedYawWidth(), 2 * max(abs(pose[1]) for pose in head_poses))
+        # The estimated distance is searched first
+        self.assertEqual(1.3, self.planner.planBoardSearch(distance=1.3)[0][0])
+        landmark_poses = self.planner.planLandmarkSearch(default_pitch=-0.05)
+        self.assertEqual((-0.05, 0.), landmark_poses[0])
+
+    def test_predicted_search(self):
+        self.planner.setBoardPose(self.board_pose, [1., 2., math.pi / 2])
+        front_middle = geom.apply_transform(self.board_pose, self.planner.front_holes_middle.reshape(1, 3))[0]
+        # The robot has not moved : the head looks at the front holes
+        distance, pitch, yaw = self.planner.planBoardSearch([1., 2., math.pi / 2])[0]
+        self.assertAlmostEqual(math.hypot(front_middle[0], front_middle[1]), distance)
+        self.assertTrue(np.allclose(self.planner.getHeadAnglesToward(front_middle), (pitch, yaw)))
+        # The robot walked half of the distance toward the board, then turned to its left
+        position, uncertainty = self.planner.predictPosition(self.planner.front_holes_middle,
+                                                             [1., 2.5, math.pi])
+        self.assertTrue(np.allclose([front_middle[1], 0.5 - front_middle[0], front_middle[2]], position))
+        self.assertGreater(uncertainty, self.planner.position_uncertainty)
+        distance, pitch, yaw = self.planner.planBoardSearch([1., 2.5, math.pi])[0]
+        self.assertLess(yaw, -1.)
+        # The landmarks are searched with the bottom camera first, before the blind search
+        poses = self.planner.planLandmarkSearch([1., 2.5, math.pi / 2], camera_num=BOTTOM_CAMERA)
+        upper_middle = geom.apply_transform(self.board_pose, self.planner.upper_holes_middle.reshape(1, 3))[0]
+        expected_pitch, expected_yaw = self.planner.getHeadAnglesToward(upper_middle - [0.5, 0, 0], BOTTOM_CAMERA)
+        self.assertAlmostEqual(max(expected_pitch, HEAD_PITCH_LIMITS[0]), poses[0][0])
+        self.assertAlmostEqual(expected_yaw, poses[0][1])
+        self.assertIn((0., 0.), poses)
+        # The board was seen crouched : once NAO stands up, the board is lower from its torso
+        self.planner.setBoardPose(self.board_pose, [1., 2., math.pi / 2], torso_height=0.22)
+        position, _ = self.planner.predictPosition(self.planner.front_holes_middle, [1., 2., math.pi / 2],
+                                                   torso_height=0.333)
+        self.assertTrue(np.allclose(front_middle - [0, 0, 0.113], position))
+        self.planner.forgetBoardPose()
+        self.assertEqual((0., 0.), self.planner.planLandmarkSearch()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+import nao.proxy as proxy
+from ai.connect4.strategy.human import Human
+from connect4 import connect4handler
+from connect4.detector.upper_hole import NotEnoughLandmarksException
+from nao import simulator
+from nao.controller.motion import MotionController
+from nao.controller.video import VideoController
+from nao.proxy import create_proxy
+from prototype.loop import LogicalLoop
+from utils.camera import geom
+
+__author__ = 'Anthony Rouneau'
+
+
+class FakeMarker(object):
+    def __init__(self, marker_id, contours):
+        self.id = marker_id
+        self.contours = contours
+        self.center = contours.mean(axis=0)
+
+
+class LogicalLoopTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        marker_images = dict((i, cv2.resize(rng.randint(0, 256, (8, 8)).astype(np.uint8), (64, 64),
+                                            interpolation=cv2.INTER_NEAREST)) for i in range(7))
+        self.robot = simulator.start_simulator(board_distance=0.8, marker_images=marker_images)
+        # The Hamming codes are found where the simulator drew them, as hampy would find them
+        self.original_functions = connect4handler.detect_markers, cv2.imshow, cv2.waitKey
+        connect4handler.detect_markers = lambda img: [FakeMarker(marker_id, corners) for marker_id, corners
+                                                      in self.robot.getVisibleMarkers(1, img.shape[1], img.shape[0])]
+        cv2.imshow = lambda window_name, img: None
+        cv2.waitKey = lambda delay=0: -1
+        self.loop = LogicalLoop(MotionController(), VideoController(), create_proxy("ALTextToSpeech"), lambda: None,
+                                dist=-1, sloped=False, other_strategy=Human, min_detections=1)
+
+    def tearDown(self):
+        self.loop.close()
+        connect4handler.detect_markers, cv2.imshow, cv2.waitKey = self.original_functions
+        proxy.set_backend(None)
+
+    def playColumn(self, column):
+        loop = self.loop
+        # NAO plays the given column instead of a random one
+        loop.strategy.chooseNextAction = lambda state: column
+        # The simulator ignores the stiffness : the head must be stiff whenever it is moved
+        head_stiffnesses = []
+        move_head = loop.nao_motion.moveHeadAsync
+
+        def moveHeadAsync(*args, **kwargs):
+            head_stiffnesses.extend(loop.nao_motion.stiffnesses.get(name, loop.nao_motion.default_stiffness)
+                                    for name in ("HeadPitch", "HeadYaw"))
+            return move_head(*args, **kwargs)
+        loop.nao_motion.moveHeadAsync = moveHeadAsync
+        loop.findGameBoard()
+        self.assertTrue(head_stiffnesses)
+        self.assertTrue(all(stiffness == 1 for stiffness in head_stiffnesses))
+        self.assertGreater(loop.estimated_distance, 0.3)
+        loop.playingRoutine()
+        # NAO dropped one disc, above the hole of the column it played
+        self.assertEqual(1, len(self.robot.drops))
+        self.assertEqual([column], np.nonzero(np.array(loop.game.game_state.board) != -1)[1].tolist())
+        c4_handler = loop.c4_handler
+        board_to_torso = geom.compose_transforms(geom.invert_transform(self.robot.torsoToWorld()),
+                                                 self.robot.board_to_world)
+        hands = np.array(c4_handler._getHandPositions(c4_handler.tracker._getUpperHolesCoordinates(board_to_torso)))
+        expected = geom.apply_transform(self.robot.torsoToWorld(), hands[:, 0:3])[column]
+        self.assertTrue(np.allclose(expected, self.robot.drops[0], atol=0.01))
+
+    def test_playing_routine(self):
+        self.playColumn(4)
+
+    def test_playing_routine_side_column(self):
+        self.playColumn(0)
+
+    def test_upper_hole_coordinates_with_every_landmark(self):
+        loop = self.loop
+        coords = np.arange(42, dtype=np.float64).reshape(7, 6)
+        calls = []
+
+        def markers_not_found(*args, **kwargs):
+            raise NotEnoughLandmarksException("Only one Hamming code is seen")
+
+        def every_landmark(distance, sloped, *args, **kwargs):
+            calls.append(distance)
+            return coords
+        loop.c4_handler.getUpperHoleCoordinatesUsingMarkers = markers_not_found
+        loop.c4_handler.getUpperHolesCoordinatesUsingAllLandmarks = every_landmark
+        # The front holes cannot be found while the distance of the board is unknown
+        self.assertRaises(NotEnoughLandmarksException, loop.getUpperHoleCoordinates, 3)
+        loop.estimated_distance = 0.4
+        self.assertEqual(coords[3].tolist(), loop.getUpperHoleCoordinates(3))
+        self.assertEqual([0.4], calls)
+
+    def test_no_frame_older_than_last_move(self):
+        loop = self.loop
+        self.assertIsNotNone(loop.getNaoImage(1))
+        # No frame was captured since the last move : the latest one, taken before it, is not used
+        loop.nao_video.nextAfter = lambda timestamp=None, camera_num=0, timeout=1.0: None
+        loop.last_move_time = time.time()
+        self.assertIsNone(loop.getNaoImage(1))
+
+    def test_close(self):
+        loop = LogicalLoop(MotionController(), VideoController(), create_proxy("ALTextToSpeech"), lambda: None,
+                           dist=-1, sloped=False, other_strategy=Human, use_pipeline=True)
+        loop.close()
+        self.assertIsNone(loop.pipeline)
+        self.assertFalse(loop.nao_video.isCapturing(0) or loop.nao_video.isCapturing(1))
+        self.assertIsNone(loop.nao_motion.motion_queue)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from connect4.connect4tracker import Connect4Tracker
+from connect4.detector.upper_hole import NotEnoughLandmarksException
+from connect4.model.default_model import DefaultModel
+from nao.controller.capture import FrameRingBuffer
+from prototype.pipeline import DetectionWorker, DualCameraPipeline, TOP_CAMERA, BOTTOM_CAMERA
+
+__author__ = 'Anthony Rouneau'
+
+
+class FakeVideo(object):
+    """
+    Serves the frames put in its ring buffers, as VideoController does when its cameras are captured
+    """
+    def __init__(self):
+        self.ring_buffers = [FrameRingBuffer(), FrameRingBuffer()]
+
+    def nextAfter(self, timestamp=None, camera_num=0, timeout=1.0):
+        return self.ring_buffers[camera_num].nextAfter(timestamp, timeout)
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.video = FakeVideo()
+        self.camera_position = [0, 0, 0, 0, 0, 0]
+        self.threads = []
+
+    def tearDown(self):
+        for worker in self.threads:
+            worker.stop(1.)
+
+    def startWorker(self, camera_num, detect):
+        worker = DetectionWorker(self.video, camera_num, detect, frame_timeout=0.05)
+        worker.start()
+        self.threads.append(worker)
+        return worker
+
+    def test_detection_worker(self):
+        detected = []
+
+        def detect(frame):
+            detected.append(threading.current_thread())
+            if frame.img[0, 0, 0] == 0:
+                raise NotEnoughLandmarksException("No marker")
+            return np.zeros((3, 1)), np.array([[0.], [0.], [frame.img[0, 0, 0]]]), self.camera_position
+
+        worker = self.startWorker(BOTTOM_CAMERA, detect)
+        self.video.ring_buffers[BOTTOM_CAMERA].put(np.full((4, 4, 3), 2, dtype=np.uint8), 10.)
+        result = worker.waitForResult(5., timeout=1.)
+        self.assertEqual(10., result.timestamp)
+        self.assertEqual(2., result.tvec[2, 0])
+        # A failed detection does not replace the last successful one
+        self.video.ring_buffers[BOTTOM_CAMERA].put(np.zeros((4, 4, 3), dtype=np.uint8), 11.)
+        self.assertIsNone(worker.waitForResult(10., timeout=0.2))
+        self.assertEqual(11., worker.latest(successful=False).timestamp)
+        self.assertIsNone(worker.latest(successful=False).rvec)
+        self.assertEqual(10., worker.latest().timestamp)
+        self.assertEqual(2, worker.nb_of_detections)
+        self.assertNotIn(threading.current_thread(), detected)
+
+    def test_detection_error(self):
+        def detect(frame):
+            if frame.img[0, 0, 0] == 0:
+                raise IndexError("Degenerate frame")
+            return np.zeros((3, 1)), np.zeros((3, 1)), self.camera_position
+
+        worker = self.startWorker(TOP_CAMERA, detect)
+        self.video.ring_buffers[TOP_CAMERA].put(np.zeros((4, 4, 3), dtype=np.uint8), 1.)
+        # The error is published as a failed detection and the worker keeps detecting
+        self.assertIsNone(worker.waitForResult(0, timeout=1., successful=False).rvec)
+        self.video.ring_buffers[TOP_CAMERA].put(np.ones((4, 4, 3), dtype=np.uint8), 2.)
+        self.assertEqual(2., worker.waitForResult(0, timeout=1.).timestamp)
+        self.assertTrue(worker.is_alive())
+
+    def test_apply_to_tracker(self):
+        pipeline = DualCameraPipeline(self.video, None, None, None)
+        rvec = np.zeros((3, 1))
+        camera_positions = [[0.05, 0, 0.07, 0, 0, 0], [0.05, 0, 0.04, 0, 0, 0]]
+        for camera_num, z in ((TOP_CAMERA, 1.), (BOTTOM_CAMERA, 1.02)):
+            pipeline.workers[camera_num] = self.startWorker(
+                camera_num, lambda frame, z=z, camera_num=camera_num: (rvec, np.array([[0.], [0.], [z]]),
+                                                                       camera_positions[camera_num]))
+        tracker = Connect4Tracker(DefaultModel())
+        self.video.ring_buffers[TOP_CAMERA].put(np.zeros((4, 4, 3), dtype=np.uint8), 1.)
+        self.assertIsNotNone(pipeline.waitForResult(TOP_CAMERA, 0, timeout=1.))
+        # The results older than the last move are ignored
+        self.assertEqual(0, pipeline.applyTo(tracker, since=2.))
+        self.video.ring_buffers[BOTTOM_CAMERA].put(np.zeros((4, 4, 3), dtype=np.uint8), 3.)
+        self.assertIsNotNone(pipeline.waitForResult(BOTTOM_CAMERA, 0, timeout=1.))
+        self.assertEqual(1, pipeline.applyTo(tracker, since=2.))
+        self.assertTrue(tracker.isBoardPoseValid(camera_positions[BOTTOM_CAMERA], BOTTOM_CAMERA))
+        self.assertFalse(tracker.isBoardPoseValid(camera_positions[TOP_CAMERA], TOP_CAMERA))
+        # A result is fused only once
+        self.assertEqual(0, pipeline.applyTo(tracker, since=2.))
+        self.video.ring_buffers[TOP_CAMERA].put(np.zeros((4, 4, 3), dtype=np.uint8), time.time())
+        self.assertIsNotNone(pipeline.waitForResult(TOP_CAMERA, 3., timeout=1.))
+        self.assertEqual(1, pipeline.applyTo(tracker, since=2.))
+        # The bottom result does not invalidate the top one : each camera keeps its own position
+        self.assertTrue(tracker.isBoardPoseValid(camera_positions[TOP_CAMERA], TOP_CAMERA))
+        self.assertTrue(tracker.isBoardPoseValid(camera_positions[BOTTOM_CAMERA], BOTTOM_CAMERA))
+
+
+if __name__ == '__main__':
+    unittest.main()
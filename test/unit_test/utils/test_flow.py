@@ -0,0 +1,42 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from utils.camera.flow import PointFlowTracker
+
+__author__ = 'Anthony Rouneau'
+
+
+class PointFlowTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        noise = np.random.RandomState(0).randint(0, 256, (60, 80)).astype(np.uint8)
+        self.img = cv2.GaussianBlur(cv2.resize(noise, (320, 240), interpolation=cv2.INTER_NEAREST), (5, 5), 0)
+        self.points = np.array([[80, 60], [160, 120], [240, 180], [100, 200]], dtype=np.float32)
+
+    def test_follow_points(self):
+        flow = PointFlowTracker()
+        self.assertFalse(flow.isTracking())
+        flow.start(self.img, self.points)
+        shifted = cv2.warpAffine(self.img, np.float32([[1, 0, 3], [0, 1, -2]]), (320, 240))
+        ids, points = flow.track(shifted)
+        self.assertEqual([0, 1, 2, 3], ids.tolist())
+        self.assertTrue(np.allclose(self.points + [3, -2], points, atol=0.2))
+        # The points are followed from the last frame
+        ids, points = flow.track(cv2.warpAffine(self.img, np.float32([[1, 0, 5], [0, 1, -3]]), (320, 240)))
+        self.assertTrue(np.allclose(self.points + [5, -3], points, atol=0.2))
+
+    def test_lose_points(self):
+        flow = PointFlowTracker()
+        flow.start(self.img, self.points)
+        occluded = self.img.copy()
+        occluded[100:240, 120:320] = 128
+        ids, points = flow.track(occluded)
+        self.assertEqual([0, 3], ids.tolist())
+        self.assertEqual((2, 2), points.shape)
+        flow.stop()
+        self.assertEqual(0, len(flow.track(self.img)[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
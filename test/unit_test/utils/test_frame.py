@@ -0,0 +1,46 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from camera.calibration_engine import preprocess
+from nao.controller.capture import decode_image, encode_image
+from utils.camera.frame import Frame, as_frame, GRAY_COLOR_SPACE, RGB_COLOR_SPACE
+
+__author__ = 'Anthony Rouneau'
+
+
+class FrameTestCase(unittest.TestCase):
+    def setUp(self):
+        self.img = np.random.RandomState(0).randint(0, 256, (24, 32, 3)).astype(np.uint8)
+
+    def test_views(self):
+        frame = Frame(self.img, timestamp=3.)
+        self.assertIs(self.img, frame.getBGR())
+        gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+        self.assertTrue((gray == frame.getGray()).all())
+        blurred = cv2.medianBlur(cv2.GaussianBlur(gray, (3, 3), 0), 3)
+        self.assertTrue((blurred == frame.getBlurredGray()).all())
+        self.assertTrue((preprocess(self.img) == blurred).all())
+        self.assertTrue((cv2.cvtColor(self.img, cv2.COLOR_BGR2HSV) == frame.getHSV()).all())
+        # The views are computed once and shared
+        self.assertIs(frame.getGray(), frame.getGray())
+        self.assertIs(frame.getBlurredGray(), frame.getBlurredGray())
+        self.assertIs(frame.getHSV(), frame.getHSV())
+        self.assertIs(frame, as_frame(frame))
+        self.assertIsNone(as_frame(None))
+
+    def test_color_spaces(self):
+        frame = Frame(decode_image(encode_image(self.img[:, :, ::-1], color_space=RGB_COLOR_SPACE)), RGB_COLOR_SPACE)
+        self.assertEqual((24, 32, 3), frame.shape)
+        # The image is not copied
+        self.assertFalse(frame.img.flags.owndata)
+        self.assertFalse(frame.img.flags.writeable)
+        self.assertTrue((self.img == frame.getBGR()).all())
+        self.assertTrue((cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY) == frame.getGray()).all())
+        gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+        frame = Frame(decode_image(encode_image(gray, color_space=GRAY_COLOR_SPACE)), GRAY_COLOR_SPACE)
+        self.assertEqual((24, 32), frame.shape)
+        self.assertIs(frame.img, frame.getGray())
+        self.assertEqual((24, 32, 3), frame.getBGR().shape)
+        self.assertRaises(ValueError, Frame, self.img, 9)
@@ -122,9 +122,9 @@ class GeomTestCase(unittest.TestCase):
         vector_1 = transform_vector(self.vector_1, rmat=rot_mat, tvec=tvec)
         vector_2 = transform_vector(self.vector_2, rmat=rot_mat, tvec=tvec)
         vector_3 = transform_vector(self.vector_3, rmat=rot_mat, tvec=tvec)
-        vector_1 = vector_1.tolist()[0]
-        vector_2 = vector_2.tolist()[0]
-        vector_3 = vector_3.tolist()[0]
+        vector_1 = vector_1.tolist()
+        vector_2 = vector_2.tolist()
+        vector_3 = vector_3.tolist()
         for i in range(3):
             self.assertAlmostEqual(np.array([0, 0,  1])[i], vector_1[i], delta=0.0001)
         for i in range(3):
@@ -132,6 +132,107 @@ class GeomTestCase(unittest.TestCase):
         for i in range(3):
             self.assertAlmostEqual(np.array([0, -1, 0])[i], vector_3[i], delta=0.0001)
 
+    def test_homogeneous_transforms(self):
+        rmat = np.asarray(self.test_mat)
+        tvec = np.array([0.5, -1., 2.])
+        transform = transform_matrix(rmat, tvec)
+        points = np.array([self.vector_1, self.vector_2, self.vector_3, [0.3, 0.2, -0.7]], dtype=np.float64)
+        transformed = apply_transform(transform, points)
+        for point, result in zip(points, transformed):
+            self.assertTrue(np.allclose(transform_vector(point, rmat, tvec), result))
+        # Applying a transformation then its inverse gives the identity
+        self.assertTrue(np.allclose(np.eye(4), compose_transforms(invert_transform(transform), transform)))
+        out = np.zeros((len(points), 6))
+        apply_transform(invert_transform(transform), transformed, out=out[:, 0:3])
+        self.assertTrue(np.allclose(points, out[:, 0:3]))
+        self.assertTrue(np.allclose(0, out[:, 3:]))
+
+    def test_rectangle_sum(self):
+        array = np.arange(42).reshape(6, 7)
+        table = summed_area_table(array)
+        for (min_x, min_y, max_x, max_y) in [(0, 0, 6, 5), (2, 1, 4, 3), (3, 3, 3, 3), (0, 5, 6, 5)]:
+            expected = array[min_y:max_y + 1, min_x:max_x + 1].sum()
+            self.assertEqual(expected, rectangle_sum(table, min_x, min_y, max_x, max_y))
+
+    def test_cluster_grid_vectors(self):
+        # Right, left, up and down vectors of a slightly rotated grid, with noise
+        vectors = []
+        for i in range(20):
+            noise = (i % 5 - 2) * 0.5
+            vectors.extend([(60 + noise, 5 - noise), (-60 - noise, -5 + noise),
+                            (-4 + noise, -50 + noise), (4 - noise, 50 - noise)])
+        compactness, labels, centres = cluster_grid_vectors(vectors)
+        self.assertEqual(4, len(centres))
+        self.assertEqual(len(vectors), len(labels))
+        for expected in [(60, 5), (-60, -5), (-4, -50), (4, 50)]:
+            distances = [point_distance(expected, centre) for centre in centres]
+            self.assertLess(min(distances), 2)
+        # Vectors with the same direction must be in the same cluster
+        for i in range(4):
+            self.assertTrue((labels[i::4] == labels[i]).all())
+
+    def test_sort_rectangle_corners(self):
+        expected = [[58.4, 89.], [214.9, 123.9], [43.2, 112.3], [203.8, 149.3]]
+        # A slanted marker seen in perspective : its NE corner is lower than its SW corner
+        for shuffled in [[3, 0, 2, 1], [1, 2, 3, 0], [2, 3, 1, 0]]:
+            corners = sort_rectangle_corners(np.array(expected)[shuffled])
+            self.assertTrue(np.allclose(expected, corners))
+        self.assertTrue(np.allclose([[0, 0], [4, 0], [0, 2], [4, 2]],
+                                    sort_rectangle_corners(np.array([[4, 2], [0, 0], [0, 2], [4, 0]]))))
+
+    def test_get_boxes_info(self):
+        boxes = [sort_rectangle_corners(cv2.boxPoints(rect))
+                 for rect in [((10, 10), (40, 6), 0.), ((50, 20), (5, 30), -30.), ((5, 5), (8, 8), -45.)]]
+        long_vectors, long_norms, short_norms = get_boxes_info(boxes)
+        for i, box in enumerate(boxes):
+            ((long_vector, long_norm), (_, short_norm)) = get_box_info(box)
+            self.assertTrue(np.allclose(long_vector, long_vectors[i]))
+            self.assertAlmostEqual(long_norm, long_norms[i])
+            self.assertAlmostEqual(short_norm, short_norms[i])
+
+    def test_array_kernels(self):
+        rng = np.random.RandomState(42)
+        points1 = rng.uniform(-100, 100, (50, 2))
+        points2 = rng.uniform(-100, 100, (50, 2))
+        points2[0] = points1[0]  # Null vector
+        vectors = vectorize_points(points1, points2)
+        unsigned_vectors = vectorize_points(points1, points2, signed=False)
+        distances = points_distances(points1, points2)
+        normalized = normalize_vectors(vectors[1:])
+        similar = similar_vectors_mask(vectors, vectors[::-1], 40)
+        parallel = parallel_vectors_mask(vectors, vectors[::-1], 0.1)
+        for i in range(len(points1)):
+            self.assertTrue(np.allclose(vectorize(points1[i], points2[i]), vectors[i]))
+            self.assertTrue(np.allclose(vectorize(points1[i], points2[i], signed=False), unsigned_vectors[i]))
+            self.assertAlmostEqual(point_distance(points1[i], points2[i]), distances[i])
+            if i > 0:
+                self.assertTrue(np.allclose(normalize(vectors[i]), normalized[i - 1]))
+            self.assertEqual(are_vectors_similar(vectors[i], vectors[-1 - i], 40), similar[i])
+            if i != 0 and i != len(points1) - 1:
+                self.assertEqual(are_vectors_parallel(vectors[i], vectors[-1 - i], 0.1), parallel[i])
+        self.assertFalse(parallel[0])
+        # One point is broadcast over the array
+        self.assertTrue(np.allclose(points_distances(points1, (0, 0)), np.linalg.norm(points1, axis=1)))
+
+    def test_array_kernels_equivalence(self):
+        rng = np.random.RandomState(0)
+        points1 = rng.uniform(-100, 100, (2000, 2))
+        points2 = rng.uniform(-100, 100, (2000, 2)).astype(np.float32)
+        distances = points_distances(points1, points2)
+        vectors = vectorize_points(points1, points2)
+        self.assertTrue(np.allclose([point_distance(p1, p2) for p1, p2 in zip(points1, points2)], distances))
+        self.assertTrue(np.allclose([vector_distance(vector, (0, 0)) for vector in vectors], vectors_norms(vectors)))
+        self.assertTrue(np.allclose([normalize(vector) for vector in vectors], normalize_vectors(vectors)))
+        # The kernels keep working on 3D points
+        points3d = rng.uniform(-1, 1, (100, 3))
+        self.assertTrue(np.allclose([np.linalg.norm(point) for point in points3d], points_distances(points3d, 0)))
+
+    def test_max_min_tuple(self):
+        circles = [(3, 8, 1), (5, -2, 2), (-1, 4, 3)]
+        self.assertEqual((5, 8), max_tuple(circles))
+        self.assertEqual((-1, -2), min_tuple(circles))
+        self.assertEqual((np.infty, np.infty), min_tuple([]))
+
     # def test_common_area_included(self):
     #     rect1 = ((2.34, 5.56), (12, 5), 45.)
     #     rect2 = ((2.34, 5.56), (5, 2), 45.)